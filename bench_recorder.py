@@ -0,0 +1,68 @@
+import argparse
+import shutil
+import tempfile
+
+from sdr_backends import ReplayDevice, SyntheticDevice, DEVICE_BUFFER_SECONDS
+from sdr_recorder import SDRRecorder, CAPTURE_SETTINGS, SAMPLE_FORMATS, DEFAULT_SAMPLE_FORMAT, DATA_BASE_DIR
+
+# Sample rates tried after the tuner's own, to find where the pipeline gives out
+EXTRA_RATES = [12e6, 16e6, 20e6, 30e6, 40e6]
+
+
+def record(sample_rate, args):
+    """Recording health stats (and compression stats) of one recording at sample_rate."""
+    device = ReplayDevice(args.replay, buffer_seconds=args.device_buffer) if args.replay else SyntheticDevice(buffer_seconds=args.device_buffer)
+    directory = tempfile.mkdtemp(prefix="bench_recorder_", dir=args.directory)
+    try:
+        recorder = SDRRecorder(device, sample_rate * 0.8, sat_name="Bench", mode=args.mode, directory=directory,
+                               sample_rate=sample_rate, sample_format=args.format, compression=args.compression)
+        recorder.start_recording(0, args.seconds)
+        recorder.stop_recording()
+        return recorder.stats.snapshot(), recorder.compression_stats
+    finally:
+        shutil.rmtree(directory)
+
+
+def sustained(stats, sample_rate, seconds):
+    # Every sample of the recording arrived and was written without the producer waiting on the disk
+    return (stats["overflows"] == 0 and stats["dropped_samples"] == 0 and stats["buffer_waits"] == 0
+            and stats["samples"] >= sample_rate * seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Highest sample rate the recorder's producer/consumer path writes without losing data")
+    parser.add_argument("--directory", default=DATA_BASE_DIR, help="where the test recordings are written (and deleted)")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--format", choices=list(SAMPLE_FORMATS), default=DEFAULT_SAMPLE_FORMAT)
+    parser.add_argument("--mode", choices=["single", "dual"], default="single")
+    parser.add_argument("--compression", choices=["zstd", "zlib"], default=None)
+    parser.add_argument("--replay", help="stream this .dat recording instead of synthetic samples")
+    parser.add_argument("--device-buffer", type=float, default=DEVICE_BUFFER_SECONDS, help="seconds of samples the device holds before it overflows")
+    parser.add_argument("--rates", type=float, nargs="+", help="sample rates to try, default the tuner's rates and beyond")
+    parser.add_argument("--all", action="store_true", help="keep going after the first rate that loses data")
+    args = parser.parse_args()
+
+    rates = args.rates or sorted(set(rate for _, rate in CAPTURE_SETTINGS)) + EXTRA_RATES
+    best = None
+    print(f"{'MS/s':>6} {'MB/s':>7} {'write MB/s':>10} {'overflows':>9} {'dropped':>9} {'waits':>5} {'queue':>7} {'read ms':>8} {'ratio':>6}")
+    for sample_rate in rates:
+        stats, compression = record(sample_rate, args)
+        queue = max(stats["queue_high_water"].values())
+        write_rates = [rate for rate in stats["write_mb_per_s"].values() if rate is not None]
+        ratio = f"{compression['ratio']:.2f}" if compression and compression["ratio"] else "-"
+        print(f"{sample_rate / 1e6:6.2f} {stats['throughput_mb_per_s'] or 0:7.1f} {min(write_rates) if write_rates else 0:10.1f} "
+              f"{stats['overflows']:9d} {stats['dropped_samples']:9d} {stats['buffer_waits']:5d} {queue:3d}/{stats['queue_capacity']:<3d} "
+              f"{stats['read_latency_ms']['max']:8.1f} {ratio:>6}")
+        if sustained(stats, sample_rate, args.seconds):
+            best = sample_rate
+        elif not args.all:
+            break
+
+    if best is None:
+        print("No rate was sustained")
+    else:
+        print(f"Max sustained sample rate: {best / 1e6:.2f} MS/s ({args.format}, {args.mode}{', ' + args.compression if args.compression else ''})")
+
+
+if __name__ == "__main__":
+    main()
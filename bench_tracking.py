@@ -0,0 +1,81 @@
+import argparse
+import time
+from datetime import timedelta
+
+import serial
+
+import scheduler
+import tracking
+import trajectory
+from rotator import RotatorWorker
+from rotator_sim import RotatorSimulator
+from tle_catalog import TLECatalog
+
+
+def highest_pass(satellites, observer_location, hours=24):
+    # Highest pass of any satellite in the day after the TLE epochs, where the elements are accurate
+    start_time = min(satellite.epoch.utc_datetime() for satellite in satellites)
+    windows = scheduler.get_viewing_windows(satellites, start_time, start_time + timedelta(hours=hours), observer_location)
+    best = max(windows, key=lambda window: window.quality.max_elevation)
+    return best, best.quality
+
+
+def replay_now(mount_trajectory, start_timestamp, seconds):
+    # The same path shifted in time so that start_timestamp plays now, cut to the given length
+    keep = (mount_trajectory.times >= start_timestamp) & (mount_trajectory.times <= start_timestamp + seconds)
+    times = mount_trajectory.times[keep] - start_timestamp + time.time()
+    return trajectory.MountTrajectory(times, mount_trajectory.unwrapped_azimuths[keep], mount_trajectory.elevations[keep], mount_trajectory.strategy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tracking loop benchmark against the simulated rotator")
+    parser.add_argument("--tle", default="satellites.tle")
+    parser.add_argument("--latitude", type=float, default=37.23)
+    parser.add_argument("--longitude", type=float, default=-80.42)
+    parser.add_argument("--seconds", type=float, default=120, help="length of the replayed pass, centred on culmination")
+    parser.add_argument("--slew-rate", type=float, default=3.0)
+    parser.add_argument("--adc-delay", type=float, default=0.0)
+    parser.add_argument("--noise", type=float, default=0.2)
+    parser.add_argument("--read-timeout", type=float, default=1.0, help="the firmware's Serial.readString timeout")
+    parser.add_argument("--mode", choices=["stream", "upload"], default="stream", help="host-driven MOVE commands or trajectory upload")
+    args = parser.parse_args()
+
+    catalog = TLECatalog.from_file(args.tle, scheduler.ts)
+    observer_location = scheduler.wgs84.latlon(args.latitude, args.longitude)
+    (name, rise_time, set_time, satellite), quality = highest_pass(catalog.satellites(), observer_location)
+    print(f"Replaying {args.seconds:.0f} s of {name} around culmination at {quality.max_elevation:.1f} deg")
+
+    simulator = RotatorSimulator(args.slew_rate, args.adc_delay, args.noise, args.read_timeout)
+    rotator = RotatorWorker(serial.Serial(simulator.port, 9600))
+    try:
+        pass_trajectory = trajectory.compute_pass_trajectory(satellite, observer_location, rise_time, set_time)
+        start_timestamp = max(quality.culmination_time.timestamp() - args.seconds / 2, pass_trajectory.start)
+        mount_trajectory = trajectory.plan_mount_trajectory(pass_trajectory, model=rotator.response_model)
+        # Start on target, as the tracker does after pre-positioning at AOS, then replay from now
+        rotator.move(*mount_trajectory.at(start_timestamp))
+        replay = replay_now(mount_trajectory, start_timestamp, args.seconds)
+        if args.mode == "upload":
+            report = tracking.follow_uploaded_pass(rotator, replay, replay.end)
+        else:
+            report = tracking.track_pass(rotator, replay, replay.end)
+    finally:
+        rotator.close()
+        simulator.close()
+
+    stats = rotator.latency_stats()
+    print(f"Mount path: {mount_trajectory.strategy}")
+    if args.mode == "upload":
+        print(f"Clock syncs: {report['syncs']}, status reports: {report['status_reports']}")
+    else:
+        print(f"Moves: {report['moves']} ({report['corrective_moves']} corrective)")
+    if report["mean_error"] is not None:
+        print(f"Pointing error: mean {report['mean_error']:.2f} deg, max {report['max_error']:.2f} deg")
+    if report["tick_jitter_mean"] is not None:
+        print(f"Loop jitter: mean {report['tick_jitter_mean'] * 1000:.2f} ms, max {report['tick_jitter_max'] * 1000:.2f} ms")
+    if "latency_mean" in stats:
+        print(f"Command latency: mean {stats['latency_mean']:.2f} s, p95 {stats['latency_p95']:.2f} s, max {stats['latency_max']:.2f} s")
+    print(f"Response model: {stats['model']}")
+
+
+if __name__ == "__main__":
+    main()
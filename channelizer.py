@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+# Prototype filter taps per polyphase branch, each output sample costs this many complex MACs per
+# branch whatever the decimation
+TAPS_PER_PHASE = 16
+# The channel's output rate is at least this much wider than its bandwidth, leaving room for the
+# filter's transition band
+OVERSAMPLING = 1.25
+# Kaiser window shape of the prototype filter, about 80 dB stopband
+KAISER_BETA = 8.0
+# Channel bandwidth used when the signal bandwidth isn't known
+DEFAULT_CHANNEL_BANDWIDTH = 100e3
+# Share of the measured extractor throughput a recording may use, the rest covers the other stages
+# sharing the core
+EXTRACTION_MARGIN = 0.7
+
+
+def decimation_for(sample_rate, channel_bandwidth):
+    return max(1, int(sample_rate // (channel_bandwidth * OVERSAMPLING)))
+
+
+def design_prototype(decimation, channel_bandwidth, sample_rate, taps_per_phase=TAPS_PER_PHASE):
+    """Kaiser windowed-sinc low-pass passing channel_bandwidth, unity gain at DC."""
+    length = decimation * taps_per_phase
+    cutoff = channel_bandwidth / 2 / sample_rate
+    n = np.arange(length) - (length - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, KAISER_BETA)
+    return (taps / taps.sum()).astype(np.float32)
+
+
+class ChannelExtractor:
+    """Streams one narrow channel out of a wideband capture: mix the channel to DC, low-pass and decimate.
+
+    The filter is only evaluated at the decimated output instants. Each output is the dot product of
+    the prototype with the last len(taps) mixed samples, which is the polyphase decimator's cost of
+    len(taps) / decimation MACs per input sample, computed for a whole block in one matrix product.
+    Mixer phase and filter history carry over between blocks so block boundaries leave no trace.
+    """
+
+    def __init__(self, frequency, offset, sample_rate, channel_bandwidth=DEFAULT_CHANNEL_BANDWIDTH):
+        self.frequency = frequency
+        self.offset = offset
+        self.sample_rate = sample_rate
+        self.decimation = decimation_for(sample_rate, channel_bandwidth)
+        self.output_rate = sample_rate / self.decimation
+        # Reversed so a window of input samples times the taps is the convolution
+        self.taps = design_prototype(self.decimation, channel_bandwidth, sample_rate)[::-1].copy()
+        self.history = np.zeros(len(self.taps) - 1, dtype=np.complex64)
+        self.phase = 0.0
+        # Mixer phasors from phase 0 for the block length and offset in use, the offset only changes
+        # when the tuner is retuned
+        self.phasors = None
+        self.phasors_key = None
+
+    def mixer(self, length):
+        # Phasors of the next length samples: the table rotated by the phase the last block ended on
+        step = -2 * np.pi * self.offset / self.sample_rate
+        if self.phasors_key != (self.offset, length):
+            self.phasors = np.exp(1j * step * np.arange(length)).astype(np.complex64)
+            self.phasors_key = (self.offset, length)
+        start = np.complex64(np.exp(1j * self.phase))
+        self.phase = (self.phase + step * length) % (2 * np.pi)
+        return self.phasors, start
+
+    def process(self, samples):
+        """Decimated complex64 channel samples for the next block of complex64 wideband samples."""
+        phasors, start = self.mixer(len(samples))
+        mixed = samples * phasors
+        mixed *= start
+
+        signal = np.concatenate((self.history, mixed))
+        if len(signal) < len(self.taps):
+            self.history = signal
+            return np.zeros(0, dtype=np.complex64)
+        windows = sliding_window_view(signal, len(self.taps))[::self.decimation]
+        output = windows @ self.taps
+        # The next output's window starts right after the last one used here
+        self.history = signal[len(output) * self.decimation:]
+        return output.astype(np.complex64)
+
+
+def measure_throughput(channel_bandwidth=DEFAULT_CHANNEL_BANDWIDTH, sample_rate=10e6, block=1024 * 100, seconds=0.5):
+    """Wideband samples per second one ChannelExtractor processes on this machine, in blocks of block samples."""
+    extractor = ChannelExtractor(0.0, sample_rate / 4, sample_rate, channel_bandwidth)
+    rng = np.random.default_rng(0)
+    samples = (rng.standard_normal(2 * block).astype(np.float32) * 0.1).view(np.complex64)
+    extractor.process(samples)
+    processed = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        extractor.process(samples)
+        processed += block
+    return processed / (time.perf_counter() - start)
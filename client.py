@@ -86,12 +86,14 @@ class WiFiManager:
 
     def interpret_command(self, command):
         response = None
-        if command.startswith("add_to_queue"):
+        if command.startswith("add_to_queue") or command.startswith("start_campaign"):
             self.add_to_queue(command)
         elif command.startswith("calibrate_date_time"):
             self.calibrate_date_time(command)
         elif command.startswith("getMeta"):
             self.get_meta(command)
+        elif command.startswith("recording_status"):
+            self.recording_status(command)
         elif command.startswith("get"):
             start_time = time.time()
             self.get_file(command, 104857600)
@@ -99,10 +101,12 @@ class WiFiManager:
             print(f"Time taken to receive file: {end_time - start_time} seconds")
         elif command.startswith("record_fixed"):
             self.send_and_print(command)
-        elif command in ["clear_schedule", "start_tracking", "calibrate", "stop_tracking", "device_get", "set_single_tuner", "set_dual_tuner", "setCord"]:
+        elif command in ["clear_schedule", "start_tracking", "calibrate", "stop_tracking", "device_get", "set_single_tuner", "set_dual_tuner", "setCord", "schedule_status", "stop_campaign", "probe_disk"]:
             self.send_and_print(command)
         elif command.startswith("move"):
             self.send_and_print(command)
+        elif command.startswith("set_schedule_mode") or command.startswith("set_schedule_report") or command.startswith("set_priority") or command.startswith("set_pass_filter") or command.startswith("set_doppler") or command.startswith("set_tracking_mode") or command.startswith("set_sample_format") or command.startswith("set_compression") or command.startswith("set_channelizer") or command.startswith("set_segment_size"):
+            self.send_and_print(command)
         elif command.startswith("setViewingWindow"):
             self.send_and_print(command)
         else:
@@ -142,6 +146,24 @@ class WiFiManager:
         response = self.receive_full_message()
         print(response)
 
+    def recording_status(self, command):
+        self.send_message(command)
+        response = pickle.loads(self.receive_full_message(as_bytes=True))
+        print(f"Recording Status: {'On' if response['is_recording'] else 'Off'}")
+        stats = response["stats"]
+        if stats is None:
+            print("No recording since the slave started")
+            return
+        print(f"{stats['elapsed']:.0f} s, {stats['samples']} samples in {stats['reads']} reads")
+        print(f"Overflows: {stats['overflows']}, dropped samples: {stats['dropped_samples']}, timeouts: {stats['timeouts']}, stream errors: {stats['stream_errors']}")
+        print(f"Buffers waiting to be written: high-water {stats['queue_high_water']} of {stats['queue_capacity']}, {stats['buffer_waits']} waits for a free buffer")
+        print(f"Read latency max {stats['read_latency_ms']['max']:.1f} ms, write latency max {stats['write_latency_ms']['max']:.1f} ms")
+        write_rates = ", ".join(f"channel {channel} {rate:.1f} MB/s" for channel, rate in stats["write_mb_per_s"].items() if rate is not None)
+        if write_rates:
+            print(f"Write speed: {write_rates}")
+        if stats["throughput_mb_per_s"] is not None:
+            print(f"Throughput: {stats['throughput_mb_per_s']:.1f} MB/s")
+
     def get_meta(self, command):
         self.send_message(command)
         response = pickle.loads(self.receive_full_message(as_bytes=True))
@@ -162,6 +184,49 @@ class WiFiManager:
         print(f"Recording Status: {'On' if is_recording else 'Off'}\n")
         print(f"Using directory: {used_dir}\n")
         print(f"Total GB used in directory: {used_space}")
+        if "pass_cache" in response:
+            cache_stats = response["pass_cache"]
+            print(f"Pass cache: {cache_stats['hits']} hits, {cache_stats['partial_hits']} partial hits, {cache_stats['misses']} misses, {cache_stats['entries']} entries")
+        if "schedule_mode" in response:
+            print(f"Schedule mode: {response['schedule_mode']} ({response['schedule_status']})")
+            for mode, seconds in response["schedule_report"].items():
+                print(f"  {mode}: {seconds:.0f} s recorded")
+        if response.get("pass_filter"):
+            pass_filter = response["pass_filter"]
+            print(f"Pass filter: max elevation >= {pass_filter['min_max_elevation']} deg, >= {pass_filter['min_seconds_above_mask']:.0f} s above {pass_filter['elevation_mask']} deg")
+        if response.get("rotator"):
+            rotator = response["rotator"]
+            latency = f", latency mean {rotator['latency_mean']:.2f} s, p95 {rotator['latency_p95']:.2f} s" if "latency_mean" in rotator else ""
+            print(f"Rotator: {rotator['moves']} moves, {rotator['coalesced']} stale targets skipped, {rotator['timeouts']} timeouts, {rotator['errors']} errors{latency}")
+        if response.get("pointing"):
+            pointing = response["pointing"]
+            error = f", pointing error mean {pointing['mean_error']:.2f} deg, max {pointing['max_error']:.2f} deg" if pointing["mean_error"] is not None else ""
+            print(f"Last pass ({pointing['satellite']}): {pointing['moves']} moves, {pointing['corrective_moves']} corrective{error}")
+        if "tracking_mode" in response:
+            print(f"Tracking mode: {response['tracking_mode']}")
+        if "doppler_correction" in response:
+            signal_bandwidth = f", signal bandwidth {response['signal_bandwidth']:.0f} Hz" if response["signal_bandwidth"] else ""
+            print(f"Doppler correction: {'On' if response['doppler_correction'] else 'Off'}{signal_bandwidth}")
+        if "sample_format" in response:
+            print(f"Sample format: {response['sample_format']}")
+        if response.get("disk_probe"):
+            probe = response["disk_probe"]
+            print(f"Drive write speed: {probe['bytes_per_second'] / 1e6:.1f} MB/s{'' if probe['direct'] else ' (buffered)'}")
+        if response.get("disk_probe_status") not in (None, "idle", "done"):
+            print(f"Disk probe: {response['disk_probe_status']}")
+        if "segment_bytes" in response:
+            print(f"Segment size: {response['segment_bytes'] / 1024**2:.0f} MB" if response["segment_bytes"] else "Segment size: one file per pass")
+        if response.get("channelizer") and response["channelizer"]["enabled"]:
+            channelizer = response["channelizer"]
+            wideband = "with" if channelizer["record_wideband"] else "without"
+            throughput = f", {channelizer['extractor_throughput'] / 1e6:.1f} MS/s per extractor" if channelizer.get("extractor_throughput") else ""
+            print(f"Channelizer: {channelizer['channel_bandwidth']:.0f} Hz channels, {wideband} the wideband file{throughput}")
+        if response.get("compression") and response["compression"]["codec"]:
+            compression = response["compression"]
+            print(f"Compression: {compression['codec']} on {compression['workers']} threads")
+            last = compression["last"]
+            if last and last["ratio"]:
+                print(f"Last recording: ratio {last['ratio']:.2f}, {last['cpu_seconds']:.0f} CPU seconds ({last['cpu_share'] * 100:.0f}% of the machine)")
 
         
 
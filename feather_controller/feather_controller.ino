@@ -21,6 +21,17 @@ const int pinStatusElevation = A1;  // Analog pin for Elevation feedback
 float currentAzimuth = 0;
 float currentElevation = 0;
 
+// Uploaded pass trajectory, see encode_trajectory in rotator.py for the frame layout
+const int maxWaypoints = 1024;
+const unsigned long statusInterval = 1000;  // ms between STATUS reports while following
+uint32_t waypointTimes[maxWaypoints];       // ms from the start of the path
+int16_t waypointAzimuths[maxWaypoints];     // tenths of a degree
+int16_t waypointElevations[maxWaypoints];
+int waypointCount = 0;
+bool followingTrajectory = false;
+unsigned long trajectoryStart = 0;          // millis() at the start of the path
+unsigned long lastStatus = 0;
+
 void setup() {
   Serial.begin(9600);
   
@@ -40,6 +51,13 @@ void setup() {
 void loop() {
   if (Serial.available() > 0) {
 
+    // Binary messages are read by length, text commands by Serial.readString()
+    char first = Serial.peek();
+    if (first == 'T') {
+      receiveTrajectory();
+    } else if (first == 'S') {
+      receiveTrajectoryControl();
+    } else {
     String command = Serial.readString();
     if (command.startsWith("calibrate")) {
       calibrate();
@@ -48,10 +66,133 @@ void loop() {
       if (separatorIndex != -1) {
       float desiredAzimuth = command.substring(5, separatorIndex).toFloat();
       float desiredElevation = command.substring(separatorIndex + 1).toFloat();
+        followingTrajectory = false;
         moveMount(desiredAzimuth, desiredElevation);
       }
     }
+    }
+
+  }
+  if (followingTrajectory) {
+    followTrajectory();
+  }
+}
+
+uint16_t crc16(const uint8_t *data, size_t length, uint16_t crc) {
+  // CRC-16/CCITT-FALSE, updated one buffer at a time
+  for (size_t i = 0; i < length; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (int bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+uint32_t readLittleEndian(const uint8_t *bytes, int length) {
+  uint32_t value = 0;
+  for (int i = length - 1; i >= 0; i--) {
+    value = (value << 8) | bytes[i];
+  }
+  return value;
+}
+
+void receiveTrajectory() {
+  // "TRAJ", uint16 count, count x (uint32 ms, int16 az x10, int16 el x10), uint16 CRC-16 of the waypoints
+  uint8_t header[6];
+  if (Serial.readBytes(header, 6) != 6 || memcmp(header, "TRAJ", 4) != 0) {
+    Serial.println("TRAJ ERROR header");
+    return;
+  }
+  int count = readLittleEndian(header + 4, 2);
+  if (count < 2 || count > maxWaypoints) {
+    Serial.println("TRAJ ERROR count");
+    return;
+  }
+  followingTrajectory = false;
+  uint16_t crc = 0xFFFF;
+  uint8_t waypoint[8];
+  for (int i = 0; i < count; i++) {
+    if (Serial.readBytes(waypoint, 8) != 8) {
+      Serial.println("TRAJ ERROR timeout");
+      waypointCount = 0;
+      return;
+    }
+    crc = crc16(waypoint, 8, crc);
+    waypointTimes[i] = readLittleEndian(waypoint, 4);
+    waypointAzimuths[i] = (int16_t)readLittleEndian(waypoint + 4, 2);
+    waypointElevations[i] = (int16_t)readLittleEndian(waypoint + 6, 2);
+  }
+  uint8_t checksum[2];
+  if (Serial.readBytes(checksum, 2) != 2 || readLittleEndian(checksum, 2) != crc) {
+    Serial.println("TRAJ ERROR checksum");
+    waypointCount = 0;
+    return;
+  }
+  waypointCount = count;
+  Serial.print("TRAJ OK ");
+  Serial.println(count);
+}
+
+void receiveTrajectoryControl() {
+  // "SYNC" + int32 ms into the path (negative before it starts) starts or re-times it, "STOP" ends it
+  uint8_t message[4];
+  if (Serial.readBytes(message, 4) != 4) {
+    return;
+  }
+  if (memcmp(message, "SYNC", 4) == 0) {
+    uint8_t elapsed[4];
+    if (Serial.readBytes(elapsed, 4) == 4 && waypointCount > 0) {
+      trajectoryStart = millis() - (int32_t)readLittleEndian(elapsed, 4);
+      followingTrajectory = true;
+    }
+  } else if (memcmp(message, "STOP", 4) == 0) {
+    followingTrajectory = false;
+  }
+}
+
+void followTrajectory() {
+  // One step towards the interpolated waypoint position per call, so serial input is still handled
+  long elapsed = (long)(millis() - trajectoryStart);
+  if (elapsed < 0) {
+    return;
+  }
+  if ((uint32_t)elapsed > waypointTimes[waypointCount - 1]) {
+    followingTrajectory = false;
+    Serial.println("DONE");
+    return;
+  }
+  int i = 0;
+  while (i < waypointCount - 2 && waypointTimes[i + 1] < (uint32_t)elapsed) {
+    i++;
+  }
+  float fraction = (float)(elapsed - (long)waypointTimes[i]) / (float)(waypointTimes[i + 1] - waypointTimes[i]);
+  float targetAzimuth = (waypointAzimuths[i] + fraction * (waypointAzimuths[i + 1] - waypointAzimuths[i])) / 10.0;
+  float targetElevation = (waypointElevations[i] + fraction * (waypointElevations[i + 1] - waypointElevations[i])) / 10.0;
+
+  const int stepDelay = 100;
+  currentAzimuth = readAzimuth();
+  currentElevation = readElevation();
+  if (fabs(currentAzimuth - targetAzimuth) > 1) {
+    int pin = currentAzimuth < targetAzimuth ? pinRight : pinLeft;
+    digitalWrite(pin, HIGH);
+    delay(stepDelay);
+    digitalWrite(pin, LOW);
+  } else if (fabs(currentElevation - targetElevation) > 1) {
+    int pin = currentElevation < targetElevation ? pinUp : pinDown;
+    digitalWrite(pin, HIGH);
+    delay(stepDelay);
+    digitalWrite(pin, LOW);
+  }
 
+  if (millis() - lastStatus >= statusInterval) {
+    lastStatus = millis();
+    Serial.print("STATUS ");
+    Serial.print(elapsed);
+    Serial.print(" ");
+    Serial.print(currentAzimuth);
+    Serial.print(" ");
+    Serial.println(currentElevation);
   }
 }
 float get_readings(int pin){
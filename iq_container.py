@@ -0,0 +1,174 @@
+import json
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Block-indexed container for compressed IQ recordings (.iqz):
+#   "IQZ1", uint32 header length, JSON header (codec, datatype, shuffle element size, sample size)
+#   blocks of uint32 compressed length, uint32 raw length, compressed bytes
+#   index of (uint64 file offset, uint32 compressed length, uint32 raw length) per block
+#   trailer of uint64 index offset, uint32 block count, "IQZI"
+# All little-endian. The index at the end makes any block reachable with one seek.
+CONTAINER_MAGIC = b"IQZ1"
+INDEX_MAGIC = b"IQZI"
+BLOCK_FORMAT = "<II"
+INDEX_FORMAT = "<QII"
+TRAILER_FORMAT = "<QI4s"
+CODECS = ("zstd", "zlib")
+DEFAULT_LEVEL = {"zstd": 1, "zlib": 1}
+
+# SigMF datatypes the recorder writes: numpy dtype of one I or Q value and the full scale of the integers
+SIGMF_DATATYPES = {
+    "cf32_le": (np.dtype("<f4"), 1.0),
+    "ci16_le": (np.dtype("<i2"), 32768.0),
+    "ci8": (np.dtype("i1"), 128.0),
+}
+
+
+def to_complex64(raw_data, datatype="cf32_le"):
+    # Interleaved I/Q bytes to complex64, integer samples scaled to +-1
+    dtype, full_scale = SIGMF_DATATYPES[datatype]
+    if datatype == "cf32_le":
+        return np.frombuffer(raw_data, dtype=np.complex64)
+    values = np.frombuffer(raw_data, dtype=dtype).astype(np.float32) / full_scale
+    return values.view(np.complex64)
+
+
+def available_codec(codec):
+    # zstd needs the zstandard package, zlib is always there
+    if codec == "zstd" and zstandard is None:
+        return "zlib"
+    return codec
+
+
+def shuffle(data, element_size):
+    # Group the n-th byte of every element together: the high bytes of mostly-noise samples are
+    # nearly constant and compress far better apart from the noisy low bytes
+    if element_size == 1:
+        return data
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, element_size).T.tobytes()
+
+
+def unshuffle(data, element_size):
+    if element_size == 1:
+        return data
+    return np.frombuffer(data, dtype=np.uint8).reshape(element_size, -1).T.tobytes()
+
+
+class BlockCompressor:
+    """Compresses blocks on any thread, keeping a compressor per thread (zstd contexts are not shareable).
+
+    Counts the CPU time spent so the cost of compression can be set against the space it saves.
+    """
+
+    def __init__(self, codec="zstd", level=None, element_size=1):
+        self.codec = available_codec(codec)
+        self.level = DEFAULT_LEVEL[self.codec] if level is None else level
+        self.element_size = element_size
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.cpu_seconds = 0.0
+
+    def compress(self, data):
+        start = time.thread_time()
+        data = shuffle(data, self.element_size)
+        if self.codec == "zstd":
+            if not hasattr(self.local, "compressor"):
+                self.local.compressor = zstandard.ZstdCompressor(level=self.level)
+            compressed = self.local.compressor.compress(data)
+        else:
+            compressed = zlib.compress(data, self.level)
+        with self.lock:
+            self.cpu_seconds += time.thread_time() - start
+        return compressed
+
+
+def decompress_block(data, codec, element_size):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is needed to read zstd compressed recordings")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        data = zlib.decompress(data)
+    return unshuffle(data, element_size)
+
+
+class ContainerWriter:
+    """Writes compressed blocks in order through writer (an AlignedWriter) and the index on close."""
+
+    def __init__(self, writer, codec, datatype, element_size, sample_size):
+        self.writer = writer
+        self.index = []
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        header = json.dumps({"codec": codec, "datatype": datatype, "element_size": element_size, "sample_size": sample_size}).encode("utf-8")
+        self.writer.write(CONTAINER_MAGIC + struct.pack("<I", len(header)) + header)
+
+    def write_block(self, compressed, raw_length):
+        self.index.append((self.writer.length, len(compressed), raw_length))
+        self.writer.write(struct.pack(BLOCK_FORMAT, len(compressed), raw_length))
+        self.writer.write(compressed)
+        self.raw_bytes += raw_length
+        self.compressed_bytes += len(compressed)
+
+    def close(self):
+        index_offset = self.writer.length
+        self.writer.write(b"".join(struct.pack(INDEX_FORMAT, *entry) for entry in self.index))
+        self.writer.write(struct.pack(TRAILER_FORMAT, index_offset, len(self.index), INDEX_MAGIC))
+        self.writer.close()
+
+
+class ContainerReader:
+    """Random access to the samples of a .iqz container by block."""
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        if self.file.read(4) != CONTAINER_MAGIC:
+            raise ValueError(f"{path} is not an IQ container")
+        header_length, = struct.unpack("<I", self.file.read(4))
+        self.header = json.loads(self.file.read(header_length))
+        trailer_size = struct.calcsize(TRAILER_FORMAT)
+        self.file.seek(-trailer_size, 2)
+        index_offset, count, magic = struct.unpack(TRAILER_FORMAT, self.file.read(trailer_size))
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path} has no block index, the recording did not finish")
+        self.file.seek(index_offset)
+        self.index = list(struct.iter_unpack(INDEX_FORMAT, self.file.read(count * struct.calcsize(INDEX_FORMAT))))
+        # Byte offset of each block in the uncompressed stream
+        self.raw_offsets = np.concatenate(([0], np.cumsum([entry[2] for entry in self.index], dtype=np.int64)))
+
+    @property
+    def raw_length(self):
+        return int(self.raw_offsets[-1])
+
+    def read_block(self, block):
+        offset, compressed_length, _ = self.index[block]
+        self.file.seek(offset + struct.calcsize(BLOCK_FORMAT))
+        return decompress_block(self.file.read(compressed_length), self.header["codec"], self.header["element_size"])
+
+    def read(self, start_sample=0, count=None):
+        """Raw sample bytes from start_sample, count samples or to the end."""
+        sample_size = self.header["sample_size"]
+        start = start_sample * sample_size
+        end = self.raw_length if count is None else min(start + count * sample_size, self.raw_length)
+        first = int(np.searchsorted(self.raw_offsets, start, side="right")) - 1
+        chunks = []
+        block = first
+        while block < len(self.index) and self.raw_offsets[block] < end:
+            chunks.append(self.read_block(block))
+            block += 1
+        data = b"".join(chunks)
+        skip = start - int(self.raw_offsets[first])
+        return data[skip:skip + end - start]
+
+    def close(self):
+        self.file.close()
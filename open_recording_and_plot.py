@@ -1,11 +1,70 @@
 import numpy as np
 import matplotlib.pyplot as plt
+import json
 import os
 import re
 
+from iq_container import ContainerReader, to_complex64
+
+
+def read_datatype(file_path):
+    # Datatype from the SigMF sidecar, recordings made before the sidecar existed are cf32
+    meta_path = os.path.splitext(file_path)[0] + ".sigmf-meta"
+    if not os.path.exists(meta_path):
+        return "cf32_le"
+    with open(meta_path) as f:
+        return json.load(f)["global"]["core:datatype"]
+
+
+def read_compressed_samples(file_path):
+    # Samples of a compressed .iqz recording
+    reader = ContainerReader(file_path)
+    try:
+        return to_complex64(reader.read(), reader.header["datatype"])
+    finally:
+        reader.close()
+
+
+def index_path_of(file_path):
+    # The .index.json of a segmented recording given the index itself or the recording's base name,
+    # None for a single file
+    if file_path.endswith(".index.json"):
+        return file_path
+    if os.path.exists(file_path + ".index.json"):
+        return file_path + ".index.json"
+    return None
+
+
+def read_segmented_samples(index_path):
+    # Samples of every segment of a recording, each placed at its sample_start from the index
+    with open(index_path) as f:
+        index = json.load(f)
+    directory = os.path.dirname(index_path)
+    segments = sorted(index["segments"], key=lambda segment: segment["sample_start"])
+    chunks = []
+    position = 0
+    for segment in segments:
+        path = os.path.join(directory, segment["file"])
+        if not os.path.exists(path):
+            continue
+        samples = read_iq_samples_chunked(path)
+        if segment["sample_start"] > position:
+            # A missing segment leaves a gap of zeros, the samples after it stay at their time
+            chunks.append(np.zeros(segment["sample_start"] - position, dtype=np.complex64))
+            position = segment["sample_start"]
+        chunks.append(samples[position - segment["sample_start"]:])
+        position = max(position, segment["sample_start"] + len(samples))
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.complex64)
+
 
 def read_iq_samples_chunked(file_path, chunk_size=1024*1024):
     # Read the IQ samples from the file in chunks
+    index_path = index_path_of(file_path)
+    if index_path is not None:
+        return read_segmented_samples(index_path)
+    if file_path.endswith(".iqz"):
+        return read_compressed_samples(file_path)
+    datatype = read_datatype(file_path)
     iq_samples = []
     with open(file_path, 'rb') as file:
         while True:
@@ -13,7 +72,7 @@ def read_iq_samples_chunked(file_path, chunk_size=1024*1024):
             if not raw_data:
                 break
             # Convert the bytes to complex64
-            iq_samples_chunk = np.frombuffer(raw_data, dtype=np.complex64)
+            iq_samples_chunk = to_complex64(raw_data, datatype)
             # Process the chunk (for example, just append to a list here)
             iq_samples.append(iq_samples_chunk)
     # Combine chunks into one array if needed
@@ -25,10 +84,12 @@ class IQDataProcessor:
     def __init__(self, filepath):
         self.filepath = filepath
         self.parse_filename()
+        self.datatype = read_datatype(filepath)
 
     def parse_filename(self):
         # Extract parameters from the filename using a regular expression
-        filename_pattern = r"(.+)_Frequency(\d+(\.\d+)?)_SampleRate(\d+(\.\d+)?)_Channel(\d+(\.\d+)?)_(.+)\.dat"
+        # A single file, a segment (_0000 after the timestamp), or a segmented recording's index or base name
+        filename_pattern = r"(.+)_Frequency(\d+(\.\d+)?)_SampleRate(\d+(\.\d+)?)_Channel(\d+(\.\d+)?)_(.+?)(_\d{4})?(\.dat|\.iqz|\.index\.json)?$"
         match = re.search(filename_pattern, os.path.basename(self.filepath))
         if match:
             self.sat_name = match.group(1)
@@ -42,9 +103,13 @@ class IQDataProcessor:
 
     def read_iq_samples(self):
         # Read the IQ samples from the file
+        if index_path_of(self.filepath) is not None:
+            return read_segmented_samples(index_path_of(self.filepath))
+        if self.filepath.endswith(".iqz"):
+            return read_compressed_samples(self.filepath)
         with open(self.filepath, 'rb') as file:
             raw_data = file.read()
-        iq_samples = np.frombuffer(raw_data, dtype=np.complex64)
+        iq_samples = to_complex64(raw_data, self.datatype)
         return iq_samples
 
     def compute_spectrum(self, iq_samples, fft_size=1024):
@@ -89,7 +154,7 @@ class IQDataProcessor:
 
 def prompt_directory_and_plot():
     # Ask the user for the directory path
-    directory = input("Please enter the name of the file containing the IQ .dat files: ")
+    directory = input("Please enter the IQ .dat or .iqz file, or the .index.json of a segmented recording: ")
     processor = IQDataProcessor(directory)
     processor.plot_signal_strength_and_spectrum(fft_size=1024)
 
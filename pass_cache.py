@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+# Entries beyond this count are evicted least recently used first
+MAX_ENTRIES = 5000
+# Entries not used for this many days are dropped
+MAX_IDLE_DAYS = 14
+# Extra time computed on both sides of a missing span so passes crossing its edges are found whole.
+# Must be longer than the longest pass we expect (LEO passes are well under an hour).
+SPAN_PADDING_SECONDS = 3600
+
+SECONDS_PER_DAY = 86400.0
+
+logger = logging.getLogger(__name__)
+
+
+def tle_key(satellite):
+    # Hash of the element set parsed from the TLE lines, so a new TLE for the same satellite gets a new key
+    model = satellite.model
+    elements = (model.satnum, model.jdsatepoch, model.jdsatepochF, model.bstar, model.ndot, model.nddot,
+                model.inclo, model.nodeo, model.ecco, model.argpo, model.mo, model.no_kozai)
+    return hashlib.sha1(repr(elements).encode('utf-8')).hexdigest()
+
+
+def observer_key(observer_location, elevation_mask=0.0):
+    # The pass qualities stored with the windows depend on the elevation mask they were measured against
+    return (round(observer_location.latitude.degrees, 5), round(observer_location.longitude.degrees, 5), round(observer_location.elevation.m, 1), round(elevation_mask, 3))
+
+
+def missing_spans(spans, start, end):
+    # Parts of [start, end] not covered by the sorted, non-overlapping spans
+    missing = []
+    current = start
+    for span_start, span_end in spans:
+        if span_end <= current:
+            continue
+        if span_start >= end:
+            break
+        if span_start > current:
+            missing.append((current, span_start))
+        current = max(current, span_end)
+    if current < end:
+        missing.append((current, end))
+    return missing
+
+
+def merge_spans(spans):
+    merged = []
+    for span_start, span_end in sorted(spans):
+        if merged and span_start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], span_end))
+        else:
+            merged.append((span_start, span_end))
+    return merged
+
+
+class PassCache:
+    """On-disk cache of viewing windows per TLE and observer location.
+
+    Each entry records the time spans it covers: every pass that intersects a covered span is stored
+    with its quality. Requests only compute the spans that are still missing. Times are unix timestamps.
+    """
+
+    def __init__(self, path, max_entries=MAX_ENTRIES, max_idle_days=MAX_IDLE_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_idle_days = max_idle_days
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.stats = {"hits": 0, "partial_hits": 0, "misses": 0}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+            self.entries = data["entries"]
+            self.stats = data["stats"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Could not load pass cache {self.path}, starting empty: {e}")
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"entries": self.entries, "stats": self.stats}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save pass cache {self.path}: {e}")
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.save()
+
+    def get_windows(self, satellites, start, end, observer_location, compute_windows, elevation_mask=0.0):
+        """Return (satellite, rise, set, quality) for every complete pass between start and end.
+
+        compute_windows(satellites, start, end) is called for the spans missing from the cache and
+        must return (satellite, rise, set, quality) tuples for them, quality measured against
+        elevation_mask.
+        """
+        observer = observer_key(observer_location, elevation_mask)
+        with self.lock:
+            # Group satellites by the spans they are missing so each group is computed in one batch
+            pending = {}
+            keys = {}
+            for satellite in satellites:
+                key = (tle_key(satellite), observer)
+                keys[id(satellite)] = key
+                entry = self.entries.get(key)
+                missing = missing_spans(entry["spans"], start, end) if entry else [(start, end)]
+                if not missing:
+                    self.stats["hits"] += 1
+                elif entry:
+                    self.stats["partial_hits"] += 1
+                else:
+                    self.stats["misses"] += 1
+                if missing:
+                    pending.setdefault(tuple(missing), []).append(satellite)
+
+            for missing, group in pending.items():
+                computed = {id(satellite): [] for satellite in group}
+                for span_start, span_end in missing:
+                    for satellite, rise, set_, quality in compute_windows(group, span_start - SPAN_PADDING_SECONDS, span_end + SPAN_PADDING_SECONDS):
+                        computed[id(satellite)].append((rise, set_, quality))
+                for satellite in group:
+                    self._store(keys[id(satellite)], satellite, missing, computed[id(satellite)])
+
+            windows = []
+            for satellite in satellites:
+                key = keys[id(satellite)]
+                entry = self.entries[key]
+                entry["last_used"] = time.time()
+                self.entries.move_to_end(key)
+                windows.extend((satellite, rise, set_, quality) for rise, set_, quality in entry["windows"] if rise >= start and set_ <= end)
+
+            self._evict()
+            self.save()
+
+        windows.sort(key=lambda x: x[1])
+        return windows
+
+    def _store(self, key, satellite, spans, windows):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = {"satnum": satellite.model.satnum, "epoch": satellite.model.jdsatepoch + satellite.model.jdsatepochF, "spans": [], "windows": [], "last_used": time.time()}
+            self.entries[key] = entry
+        # Passes of one satellite never overlap, so an overlapping window is one we already have
+        stored = entry["windows"]
+        for rise, set_, quality in windows:
+            if not any(rise < other_set and set_ > other_rise for other_rise, other_set, _ in stored):
+                stored.append((rise, set_, quality))
+        stored.sort()
+        entry["spans"] = merge_spans(entry["spans"] + list(spans))
+
+    def _evict(self):
+        # Drop entries whose TLE was superseded by a newer epoch of the same satellite, then idle ones,
+        # then the least recently used ones above the size limit
+        newest_epoch = {}
+        for (_, observer), entry in self.entries.items():
+            object_key = (entry["satnum"], observer)
+            newest_epoch[object_key] = max(newest_epoch.get(object_key, entry["epoch"]), entry["epoch"])
+        idle_limit = time.time() - self.max_idle_days * SECONDS_PER_DAY
+        for key in [key for key, entry in self.entries.items()
+                    if entry["epoch"] < newest_epoch[(entry["satnum"], key[1])] or entry["last_used"] < idle_limit]:
+            del self.entries[key]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
@@ -0,0 +1,304 @@
+import logging
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+# Serial reads return after this long so the worker notices new targets and stop requests
+READ_TIMEOUT_SECONDS = 0.5
+# A move that hasn't answered "moved" within this time is abandoned
+MOVE_TIMEOUT_SECONDS = 60
+# The Feather drives each of the four end stops for 80 s while calibrating
+CALIBRATE_TIMEOUT_SECONDS = 360
+# Round-trip latencies kept for the statistics
+LATENCY_HISTORY = 200
+# Mount response assumed until enough moves have been timed: the Feather's 1 s serial read timeout
+# plus its averaged position reads, then degrees per second on each axis
+DEFAULT_LATENCY_SECONDS = 1.5
+DEFAULT_SLEW_RATE = 3.0
+MIN_MODEL_SAMPLES = 10
+
+# Trajectory upload: "TRAJ", uint16 waypoint count, then per waypoint uint32 milliseconds from the
+# start of the path and int16 azimuth and elevation in tenths of a degree, then the CRC-16 of the
+# waypoints, all little-endian. "SYNC" + int32 milliseconds into the path starts or re-times it and
+# "STOP" ends it. Must match feather_controller.ino.
+TRAJECTORY_MAGIC = b"TRAJ"
+WAYPOINT_FORMAT = "<Ihh"
+MAX_WAYPOINTS = 1024
+# Waypoints are at least this far apart, the controller interpolates between them
+WAYPOINT_STEP_SECONDS = 2.0
+TRAJECTORY_TIMEOUT_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+
+def crc16(data):
+    # CRC-16/CCITT-FALSE
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+            crc &= 0xFFFF
+    return crc
+
+
+def encode_trajectory(times, azimuths, elevations):
+    """Binary upload frame for waypoints at unix times (relative to the first) in mount coordinates."""
+    waypoints = b"".join(struct.pack(WAYPOINT_FORMAT, int(round((t - times[0]) * 1000)), int(round(azimuth * 10)), int(round(elevation * 10)))
+                         for t, azimuth, elevation in zip(times, azimuths, elevations))
+    return TRAJECTORY_MAGIC + struct.pack("<H", len(times)) + waypoints + struct.pack("<H", crc16(waypoints))
+
+
+def decode_trajectory(frame):
+    """(milliseconds, azimuths, elevations) of an upload frame, None if it is damaged."""
+    if frame[:4] != TRAJECTORY_MAGIC:
+        return None
+    count, = struct.unpack_from("<H", frame, 4)
+    size = struct.calcsize(WAYPOINT_FORMAT)
+    waypoints = frame[6:6 + count * size]
+    if len(frame) < 8 + count * size or struct.unpack_from("<H", frame, 6 + count * size)[0] != crc16(waypoints):
+        return None
+    rows = list(struct.iter_unpack(WAYPOINT_FORMAT, waypoints))
+    return [row[0] for row in rows], [row[1] / 10 for row in rows], [row[2] / 10 for row in rows]
+
+
+def trajectory_waypoints(mount_trajectory):
+    # Evenly spaced waypoints of the path, as many as the controller holds
+    duration = mount_trajectory.end - mount_trajectory.start
+    step = max(WAYPOINT_STEP_SECONDS, duration / (MAX_WAYPOINTS - 1))
+    times = np.append(np.arange(mount_trajectory.start, mount_trajectory.end, step), mount_trajectory.end)
+    positions = [mount_trajectory.at(t) for t in times]
+    return times, [position[0] for position in positions], [position[1] for position in positions]
+
+
+class ResponseModel:
+    """Online estimate of how long the mount takes to complete a move.
+
+    The Feather moves azimuth and then elevation, so a move takes a fixed command latency plus the
+    azimuth and the elevation distance each divided by that axis' slew rate. The three terms are a
+    least squares fit over the most recent timed moves.
+    """
+
+    def __init__(self, history=LATENCY_HISTORY):
+        self.samples = deque(maxlen=history)
+        self.latency = DEFAULT_LATENCY_SECONDS
+        self.azimuth_rate = DEFAULT_SLEW_RATE
+        self.elevation_rate = DEFAULT_SLEW_RATE
+
+    def add(self, azimuth_distance, elevation_distance, seconds):
+        self.samples.append((azimuth_distance, elevation_distance, seconds))
+        if len(self.samples) < MIN_MODEL_SAMPLES:
+            return
+        samples = np.array(self.samples)
+        design = np.column_stack((np.ones(len(samples)), samples[:, 0], samples[:, 1]))
+        (latency, azimuth_seconds, elevation_seconds), *_ = np.linalg.lstsq(design, samples[:, 2], rcond=None)
+        # Small tracking moves may not separate the terms well, keep the previous value for a term that
+        # comes out unphysical
+        if latency >= 0:
+            self.latency = float(latency)
+        if azimuth_seconds > 0:
+            self.azimuth_rate = float(1 / azimuth_seconds)
+        if elevation_seconds > 0:
+            self.elevation_rate = float(1 / elevation_seconds)
+
+    def predict(self, start, target):
+        """Seconds from sending a move from start to target (azimuth, elevation) until it is done."""
+        if start is None:
+            return self.latency
+        return self.latency + abs(target[0] - start[0]) / self.azimuth_rate + abs(target[1] - start[1]) / self.elevation_rate
+
+    def to_dict(self):
+        return {"latency": self.latency, "azimuth_rate": self.azimuth_rate, "elevation_rate": self.elevation_rate, "samples": len(self.samples)}
+
+
+class RotatorWorker:
+    """Owns the rotator serial port and talks to the Feather on its own thread.
+
+    Pointing targets go into a one-slot mailbox: a target the worker hasn't started on yet is replaced
+    by a newer one, so the mount always heads for the latest position and callers never wait on it.
+    Calibration and synchronous moves are queued separately and are never dropped.
+    """
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.ser.timeout = READ_TIMEOUT_SECONDS
+        self.condition = threading.Condition()
+        self.target = None
+        self.commands = deque()
+        self.busy = False
+        self.stop_event = threading.Event()
+        self.latencies = deque(maxlen=LATENCY_HISTORY)
+        self.stats = {"moves": 0, "coalesced": 0, "timeouts": 0, "errors": 0}
+        self.last_position = None
+        # (azimuth, elevation, unix time) of the last completed move
+        self.last_move = None
+        self.response_model = ResponseModel()
+        # Trajectory mode: the controller follows an uploaded path and reports STATUS lines of
+        # (milliseconds into the path, azimuth, elevation) until DONE
+        self.following = False
+        self.status_reports = deque(maxlen=MAX_WAYPOINTS * 4)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def point(self, azimuth, elevation):
+        """Non-blocking move to (azimuth, elevation), replacing any target not yet started."""
+        with self.condition:
+            if self.target is not None:
+                self.stats["coalesced"] += 1
+            self.target = (azimuth, elevation)
+            self.condition.notify()
+
+    def move(self, azimuth, elevation, timeout=MOVE_TIMEOUT_SECONDS):
+        """Blocking move, True once the mount reports it has moved."""
+        return self._submit(f"MOVE {azimuth}, {elevation}\n", timeout) == "moved"
+
+    def calibrate(self, timeout=CALIBRATE_TIMEOUT_SECONDS):
+        return self._submit("calibrate\n", timeout) or "calibration timed out"
+
+    def upload_trajectory(self, mount_trajectory):
+        """Send the whole path to the controller in one binary frame, True once it accepts it."""
+        frame = encode_trajectory(*trajectory_waypoints(mount_trajectory))
+        response = self._submit(frame, TRAJECTORY_TIMEOUT_SECONDS)
+        return response is not None and response.startswith("TRAJ OK")
+
+    def start_trajectory(self, start_timestamp):
+        """Tell the controller how far into the uploaded path it is now (negative before the path starts).
+
+        Sent again during the pass to correct the drift of the controller's clock. The time is taken
+        when the worker writes the message, not when it is queued.
+        """
+        self.following = True
+        self._submit(lambda: b"SYNC" + struct.pack("<i", int(round((time.time() - start_timestamp) * 1000))), 0)
+
+    def stop_trajectory(self):
+        self._submit(b"STOP", 0)
+        self.following = False
+
+    def _submit(self, command, timeout):
+        done = threading.Event()
+        result = []
+        with self.condition:
+            self.commands.append((command, timeout, done, result))
+            self.condition.notify()
+        # The worker enforces the command timeout, the extra wait covers a move it is still finishing.
+        # A timeout of 0 means the command has no reply.
+        done.wait(timeout + MOVE_TIMEOUT_SECONDS)
+        return result[0] if result else None
+
+    def is_idle(self):
+        with self.condition:
+            return not self.busy and self.target is None and not self.commands
+
+    def latency_stats(self):
+        latencies = np.array(self.latencies)
+        stats = dict(self.stats, model=self.response_model.to_dict())
+        if len(latencies):
+            stats.update(latency_mean=float(latencies.mean()), latency_p95=float(np.percentile(latencies, 95)), latency_max=float(latencies.max()), latency_last=float(latencies[-1]))
+        return stats
+
+    def close(self):
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify()
+        self.thread.join()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            with self.condition:
+                while self.target is None and not self.commands and not self.following and not self.stop_event.is_set():
+                    self.condition.wait()
+                if self.stop_event.is_set():
+                    return
+                if self.commands:
+                    command, timeout, done, result = self.commands.popleft()
+                elif self.target is not None:
+                    command, timeout, done, result = f"MOVE {self.target[0]}, {self.target[1]}\n", MOVE_TIMEOUT_SECONDS, None, []
+                    self.target = None
+                else:
+                    command = None
+                self.busy = command is not None
+            if command is None:
+                # Following an uploaded path: nothing to send, pick up the controller's status lines
+                try:
+                    self.read_status()
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.error(f"Reading rotator status failed: {e}")
+                    # A port that keeps failing is retried at the read timeout, not in a busy loop
+                    self.stop_event.wait(READ_TIMEOUT_SECONDS)
+                continue
+            try:
+                result.append(self.execute(command, timeout))
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Rotator command failed: {e}")
+            finally:
+                with self.condition:
+                    self.busy = False
+                if done is not None:
+                    done.set()
+
+    def handle_status(self, response):
+        # True if response was an unsolicited trajectory status line
+        if response.startswith("STATUS"):
+            # A garbled line is dropped, the next report comes within the status interval
+            fields = response.split()
+            try:
+                if len(fields) != 4:
+                    raise ValueError(f"{len(fields) - 1} fields")
+                report = (int(fields[1]), float(fields[2]), float(fields[3]))
+            except ValueError as e:
+                logger.warning(f"Malformed rotator status {response!r}: {e}")
+                return True
+            self.status_reports.append(report)
+            self.last_position = report[1:]
+            return True
+        if response.startswith("DONE"):
+            self.following = False
+            return True
+        return False
+
+    def read_status(self):
+        response = self.ser.readline().decode('utf-8', errors='replace').strip()
+        if response and not self.handle_status(response):
+            logger.warning(f"Unexpected rotator message: {response}")
+
+    def execute(self, command, timeout):
+        # Send one command and read until its answer: "moved"/"error" for moves, a single line for
+        # calibrate and trajectory uploads, nothing when timeout is 0
+        if not self.following:
+            self.ser.reset_input_buffer()
+        start = time.monotonic()
+        if callable(command):
+            command = command()
+        self.ser.write(command if isinstance(command, bytes) else command.encode('utf-8'))
+        if timeout == 0:
+            return None
+        is_move = isinstance(command, str) and command.startswith("MOVE")
+        while time.monotonic() - start < timeout and not self.stop_event.is_set():
+            response = self.ser.readline().decode('utf-8', errors='replace').strip()
+            if not response or self.handle_status(response):
+                continue
+            if not is_move:
+                return response
+            if response.lower() == "moved":
+                seconds = time.monotonic() - start
+                self.latencies.append(seconds)
+                self.stats["moves"] += 1
+                azimuth, elevation = (float(value) for value in command[5:].split(","))
+                if self.last_position is not None:
+                    self.response_model.add(abs(azimuth - self.last_position[0]), abs(elevation - self.last_position[1]), seconds)
+                self.last_position = (azimuth, elevation)
+                self.last_move = (azimuth, elevation, time.time())
+                return "moved"
+            if "error" in response.lower():
+                self.stats["errors"] += 1
+                logger.error(f"Rotator error: {response}")
+                return "error"
+        self.stats["timeouts"] += 1
+        logger.warning(f"Rotator command {command[:4]!r} timed out after {timeout} s")
+        return None
@@ -0,0 +1,188 @@
+import argparse
+import os
+import random
+import select
+import struct
+import threading
+import time
+import tty
+
+import numpy as np
+
+from rotator import decode_trajectory
+
+
+class RotatorSimulator:
+    """Serves the feather_controller.ino serial protocol on a pseudo-terminal.
+
+    Open self.port with pyserial (or pass it to SatelliteTracker) as if it were the Feather. Like the
+    firmware, a command is only read once no more bytes arrive for read_timeout seconds (the Arduino
+    Serial.readString timeout), MOVE steps azimuth and then elevation until each is within 1 degree,
+    reading the position after every step_seconds pulse, and answers "moved" or "error".
+
+    slew_rate is in degrees per second, adc_delay the time taken by each position read and noise the
+    standard deviation in degrees of the read position.
+
+    Uploaded trajectories (TRAJ/SYNC/STOP) are followed one step per loop as the firmware does, with
+    a STATUS line every second and DONE at the end.
+    """
+
+    def __init__(self, slew_rate=3.0, adc_delay=0.0, noise=0.2, read_timeout=1.0, step_seconds=0.1, calibrate_seconds=320.0, azimuth=0.0, elevation=0.0):
+        self.slew_rate = slew_rate
+        self.adc_delay = adc_delay
+        self.noise = noise
+        self.read_timeout = read_timeout
+        self.step_seconds = step_seconds
+        self.calibrate_seconds = calibrate_seconds
+        self.azimuth = azimuth
+        self.elevation = elevation
+        self.commands = 0
+        self.waypoints = None
+        self.trajectory_start = None
+        self.last_status = 0.0
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def read_position(self, axis):
+        time.sleep(self.adc_delay)
+        return getattr(self, axis) + random.gauss(0.0, self.noise)
+
+    def step_axis(self, axis, desired):
+        # moveMount(): one step_seconds pulse towards the target per loop, then a fresh position read.
+        # Ten reads in a row without change count as a stall.
+        current = self.read_position(axis)
+        previous = current
+        stalled = 0
+        while abs(current - desired) > 1 and stalled <= 10:
+            direction = 1 if current < desired else -1
+            limit = 450.0 if axis == "azimuth" else 180.0
+            setattr(self, axis, min(max(getattr(self, axis) + direction * self.slew_rate * self.step_seconds, 0.0), limit))
+            time.sleep(self.step_seconds)
+            current = self.read_position(axis)
+            stalled = stalled + 1 if abs(current - previous) < 1e-9 else 0
+            previous = current
+        return stalled <= 10
+
+    def handle(self, command):
+        self.commands += 1
+        if command.startswith("calibrate"):
+            time.sleep(self.calibrate_seconds)
+            return "Finished calibrating"
+        separator = command.find(",")
+        if separator == -1:
+            return None
+        try:
+            desired_azimuth = float(command[5:separator])
+            desired_elevation = float(command[separator + 1:])
+        except ValueError:
+            # Arduino toFloat() returns 0 for text it cannot parse
+            desired_azimuth, desired_elevation = 0.0, 0.0
+        self.trajectory_start = None
+        azimuth_ok = self.step_axis("azimuth", desired_azimuth)
+        elevation_ok = self.step_axis("elevation", desired_elevation)
+        return "moved" if azimuth_ok or elevation_ok else "error"
+
+    def write_line(self, line):
+        os.write(self.master_fd, (line + "\r\n").encode("utf-8"))
+
+    def binary_message(self, buffer):
+        # (length, response) of the binary message at the start of buffer, length 0 if incomplete
+        if buffer.startswith(b"TRAJ"):
+            if len(buffer) < 6:
+                return 0, None
+            count, = struct.unpack_from("<H", buffer, 4)
+            length = 8 + 8 * count
+            if len(buffer) < length:
+                return 0, None
+            decoded = decode_trajectory(buffer[:length])
+            if decoded is None:
+                return length, "TRAJ ERROR checksum"
+            self.commands += 1
+            self.waypoints = tuple(np.array(values, dtype=float) for values in decoded)
+            self.trajectory_start = None
+            return length, f"TRAJ OK {count}"
+        if buffer.startswith(b"SYNC"):
+            if len(buffer) < 8:
+                return 0, None
+            elapsed_ms, = struct.unpack_from("<i", buffer, 4)
+            if self.waypoints is not None:
+                self.trajectory_start = time.monotonic() - elapsed_ms / 1000
+            return 8, None
+        if buffer.startswith(b"STOP"):
+            self.trajectory_start = None
+            return 4, None
+        return 0, None
+
+    def follow_step(self):
+        # followTrajectory(): one pulse towards the interpolated waypoint position
+        elapsed_ms = (time.monotonic() - self.trajectory_start) * 1000
+        times, azimuths, elevations = self.waypoints
+        if elapsed_ms < 0:
+            return
+        if elapsed_ms > times[-1]:
+            self.trajectory_start = None
+            self.write_line("DONE")
+            return
+        targets = {"azimuth": np.interp(elapsed_ms, times, azimuths), "elevation": np.interp(elapsed_ms, times, elevations)}
+        current = {axis: self.read_position(axis) for axis in targets}
+        for axis, limit in (("azimuth", 450.0), ("elevation", 180.0)):
+            if abs(current[axis] - targets[axis]) > 1:
+                direction = 1 if current[axis] < targets[axis] else -1
+                setattr(self, axis, min(max(getattr(self, axis) + direction * self.slew_rate * self.step_seconds, 0.0), limit))
+                time.sleep(self.step_seconds)
+                break
+        if time.monotonic() - self.last_status >= 1.0:
+            self.last_status = time.monotonic()
+            self.write_line(f"STATUS {int(elapsed_ms)} {current['azimuth']:.2f} {current['elevation']:.2f}")
+
+    def run(self):
+        buffer = b""
+        last_byte = None
+        while not self.stop_event.is_set():
+            # Poll so both new bytes and the end of a command (read_timeout of silence) are noticed
+            readable, _, _ = select.select([self.master_fd], [], [], 0.01)
+            if readable:
+                buffer += os.read(self.master_fd, 65536)
+                last_byte = time.monotonic()
+            # Binary messages are taken by length as soon as they are complete
+            while buffer[:1] in (b"T", b"S"):
+                length, response = self.binary_message(buffer)
+                if not length:
+                    break
+                buffer = buffer[length:]
+                if response is not None:
+                    self.write_line(response)
+            if buffer and buffer[:1] not in (b"T", b"S") and time.monotonic() - last_byte >= self.read_timeout:
+                response = self.handle(buffer.decode("utf-8", errors="replace"))
+                buffer = b""
+                if response is not None:
+                    self.write_line(response)
+            if self.trajectory_start is not None:
+                self.follow_step()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rotator simulator speaking the Feather serial protocol on a pseudo-terminal")
+    parser.add_argument("--slew-rate", type=float, default=3.0, help="degrees per second")
+    parser.add_argument("--adc-delay", type=float, default=0.0, help="seconds per position read")
+    parser.add_argument("--noise", type=float, default=0.2, help="position read noise in degrees")
+    parser.add_argument("--calibrate-seconds", type=float, default=320.0)
+    args = parser.parse_args()
+
+    simulator = RotatorSimulator(args.slew_rate, args.adc_delay, args.noise, calibrate_seconds=args.calibrate_seconds)
+    print(f"Simulated rotator on {simulator.port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.close()
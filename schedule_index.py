@@ -0,0 +1,114 @@
+import bisect
+import threading
+from datetime import timedelta
+
+
+def no_break(previous, following):
+    return timedelta(0)
+
+
+class ScheduleIndex:
+    """Thread-safe schedule of (name, rise_time, set_time, satellite) passes kept sorted by rise time.
+
+    Passes stored in the index must not overlap. Because of that, sorting by rise time also sorts by
+    set time, so insert, remove and overlap/conflict queries only need a binary search and a look at
+    the neighbouring passes.
+    """
+
+    def __init__(self, items=()):
+        self.lock = threading.Lock()
+        self.items = []
+        self.rise_times = []
+        for item in items:
+            self.insert(item)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
+
+    def __contains__(self, item):
+        with self.lock:
+            return self._find(item) is not None
+
+    def to_list(self):
+        with self.lock:
+            return list(self.items)
+
+    def _find(self, item):
+        i = bisect.bisect_left(self.rise_times, item[1])
+        while i < len(self.items) and self.rise_times[i] == item[1]:
+            if self.items[i] == item:
+                return i
+            i += 1
+        return None
+
+    def insert(self, item):
+        with self.lock:
+            i = bisect.bisect_right(self.rise_times, item[1])
+            self.rise_times.insert(i, item[1])
+            self.items.insert(i, item)
+
+    def remove(self, item):
+        with self.lock:
+            i = self._find(item)
+            if i is None:
+                return False
+            del self.rise_times[i]
+            del self.items[i]
+            return True
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.rise_times.clear()
+
+    def peek(self):
+        with self.lock:
+            return self.items[0] if self.items else None
+
+    def pop_first(self):
+        with self.lock:
+            if not self.items:
+                return None
+            del self.rise_times[0]
+            return self.items.pop(0)
+
+    def overlapping(self, start_time, end_time):
+        """Passes that overlap [start_time, end_time], in rise time order."""
+        with self.lock:
+            i = bisect.bisect_left(self.rise_times, end_time)
+            found = []
+            while i > 0 and self.items[i - 1][2] > start_time:
+                i -= 1
+                found.append(self.items[i])
+            return found[::-1]
+
+    def _conflicts(self, item, required_break):
+        # Returns (conflict, insert position). Only the stored passes just before and just after the
+        # new one need checking.
+        _, rise_time, set_time, _ = item
+        i = bisect.bisect_right(self.rise_times, rise_time)
+        if i > 0 and self.items[i - 1][2] + required_break(self.items[i - 1], item) > rise_time:
+            return True, i
+        if i < len(self.items) and set_time + required_break(item, self.items[i]) > self.items[i][1]:
+            return True, i
+        return False, i
+
+    def conflicts(self, item, required_break=no_break):
+        """True if item overlaps a stored pass or is closer to one than required_break allows.
+
+        required_break(previous, following) is the break needed after the previous pass before the
+        following one may rise.
+        """
+        with self.lock:
+            return self._conflicts(item, required_break)[0]
+
+    def insert_if_free(self, item, required_break=no_break):
+        # Conflict check and insert under one lock so concurrent updates can't both take the same gap
+        with self.lock:
+            conflict, i = self._conflicts(item, required_break)
+            if conflict:
+                return False
+            self.rise_times.insert(i, item[1])
+            self.items.insert(i, item)
+            return True
@@ -1,10 +1,20 @@
 from skyfield.api import Topos, load, EarthSatellite, wgs84
+from skyfield.sgp4lib import theta_GMST1982
+from sgp4.api import SatrecArray
+from sgp4.exporter import export_tle
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 from datetime import datetime
 from datetime import timedelta
+from collections import namedtuple
+import numpy as np
 import pytz
 from timezonefinder import TimezoneFinder
 import os
 import logging
+import bisect
+from schedule_index import ScheduleIndex
+from tle_catalog import TLECatalog
 
 
 ts = load.timescale()
@@ -12,6 +22,41 @@ DATA_BASE_DIR = "/home/dietpi/Desktop/MDE/data_base"
 
 USB_DIR = "/mnt/usbdrive"
 
+# Batch pass prediction: spacing of the shared time grid, precision of the refined rise/set times
+# and the largest satellites x grid points block propagated in a single SGP4 array call
+BATCH_STEP_SECONDS = 60
+BATCH_TOLERANCE_SECONDS = 1
+BATCH_MAX_SAMPLES = 1000000
+
+# Pass quality: sampling step used to find the culmination and the time spent above the elevation mask
+QUALITY_STEP_SECONDS = 5
+# Kinds of event bracket refined by the batch pass predictor
+RISE, SET, PEAK = 1, -1, 0
+
+# max_elevation in degrees, culmination_time as a datetime, seconds_above_mask above the elevation mask
+PassQuality = namedtuple("PassQuality", ["max_elevation", "culmination_time", "seconds_above_mask"])
+# Passes whose maximum elevation or time above elevation_mask is below these are not scheduled
+PassFilter = namedtuple("PassFilter", ["min_max_elevation", "elevation_mask", "min_seconds_above_mask"])
+
+
+class Window(namedtuple("Window", ["name", "rise_time", "set_time", "satellite"])):
+    # A viewing window, unpacked like the plain (name, rise_time, set_time, satellite) tuple, with the
+    # PassQuality the batch propagation found for it in quality
+    def __new__(cls, name, rise_time, set_time, satellite, quality=None):
+        window = super().__new__(cls, name, rise_time, set_time, satellite)
+        window.quality = quality
+        return window
+
+
+# Rolling-horizon window generator: length of each lazily computed chunk and the extra time computed
+# after it so passes that rise inside the chunk but set after it are found whole
+ROLLING_CHUNK_SECONDS = 6 * 3600
+ROLLING_PADDING_SECONDS = 3600
+
+UNIX_EPOCH_JD = 2440587.5
+SPEED_OF_LIGHT_KM_S = 299792.458
+SECONDS_PER_DAY = 86400.0
+
 if os.path.isdir(USB_DIR):
     DATA_BASE_DIR = USB_DIR
 
@@ -63,15 +108,323 @@ def get_all_viewing_windows(satellite, start_time, end_time, observer_location):
 
 
 
-def get_non_overlapping_non_repeating_schedule(satellites, start_time, end_time, topos):
-    # Fetch all viewing windows for all satellites
-    all_windows = []
-    for satellite in satellites:
-        for window in get_all_viewing_windows(satellite, start_time, end_time, topos):
-            all_windows.append((satellite.name, window[0], window[1], satellite))
+def _julian_dates(unix_seconds):
+    # Split unix timestamps into the (whole, fraction) UTC Julian dates SGP4 expects
+    days, seconds = np.divmod(unix_seconds, SECONDS_PER_DAY)
+    return UNIX_EPOCH_JD + days, seconds / SECONDS_PER_DAY
+
+
+def _observer_axes(observer_location):
+    # Earth-fixed position of the observer and its local east/north/up unit vectors
+    lat = observer_location.latitude.radians
+    lon = observer_location.longitude.radians
+    axes = np.array([
+        [-np.sin(lon), np.cos(lon), 0.0],
+        [-np.sin(lat) * np.cos(lon), -np.sin(lat) * np.sin(lon), np.cos(lat)],
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)],
+    ])
+    return observer_location.itrs_xyz.km, axes
+
+
+def _topocentric_enu(r_teme, jd, fr, dut1, observer_location):
+    # Rotate SGP4 TEME positions into the Earth-fixed frame (same GMST rotation Skyfield uses)
+    # and return the east/north/up components of the observer -> satellite vector in km
+    theta, _ = theta_GMST1982(jd, fr + dut1 / SECONDS_PER_DAY)
+    cos_theta, sin_theta = np.cos(theta), np.sin(theta)
+    position, axes = _observer_axes(observer_location)
+    x = cos_theta * r_teme[..., 0] + sin_theta * r_teme[..., 1] - position[0]
+    y = cos_theta * r_teme[..., 1] - sin_theta * r_teme[..., 0] - position[1]
+    z = r_teme[..., 2] - position[2]
+    return [axis[0] * x + axis[1] * y + axis[2] * z for axis in axes]
+
+
+def _elevation_degrees(errors, r_teme, jd, fr, dut1, observer_location):
+    east, north, up = _topocentric_enu(r_teme, jd, fr, dut1, observer_location)
+    elevation = np.degrees(np.arctan2(up, np.hypot(east, north)))
+    # Propagation failures (decayed orbits) are treated as below the horizon
+    return np.where(errors == 0, elevation, -90.0)
+
+
+def _model_elevations(model, unix_times, dut1, observer_location):
+    # Elevation of one satellite at an array of unix timestamps, one SGP4 array call
+    jd, fr = _julian_dates(unix_times)
+    errors, r_teme, _ = model.sgp4_array(jd, fr)
+    return _elevation_degrees(errors, r_teme, jd, fr, dut1, observer_location)
+
+
+def _satellite_groups(sat_idx):
+    # (satellite index, positions in sat_idx) for every satellite present
+    order = np.argsort(sat_idx, kind="stable")
+    unique_sats, first_idx, counts = np.unique(sat_idx[order], return_index=True, return_counts=True)
+    for sat_i, first, count in zip(unique_sats, first_idx, counts):
+        yield sat_i, order[first:first + count]
+
+
+def _refine_events(satellites, sat_idx, lo, hi, kind, threshold, dut1, observer_location, tolerance_seconds):
+    # Bisect every [lo, hi] bracket until it is narrower than the tolerance. A RISE or SET bracket holds
+    # a crossing of its threshold elevation (the horizon or the elevation mask), a PEAK bracket the
+    # highest point of a pass, found from the sign of the elevation rate. Brackets are grouped per
+    # satellite so each step is one SGP4 array call per satellite, whatever the kinds of event.
+    # Returns the event times and the elevation at each of them.
+    lo = lo.copy()
+    hi = hi.copy()
+    elevations = threshold.astype(float)
+    if len(lo) == 0:
+        return lo, elevations
+    iterations = int(np.ceil(np.log2(max(np.max(hi - lo), tolerance_seconds) / tolerance_seconds)))
+    delta = tolerance_seconds / 4
+
+    for sat_i, sel in _satellite_groups(sat_idx):
+        model = satellites[sat_i].model
+        sel_lo, sel_hi, sel_kind, sel_threshold = lo[sel], hi[sel], kind[sel], threshold[sel]
+        peak = sel_kind == PEAK
+        for _ in range(iterations):
+            mid = (sel_lo + sel_hi) / 2
+            # Peaks are sampled a little after mid as well, for the elevation rate
+            samples = _model_elevations(model, np.concatenate((mid, mid[peak] + delta)), dut1, observer_location)
+            at_mid = samples[:len(mid)]
+            climbing = np.zeros(len(mid), dtype=bool)
+            climbing[peak] = samples[len(mid):] > at_mid[peak]
+            # A rise goes from below to above the threshold, a set the other way around, and a peak
+            # still climbing at mid is later
+            move_hi = np.where(peak, ~climbing, (at_mid > sel_threshold) == (sel_kind == RISE))
+            sel_hi = np.where(move_hi, mid, sel_hi)
+            sel_lo = np.where(move_hi, sel_lo, mid)
+        lo[sel], hi[sel] = sel_lo, sel_hi
+        if peak.any():
+            elevations[sel[peak]] = _model_elevations(model, (sel_lo[peak] + sel_hi[peak]) / 2, dut1, observer_location)
+
+    return (lo + hi) / 2, elevations
+
+
+def _refine_passes(group, elevations, grid, sat_idx, rise_steps, set_steps, dut1, observer_location, tolerance_seconds, elevation_mask):
+    # Rise and set times of the passes of group and their (max elevation, culmination unix time, seconds
+    # above elevation_mask) quality rows, from the elevations already propagated on the grid. A pass is
+    # above the horizon on grid points rise_step + 1 to set_step; its highest grid point brackets the
+    # culmination and the grid points crossing the mask bracket its mask crossings. All of them are
+    # refined in one bisection.
+    count = len(sat_idx)
+    peaks = np.array([rise_step + 1 + int(np.argmax(elevations[sat_i, rise_step + 1:set_step + 1]))
+                      for sat_i, rise_step, set_step in zip(sat_idx, rise_steps, set_steps)], dtype=int)
+    lo = [grid[rise_steps], grid[set_steps], grid[peaks - 1]]
+    hi = [grid[rise_steps + 1], grid[set_steps + 1], grid[peaks + 1]]
+    kinds = [np.full(count, RISE), np.full(count, SET), np.full(count, PEAK)]
+
+    # (pass, last grid point at or below the mask before the peak, first one after it) of the passes
+    # reaching above the mask on the grid; the points next to the pass are below the horizon
+    masked = []
+    if elevation_mask > 0:
+        for i, (sat_i, rise_step, peak, set_step) in enumerate(zip(sat_idx, rise_steps, peaks, set_steps)):
+            if elevations[sat_i, peak] > elevation_mask:
+                below = elevations[sat_i, rise_step:set_step + 2] <= elevation_mask
+                offset = peak - rise_step
+                masked.append((i, peak - 1 - int(np.argmax(below[offset - 1::-1])), peak + int(np.argmax(below[offset:]))))
+    masked = np.array(masked, dtype=int).reshape(-1, 3)
+    lo += [grid[masked[:, 1]], grid[masked[:, 2] - 1]]
+    hi += [grid[masked[:, 1] + 1], grid[masked[:, 2]]]
+    kinds += [np.full(len(masked), RISE), np.full(len(masked), SET)]
+    thresholds = np.concatenate((np.zeros(3 * count), np.full(2 * len(masked), float(elevation_mask))))
+
+    times, event_elevations = _refine_events(group, np.concatenate([sat_idx] * 3 + [sat_idx[masked[:, 0]]] * 2),
+                                             np.concatenate(lo), np.concatenate(hi), np.concatenate(kinds), thresholds, dut1, observer_location, tolerance_seconds)
+    rise_times, set_times, culminations = times[:count], times[count:2 * count], times[2 * count:3 * count]
+    qualities = np.column_stack((event_elevations[2 * count:3 * count], culminations, np.zeros(count)))
+    if elevation_mask <= 0:
+        qualities[:, 2] = set_times - rise_times
+        return rise_times, set_times, qualities
+    if len(masked):
+        qualities[masked[:, 0], 2] = times[3 * count + len(masked):] - times[3 * count:3 * count + len(masked)]
+
+    # Passes peaking above the mask only between two grid points: their crossings lie either side of
+    # the culmination
+    grazing = np.nonzero((qualities[:, 0] > elevation_mask) & (elevations[sat_idx, peaks] <= elevation_mask))[0]
+    if len(grazing):
+        crossings, _ = _refine_events(group, np.concatenate((sat_idx[grazing], sat_idx[grazing])),
+                                      np.concatenate((rise_times[grazing], culminations[grazing])), np.concatenate((culminations[grazing], set_times[grazing])),
+                                      np.concatenate((np.full(len(grazing), RISE), np.full(len(grazing), SET))), np.full(2 * len(grazing), float(elevation_mask)),
+                                      dut1, observer_location, tolerance_seconds)
+        qualities[grazing, 2] = crossings[len(grazing):] - crossings[:len(grazing)]
+    return rise_times, set_times, qualities
+
+
+def _batch_windows_unix(satellites, start_unix, end_unix, observer_location, step_seconds=BATCH_STEP_SECONDS, tolerance_seconds=BATCH_TOLERANCE_SECONDS, elevation_mask=0.0):
+    # Core of the batch pass predictor, on unix timestamps. Returns the satellite index, rise and set
+    # time arrays of every complete pass, sorted by rise time, and its quality rows (see _refine_passes).
+    sat_indices, rise_times, set_times, qualities = [], [], [], []
+    if not satellites or end_unix <= start_unix:
+        return np.array([], dtype=np.int64), np.array([]), np.array([]), np.zeros((0, 3))
+
+    grid = np.append(np.arange(start_unix, end_unix, step_seconds), end_unix)
+    jd, fr = _julian_dates(grid)
+    dut1 = float(ts.from_datetime(datetime.fromtimestamp(start_unix, tz=pytz.utc)).dut1)
+
+    chunk_size = max(1, BATCH_MAX_SAMPLES // len(grid))
+    for first in range(0, len(satellites), chunk_size):
+        group = satellites[first:first + chunk_size]
+        errors, r_teme, _ = SatrecArray([satellite.model for satellite in group]).sgp4(jd, fr)
+        elevations = _elevation_degrees(errors, r_teme, jd, fr, dut1, observer_location)
+        above = elevations > 0
+
+        # +1 where a satellite rises between two grid points, -1 where it sets
+        transitions = np.diff(above.astype(np.int8), axis=1)
+        sat_idx, step_idx = np.nonzero(transitions)
+        kind = transitions[sat_idx, step_idx]
+
+        # Only keep complete passes: a rise directly followed by a set of the same satellite
+        paired = (kind[:-1] == 1) & (kind[1:] == -1) & (sat_idx[:-1] == sat_idx[1:])
+        rise_idx = np.nonzero(paired)[0]
+
+        group_rise_times, group_set_times, group_qualities = _refine_passes(group, elevations, grid, sat_idx[rise_idx], step_idx[rise_idx], step_idx[rise_idx + 1],
+                                                                            dut1, observer_location, tolerance_seconds, elevation_mask)
+        sat_indices.append(sat_idx[rise_idx] + first)
+        rise_times.append(group_rise_times)
+        set_times.append(group_set_times)
+        qualities.append(group_qualities)
+
+    sat_indices, rise_times, set_times, qualities = np.concatenate(sat_indices), np.concatenate(rise_times), np.concatenate(set_times), np.concatenate(qualities)
+    order = np.argsort(rise_times, kind="stable")
+    return sat_indices[order], rise_times[order], set_times[order], qualities[order]
+
+
+def _windows_to_local(satellites, sat_indices, rise_times, set_times, qualities, observer_location):
+    # Windows with their PassQuality in the observer's local timezone
+    local_timezone = pytz.timezone(determine_timezone(observer_location.latitude.degrees, observer_location.longitude.degrees))
+    windows = []
+    for sat_i, rise_unix, set_unix, (max_elevation, culmination_unix, seconds_above_mask) in zip(sat_indices, rise_times, set_times, qualities.tolist()):
+        satellite = satellites[sat_i]
+        rise_time = datetime.fromtimestamp(rise_unix, tz=pytz.utc).astimezone(local_timezone)
+        set_time = datetime.fromtimestamp(set_unix, tz=pytz.utc).astimezone(local_timezone)
+        culmination_time = datetime.fromtimestamp(culmination_unix, tz=pytz.utc).astimezone(local_timezone)
+        windows.append(Window(satellite.name, rise_time, set_time, satellite, PassQuality(max_elevation, culmination_time, seconds_above_mask)))
+    return windows
 
-    # Sort the windows by their start time
-    all_windows.sort(key=lambda x: x[1])
+
+def get_all_viewing_windows_batch(satellites, start_time, end_time, observer_location, step_seconds=BATCH_STEP_SECONDS, tolerance_seconds=BATCH_TOLERANCE_SECONDS, elevation_mask=0.0):
+    # Batch version of get_all_viewing_windows for whole catalogs. All satellites are propagated on
+    # one shared time grid with SGP4 array calls, rise/set events are detected from horizon
+    # crossings between grid points and refined by bisection. Passes shorter than step_seconds
+    # can fall between two grid points and be missed.
+    # Returns Windows sorted by rise time, their quality measured against elevation_mask.
+    if start_time.tzinfo is None or start_time.tzinfo.utcoffset(start_time) is None:
+        logger.error("start_time must be timezone-aware")
+        raise ValueError("start_time must be timezone-aware")
+    if end_time.tzinfo is None or end_time.tzinfo.utcoffset(end_time) is None:
+        logger.error("end_time must be timezone-aware")
+        raise ValueError("end_time must be timezone-aware")
+
+    sat_indices, rise_times, set_times, qualities = _batch_windows_unix(satellites, start_time.timestamp(), end_time.timestamp(), observer_location, step_seconds, tolerance_seconds, elevation_mask)
+    windows = _windows_to_local(satellites, sat_indices, rise_times, set_times, qualities, observer_location)
+    logger.info(f"Computed {len(windows)} viewing windows for {len(satellites)} satellites between {start_time} and {end_time}")
+    return windows
+
+
+def _parallel_windows_worker(names, line1s, line2s, start_unix, end_unix, latitude, longitude, elevation_m, elevation_mask):
+    # Runs in a worker process: TLEs come in as plain strings, windows go back as compact arrays
+    worker_ts = load.timescale()
+    satellites = [EarthSatellite(line1, line2, name, worker_ts) for name, line1, line2 in zip(names, line1s, line2s)]
+    observer_location = wgs84.latlon(latitude, longitude, elevation_m)
+    sat_indices, rise_times, set_times, qualities = _batch_windows_unix(satellites, start_unix, end_unix, observer_location, elevation_mask=elevation_mask)
+    return sat_indices.astype(np.int32), rise_times, set_times, qualities
+
+
+def _parallel_windows_unix(satellites, start_unix, end_unix, observer_location, executor, elevation_mask=0.0):
+    # Fan the catalog out over a process pool in contiguous chunks, two per core to even out the load
+    chunk_size = max(1, -(-len(satellites) // (2 * (os.cpu_count() or 1))))
+    futures = []
+    for first in range(0, len(satellites), chunk_size):
+        group = satellites[first:first + chunk_size]
+        lines = [export_tle(satellite.model) for satellite in group]
+        futures.append((first, executor.submit(_parallel_windows_worker, [satellite.name for satellite in group], [line[0] for line in lines], [line[1] for line in lines],
+                                                start_unix, end_unix, observer_location.latitude.degrees, observer_location.longitude.degrees, observer_location.elevation.m, elevation_mask)))
+
+    sat_indices, rise_times, set_times, qualities = [np.array([], dtype=np.int64)], [np.array([])], [np.array([])], [np.zeros((0, 3))]
+    for first, future in futures:
+        chunk_indices, chunk_rise_times, chunk_set_times, chunk_qualities = future.result()
+        sat_indices.append(chunk_indices.astype(np.int64) + first)
+        rise_times.append(chunk_rise_times)
+        set_times.append(chunk_set_times)
+        qualities.append(chunk_qualities)
+
+    sat_indices, rise_times, set_times, qualities = np.concatenate(sat_indices), np.concatenate(rise_times), np.concatenate(set_times), np.concatenate(qualities)
+    order = np.argsort(rise_times, kind="stable")
+    return sat_indices[order], rise_times[order], set_times[order], qualities[order]
+
+
+def create_schedule_executor(workers=None):
+    # Process pool for parallel window computation. Spawned rather than forked: the tracker forks from
+    # a multi-threaded process and a forked child could inherit a held lock.
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+
+
+def _windows_unix(satellites, start_unix, end_unix, observer_location, executor=None, elevation_mask=0.0):
+    if executor is None:
+        return _batch_windows_unix(satellites, start_unix, end_unix, observer_location, elevation_mask=elevation_mask)
+    return _parallel_windows_unix(satellites, start_unix, end_unix, observer_location, executor, elevation_mask)
+
+
+def _elevation_mask(pass_filter):
+    return 0.0 if pass_filter is None else pass_filter.elevation_mask
+
+
+def get_viewing_windows(satellites, start_time, end_time, observer_location, cache=None, executor=None, pass_filter=None):
+    # Batch viewing windows, served from a pass_cache.PassCache when one is given so only the
+    # time spans it has not seen yet for these TLEs and this location are computed. With an
+    # executor (see create_schedule_executor) the computation is spread over its worker processes.
+    # Each Window carries its quality, measured against the elevation mask of the PassFilter when
+    # one is given; low quality passes are then left out.
+    sat_indices, rise_times, set_times, qualities = _cached_windows_unix(satellites, start_time.timestamp(), end_time.timestamp(), observer_location, cache, executor, _elevation_mask(pass_filter))
+    windows = _windows_to_local(satellites, sat_indices, rise_times, set_times, qualities, observer_location)
+    return windows if pass_filter is None else filter_windows(windows, pass_filter)
+
+
+def _cached_windows_unix(satellites, start_unix, end_unix, observer_location, cache=None, executor=None, elevation_mask=0.0):
+    # _windows_unix through the pass cache when there is one
+    if cache is None:
+        return _windows_unix(satellites, start_unix, end_unix, observer_location, executor, elevation_mask)
+
+    def compute_windows(group, start, end):
+        sat_indices, rise_times, set_times, qualities = _windows_unix(group, start, end, observer_location, executor, elevation_mask)
+        return [(group[sat_i], rise, set_, tuple(quality)) for sat_i, rise, set_, quality in zip(sat_indices, rise_times.tolist(), set_times.tolist(), qualities.tolist())]
+
+    cached = cache.get_windows(satellites, start_unix, end_unix, observer_location, compute_windows, elevation_mask)
+    positions = {id(satellite): i for i, satellite in enumerate(satellites)}
+    return (np.array([positions[id(satellite)] for satellite, _, _, _ in cached], dtype=int),
+            np.array([window[1] for window in cached], dtype=float), np.array([window[2] for window in cached], dtype=float),
+            np.array([window[3] for window in cached], dtype=float).reshape(-1, 3))
+
+
+def iter_viewing_windows(satellites, start_time, observer_location, end_time=None, chunk_seconds=ROLLING_CHUNK_SECONDS, executor=None, cache=None, pass_filter=None):
+    # Lazily yields Windows in rise time order across all satellites, computing one chunk of the
+    # horizon at a time so memory and work per step stay the same however long the campaign is.
+    # Runs forever when end_time is None. With a pass_cache.PassCache, chunks already computed (by
+    # add_to_queue or an earlier campaign) are served from it. With a PassFilter, low quality passes
+    # are left out.
+    chunk_start = start_time.timestamp()
+    end = None if end_time is None else end_time.timestamp()
+    while end is None or chunk_start < end:
+        chunk_end = chunk_start + chunk_seconds
+        compute_end = chunk_end + ROLLING_PADDING_SECONDS
+        if end is not None:
+            chunk_end, compute_end = min(chunk_end, end), min(compute_end, end)
+        sat_indices, rise_times, set_times, qualities = _cached_windows_unix(satellites, chunk_start, compute_end, observer_location, cache, executor, _elevation_mask(pass_filter))
+        # Passes rising after the chunk belong to the next one
+        keep = rise_times < chunk_end
+        windows = _windows_to_local(satellites, sat_indices[keep], rise_times[keep], set_times[keep], qualities[keep], observer_location)
+        yield from (windows if pass_filter is None else filter_windows(windows, pass_filter))
+        chunk_start = chunk_end
+
+
+def _windows_by_satellite(satellites, start_time, end_time, topos, cache=None, executor=None, pass_filter=None):
+    # Group the batch windows per satellite object, each list sorted by rise time
+    windows = {id(satellite): [] for satellite in satellites}
+    for _, rise_time, set_time, satellite in get_viewing_windows(satellites, start_time, end_time, topos, cache, executor, pass_filter):
+        windows[id(satellite)].append((rise_time, set_time))
+    return windows
+
+def get_non_overlapping_non_repeating_schedule(satellites, start_time, end_time, topos, cache=None, pass_filter=None, executor=None):
+    # Fetch all viewing windows for all satellites
+    # (already sorted by their start time)
+    all_windows = get_viewing_windows(satellites, start_time, end_time, topos, cache, executor, pass_filter)
 
     last_set_time = None
     seen_satellites = set()  # To track satellites we've already seen
@@ -87,50 +440,20 @@ def get_non_overlapping_non_repeating_schedule(satellites, start_time, end_time,
 
     return non_overlapping_non_repeating_windows
 
-def get_sequential_tracking_schedule(satellites, start_time, end_time, topos):
+def get_sequential_tracking_schedule(satellites, start_time, end_time, topos, cache=None, pass_filter=None):
     empty_sats = []
-    return add_to_sequential_schedule(empty_sats,satellites, start_time, end_time, topos)
+    return add_to_sequential_schedule(empty_sats,satellites, start_time, end_time, topos, cache, pass_filter)
 
-def get_sequential_tracking_spaced(existing_schedule, satellites_to_add, start_time, end_time, topos):
-    new_schedule = existing_schedule.copy()
-
-    for satellite in satellites_to_add:
-        windows = get_all_viewing_windows(satellite, start_time, end_time, topos)
-        sorted_windows = sorted(windows, key=lambda x: x[0])
-
-        for rise_time, set_time in sorted_windows:
-            if not new_schedule:
-                # If the schedule is empty, add the first window
-                new_schedule.append((satellite.name, rise_time, set_time, satellite))
-                break
-
-            # Calculate the duration of the last pass
-            last_pass_duration = (new_schedule[-1][2] - new_schedule[-1][1]).total_seconds()
-
-            # Calculate the required break time as 70% of the last pass duration
-            required_break = last_pass_duration * 0.7
-
-            # Calculate the earliest start time for the next pass
-            earliest_next_pass = new_schedule[-1][2] + timedelta(seconds=required_break)
-
-            # If the rise time is after the required break period, schedule the pass
-            if rise_time >= earliest_next_pass:
-                new_schedule.append((satellite.name, rise_time, set_time, satellite))
-                break  # Exit after scheduling the first valid window
-
-    return new_schedule
-
-def add_to_sequential_schedule(existing_schedule, satellites_to_add, start_time, end_time, topos):
+def add_to_sequential_schedule(existing_schedule, satellites_to_add, start_time, end_time, topos, cache=None, pass_filter=None):
     # If there's an existing schedule, pick the end time of the last satellite. Otherwise, use the start_time as the starting point.
     current_start_time = existing_schedule[-1][2] if len(existing_schedule) > 0 else start_time
     new_schedule = []
+    all_windows = _windows_by_satellite(satellites_to_add, current_start_time, end_time, topos, cache, pass_filter=pass_filter)
 
     # Iterate over the satellites to add
     for satellite in satellites_to_add:
-        windows = get_all_viewing_windows(satellite, current_start_time, end_time, topos)
-        
-        # Sort the windows based on the rise time
-        sorted_windows = sorted(windows, key=lambda x: x[0])
+        # Windows are sorted on the rise time, skip the ones before the current start time
+        sorted_windows = [window for window in all_windows[id(satellite)] if window[0] >= current_start_time]
 
         # If there are windows available for the satellite
         for rise_time, set_time in sorted_windows:
@@ -164,12 +487,87 @@ def get_azimuth_elevation(satellite, observer_location):
     return az.degrees, alt.degrees
 
 
-def get_sequential_tracking_spaced(existing_schedule, satellites_to_add, start_time, end_time, topos):
+def get_azimuth_elevation_array(satellite, observer_location, unix_times):
+    # Vectorized get_azimuth_elevation for an array of unix timestamps, one SGP4 array call
+    unix_times = np.asarray(unix_times, dtype=float)
+    jd, fr = _julian_dates(unix_times)
+    dut1 = float(ts.from_datetime(datetime.fromtimestamp(unix_times[0], tz=pytz.utc)).dut1)
+    errors, r_teme, _ = satellite.model.sgp4_array(jd, fr)
+    east, north, up = _topocentric_enu(r_teme, jd, fr, dut1, observer_location)
+    azimuth = np.degrees(np.arctan2(east, north)) % 360
+    elevation = np.degrees(np.arctan2(up, np.hypot(east, north)))
+    return azimuth, elevation
+
+
+def get_range_rate_array(satellite, observer_location, unix_times):
+    # Observer -> satellite range (km) and its rate of change (km/s) for an array of unix timestamps.
+    # The observer is fixed in the Earth-fixed frame, so the rate is the Earth-fixed velocity (TEME
+    # velocity rotated, minus the Earth rotation term) projected on the line of sight.
+    unix_times = np.asarray(unix_times, dtype=float)
+    jd, fr = _julian_dates(unix_times)
+    dut1 = float(ts.from_datetime(datetime.fromtimestamp(unix_times[0], tz=pytz.utc)).dut1)
+    _, r_teme, v_teme = satellite.model.sgp4_array(jd, fr)
+    theta, theta_dot = theta_GMST1982(jd, fr + dut1 / SECONDS_PER_DAY)
+    omega = theta_dot / SECONDS_PER_DAY
+    cos_theta, sin_theta = np.cos(theta), np.sin(theta)
+    position, _ = _observer_axes(observer_location)
+    x = cos_theta * r_teme[:, 0] + sin_theta * r_teme[:, 1]
+    y = cos_theta * r_teme[:, 1] - sin_theta * r_teme[:, 0]
+    vx = cos_theta * v_teme[:, 0] + sin_theta * v_teme[:, 1] + omega * y
+    vy = cos_theta * v_teme[:, 1] - sin_theta * v_teme[:, 0] - omega * x
+    dx, dy, dz = x - position[0], y - position[1], r_teme[:, 2] - position[2]
+    distance = np.sqrt(dx * dx + dy * dy + dz * dz)
+    range_rate = (dx * vx + dy * vy + dz * v_teme[:, 2]) / distance
+    return distance, range_rate
+
+
+def get_doppler_shift_array(satellite, observer_location, unix_times, frequency):
+    # Received minus transmitted frequency in Hz, positive while the satellite approaches
+    _, range_rate = get_range_rate_array(satellite, observer_location, unix_times)
+    return -frequency * range_rate / SPEED_OF_LIGHT_KM_S
+
+
+def get_pass_quality(satellite, observer_location, rise_time, set_time, elevation_mask=0.0, step_seconds=QUALITY_STEP_SECONDS):
+    # Maximum elevation, culmination time and time above elevation_mask of one pass, from the pass
+    # sampled every step_seconds with the peak refined by a parabola through its neighbours
+    times = np.append(np.arange(rise_time.timestamp(), set_time.timestamp(), step_seconds), set_time.timestamp())
+    _, elevations = get_azimuth_elevation_array(satellite, observer_location, times)
+    peak = int(np.argmax(elevations))
+    max_elevation, culmination = elevations[peak], times[peak]
+    if 0 < peak < len(times) - 1:
+        before, after = elevations[peak - 1], elevations[peak + 1]
+        curvature = before - 2 * max_elevation + after
+        if curvature < 0:
+            offset = 0.5 * (before - after) / curvature
+            culmination += offset * (times[peak + 1] - times[peak - 1]) / 2
+            max_elevation -= 0.25 * (before - after) * offset
+    seconds_above_mask = float(np.sum(np.diff(times)[(elevations[:-1] > elevation_mask) & (elevations[1:] > elevation_mask)]))
+    return PassQuality(float(max_elevation), datetime.fromtimestamp(culmination, tz=pytz.utc).astimezone(rise_time.tzinfo), seconds_above_mask)
+
+
+def annotate_windows(windows, observer_location, elevation_mask=0.0):
+    # PassQuality of each (name, rise_time, set_time, satellite) window, in the same order, for windows
+    # that do not come from the batch propagation and so carry no quality
+    return [get_pass_quality(satellite, observer_location, rise_time, set_time, elevation_mask) for _, rise_time, set_time, satellite in windows]
+
+
+def passes_filter(quality, pass_filter):
+    return quality.max_elevation >= pass_filter.min_max_elevation and quality.seconds_above_mask >= pass_filter.min_seconds_above_mask
+
+
+def filter_windows(windows, pass_filter):
+    # Windows whose carried PassQuality clears the filter
+    return [window for window in windows if passes_filter(window.quality, pass_filter)]
+
+
+def get_sequential_tracking_spaced(existing_schedule, satellites_to_add, start_time, end_time, topos, cache=None, pass_filter=None, required_break=None, executor=None):
+    # required_break(previous, following) is the break needed between two passes, spaced_break by
+    # default; trajectory.make_slew_break gives the real slew time of the mount
     new_schedule = existing_schedule.copy()
+    all_windows = _windows_by_satellite(satellites_to_add, start_time, end_time, topos, cache, executor, pass_filter)
 
     for satellite in satellites_to_add:
-        windows = get_all_viewing_windows(satellite, start_time, end_time, topos)
-        sorted_windows = sorted(windows, key=lambda x: x[0])
+        sorted_windows = all_windows[id(satellite)]
 
         for rise_time, set_time in sorted_windows:
             if not new_schedule:
@@ -177,34 +575,126 @@ def get_sequential_tracking_spaced(existing_schedule, satellites_to_add, start_t
                 new_schedule.append((satellite.name, rise_time, set_time, satellite))
                 break
 
-            # Calculate the duration of the last pass
-            last_pass_duration = (new_schedule[-1][2] - new_schedule[-1][1]).total_seconds()
-
-            # Calculate the required break time as 70% of the last pass duration
-            required_break = last_pass_duration * 0.7
+            item = (satellite.name, rise_time, set_time, satellite)
 
             # Calculate the earliest start time for the next pass
-            earliest_next_pass = new_schedule[-1][2] + timedelta(seconds=required_break)
+            earliest_next_pass = new_schedule[-1][2] + (required_break or spaced_break)(new_schedule[-1], item)
 
             # If the rise time is after the required break period, schedule the pass
             if rise_time >= earliest_next_pass:
-                new_schedule.append((satellite.name, rise_time, set_time, satellite))
+                new_schedule.append(item)
                 break  # Exit after scheduling the first valid window
 
     return new_schedule
 
-def load_tle_from_string(tle_string):
-    lines = tle_string.strip().split("\n")
-    satellites = []
-    
-    for i in range(0, len(lines), 3):
-        name = lines[i].strip()
-        line1 = lines[i+1].strip()
-        line2 = lines[i+2].strip()
-        satellite = EarthSatellite(line1, line2, name, load.timescale())
-        satellites.append(satellite)
-    
-    return satellites
+def spaced_break(previous, following):
+    # Break required after a pass before the next one starts: 70% of the pass duration
+    return (previous[2] - previous[1]) * 0.7
+
+
+def add_to_schedule_index(index, satellites_to_add, start_time, end_time, topos, cache=None, required_break=spaced_break, executor=None, pass_filter=None):
+    # Incremental version of get_sequential_tracking_spaced on a ScheduleIndex: each satellite gets its
+    # first window that fits in any gap of the existing schedule, without rebuilding or reordering it
+    all_windows = _windows_by_satellite(satellites_to_add, start_time, end_time, topos, cache, executor, pass_filter)
+    added = []
+    for satellite in satellites_to_add:
+        for rise_time, set_time in all_windows[id(satellite)]:
+            item = (satellite.name, rise_time, set_time, satellite)
+            if index.insert_if_free(item, required_break):
+                added.append(item)
+                break
+    return added
+
+
+def add_weighted_optimal_to_index(index, satellites_to_add, start_time, end_time, topos, priorities=None, min_gap_seconds=0, cache=None, executor=None, pass_filter=None, required_break=None):
+    # Weighted interval scheduling over every candidate window of satellites_to_add: adds to the index
+    # the set of passes, at least min_gap_seconds apart, with the largest total weight (pass duration
+    # times the satellite's priority, 1 by default). Passes already in the index are kept as they are
+    # and new passes only fill the gaps around them. O(n log n) in the number of candidate windows.
+    # With a PassFilter, low quality passes are dropped and the weight uses the time above the
+    # elevation mask instead of the whole pass duration, so grazing passes rank lower.
+    # required_break(previous, following), e.g. the mount slew time, is added to the minimum gap. The
+    # DP then walks back past candidates too close to each pass, which is exact when the break only
+    # grows the gap a little; the final inserts re-check every break.
+    priorities = priorities or {}
+    gap = timedelta(seconds=min_gap_seconds)
+    fixed_break = lambda previous, following: gap
+    if required_break is not None:
+        pair_break = lambda previous, following: gap + required_break(previous, following)
+    else:
+        pair_break = fixed_break
+
+    candidates = [window for window in get_viewing_windows(satellites_to_add, start_time, end_time, topos, cache, executor, pass_filter)
+                  if not index.conflicts(window, fixed_break)]
+    if pass_filter is None:
+        weighted = [(window, (window[2] - window[1]).total_seconds()) for window in candidates]
+    else:
+        weighted = [(window, window.quality.seconds_above_mask) for window in candidates]
+    weighted.sort(key=lambda x: x[0][2])
+    candidates = [window for window, _ in weighted]
+    set_times = [window[2] for window in candidates]
+
+    # best[j] is the largest weight achievable with the first j candidates (ordered by set time)
+    best = [0.0] * (len(candidates) + 1)
+    previous = [0] * len(candidates)
+    for j, ((sat_name, rise_time, set_time, _), seconds) in enumerate(weighted):
+        # Number of candidates that end at least gap before this one rises
+        previous[j] = bisect.bisect_right(set_times, rise_time - gap, 0, j)
+        while required_break is not None and previous[j] > 0 and set_times[previous[j] - 1] + pair_break(candidates[previous[j] - 1], candidates[j]) > rise_time:
+            previous[j] -= 1
+        weight = seconds * priorities.get(sat_name, 1.0)
+        best[j + 1] = max(best[j], best[previous[j]] + weight)
+
+    chosen = []
+    j = len(candidates)
+    while j > 0:
+        if best[j] == best[j - 1]:
+            j -= 1
+        else:
+            chosen.append(candidates[j - 1])
+            j = previous[j - 1]
+
+    chosen.sort(key=lambda x: x[1])
+    if required_break is None:
+        for item in chosen:
+            index.insert(item)
+        return chosen
+    return [item for item in chosen if index.insert_if_free(item, pair_break)]
+
+
+def get_weighted_optimal_schedule(existing_schedule, satellites_to_add, start_time, end_time, topos, priorities=None, min_gap_seconds=0, cache=None, pass_filter=None, required_break=None, executor=None):
+    index = ScheduleIndex(existing_schedule)
+    add_weighted_optimal_to_index(index, satellites_to_add, start_time, end_time, topos, priorities, min_gap_seconds, cache, executor, pass_filter, required_break)
+    return index.to_list()
+
+
+def get_schedule_recorded_seconds(schedule):
+    return sum((set_time - rise_time).total_seconds() for _, rise_time, set_time, _ in schedule)
+
+
+def compare_schedule_modes(existing_schedule, satellites_to_add, start_time, end_time, topos, priorities=None, min_gap_seconds=0, cache=None, pass_filter=None, required_break=None, executor=None, optimal_schedule=None):
+    # Total recorded seconds of the optimal schedule next to the greedy ones for the same request.
+    # optimal_schedule is the optimal result when the caller already has it, it is not planned again
+    if optimal_schedule is None:
+        optimal_schedule = get_weighted_optimal_schedule(existing_schedule, satellites_to_add, start_time, end_time, topos, priorities, min_gap_seconds, cache, pass_filter, required_break, executor)
+    report = {
+        "optimal": get_schedule_recorded_seconds(optimal_schedule),
+        "spaced": get_schedule_recorded_seconds(get_sequential_tracking_spaced(existing_schedule, satellites_to_add, start_time, end_time, topos, cache, pass_filter, required_break, executor)),
+        "non_overlapping": get_schedule_recorded_seconds(get_non_overlapping_non_repeating_schedule(satellites_to_add, start_time, end_time, topos, cache, pass_filter, executor)),
+    }
+    logger.info(f"Recorded seconds per schedule mode: {report}")
+    return report
+
+
+def load_tle_catalog(tle_string, cache_dir=None):
+    # 3LE or 2LE text, malformed entries dropped and only the newest epoch of each object kept, the
+    # dropped ones listed in the catalog's rejected. All satellites share the module timescale
+    # instead of loading one each. With cache_dir the parsed catalog is kept there in binary form.
+    return TLECatalog.from_string(tle_string, ts, cache_dir)
+
+
+def load_tle_from_string(tle_string, cache_dir=None):
+    return load_tle_catalog(tle_string, cache_dir).satellites()
 
 if __name__ == "__main__":
     # tle_file = 'satellites.tle'
@@ -212,9 +702,9 @@ if __name__ == "__main__":
     # satellites = load.tle_file(tle_file)
 
 
-    satellites = load.tle_file("satellites.tle")
-    satellites_dict = {sat.name: sat for sat in satellites}
-    specific_satellite = satellites_dict.get("Iridum 44")  # Replace with the desired satellite name
+    catalog = TLECatalog.from_file("satellites.tle", ts, cache_path="satellites.tle.npy")
+    satellites = catalog.satellites()
+    specific_satellite = catalog.get("Iridum 44")  # Replace with the desired satellite name or NORAD ID
 
     latitude, longitude  = 37.229572, -80.413940
     local_timezone = pytz.timezone(determine_timezone(latitude, longitude))
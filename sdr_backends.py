@@ -0,0 +1,244 @@
+import abc
+import json
+import os
+import random
+import time
+from collections import namedtuple
+from types import SimpleNamespace
+
+import numpy as np
+
+from iq_container import SIGMF_DATATYPES, to_complex64
+
+try:
+    import SoapySDR as sdr
+except ImportError:
+    # Without SoapySDR only the stand-in devices below are available. The constants match SoapySDR's.
+    class _MissingDevice:
+        def __init__(self, *args, **kwargs):
+            raise RuntimeError("SoapySDR is not installed, only the synthetic and replay devices are available")
+
+        @staticmethod
+        def enumerate(*args):
+            return []
+
+    sdr = SimpleNamespace(SOAPY_SDR_TX=0, SOAPY_SDR_RX=1, SOAPY_SDR_CF32="CF32", SOAPY_SDR_CS16="CS16", SOAPY_SDR_CS8="CS8",
+                          SOAPY_SDR_TIMEOUT=-1, SOAPY_SDR_STREAM_ERROR=-2, SOAPY_SDR_CORRUPTION=-3, SOAPY_SDR_OVERFLOW=-4,
+                          SOAPY_SDR_HAS_TIME=1 << 2, Device=_MissingDevice)
+
+
+# Samples a stand-in device holds before an unread backlog overflows, in seconds at its sample rate
+DEVICE_BUFFER_SECONDS = 0.05
+# readStream timeout, as SoapySDR's default
+READ_TIMEOUT_US = 100000
+
+# Result of readStream, with the fields of SoapySDR's StreamResult the recorder reads
+StreamResult = namedtuple("StreamResult", ["ret", "flags", "timeNs"])
+
+# SigMF datatype of each stream format the stand-ins can produce
+STREAM_DATATYPES = {"CF32": "cf32_le", "CS16": "ci16_le", "CS8": "ci8"}
+
+
+def from_complex64(samples, stream_format):
+    # complex64 samples (full scale +-1) as the raw bytes of stream_format
+    if stream_format == "CF32":
+        return samples.astype(np.complex64).view(np.uint8)
+    dtype, full_scale = SIGMF_DATATYPES[STREAM_DATATYPES[stream_format]]
+    values = np.clip(np.round(samples.view(np.float32) * (full_scale - 1)), -full_scale, full_scale - 1)
+    return values.astype(dtype).view(np.uint8)
+
+
+class PacedDevice(abc.ABC):
+    """Base of the stand-in devices: the SoapySDR Device calls the recorder makes, paced like hardware.
+
+    Samples arrive at the configured sample rate from activateStream on. readStream waits until the
+    requested samples have arrived or the timeout passes. A backlog larger than the device buffer is
+    dropped and reported as an overflow, with the stream timestamps jumping over the lost samples the
+    way a real tuner's do. Subclasses fill the buffers in fill().
+
+    overflow_probability and timeout_probability inject those errors into that share of the reads.
+    """
+
+    label = "Stand-in"
+
+    def __init__(self, buffer_seconds=DEVICE_BUFFER_SECONDS, overflow_probability=0.0, timeout_probability=0.0, seed=None):
+        self.buffer_seconds = buffer_seconds
+        self.overflow_probability = overflow_probability
+        self.timeout_probability = timeout_probability
+        self.random = random.Random(seed)
+        self.sample_rate = 2e6
+        self.frequency = 0.0
+        self.stream_format = "CF32"
+        self.channels = [0]
+        self.active = False
+        self.start = None
+        # Samples delivered or dropped since activateStream
+        self.position = 0
+        self.dropped = 0
+
+    def getStreamFormats(self, direction, channel):
+        return ["CS8", "CS16", "CF32"]
+
+    def setSampleRate(self, direction, channel, rate):
+        self.sample_rate = float(rate)
+
+    def setFrequency(self, direction, channel, frequency):
+        self.frequency = float(frequency)
+
+    def setBandwidth(self, direction, channel, bandwidth):
+        pass
+
+    def setGain(self, direction, channel, gain):
+        pass
+
+    def setupStream(self, direction, stream_format, channels):
+        self.stream_format = stream_format
+        self.channels = list(channels)
+        return self
+
+    def activateStream(self, stream):
+        self.active = True
+        self.start = time.monotonic()
+        self.position = 0
+
+    def deactivateStream(self, stream):
+        self.active = False
+
+    def closeStream(self, stream):
+        pass
+
+    def close(self):
+        pass
+
+    def drop(self, count):
+        # Skip count samples of the source, subclasses with a position in their data follow it
+        self.position += count
+        self.dropped += count
+
+    def readStream(self, stream, buffers, count, flags=0, timeoutUs=READ_TIMEOUT_US):
+        if self.random.random() < self.timeout_probability:
+            time.sleep(timeoutUs / 1e6)
+            return StreamResult(sdr.SOAPY_SDR_TIMEOUT, 0, 0)
+        arrived = int((time.monotonic() - self.start) * self.sample_rate)
+        backlog = arrived - self.position
+        if backlog > self.buffer_seconds * self.sample_rate or self.random.random() < self.overflow_probability:
+            # The device buffer overran: everything not yet read is lost
+            self.drop(max(backlog, count))
+            return StreamResult(sdr.SOAPY_SDR_OVERFLOW, 0, 0)
+        if backlog < count:
+            wait = (count - backlog) / self.sample_rate
+            if wait > timeoutUs / 1e6:
+                time.sleep(timeoutUs / 1e6)
+                return StreamResult(sdr.SOAPY_SDR_TIMEOUT, 0, 0)
+            time.sleep(wait)
+        time_ns = int(self.position * 1e9 / self.sample_rate)
+        count = self.fill(buffers, count)
+        if count <= 0:
+            time.sleep(timeoutUs / 1e6)
+            return StreamResult(sdr.SOAPY_SDR_TIMEOUT, 0, 0)
+        self.position += count
+        return StreamResult(count, sdr.SOAPY_SDR_HAS_TIME, time_ns)
+
+    @abc.abstractmethod
+    def fill(self, buffers, count):
+        """Write count samples into each of buffers and return how many were written, 0 once out of samples."""
+
+
+class SyntheticDevice(PacedDevice):
+    """Noise with a tone, generated once per format and cycled, so producing samples costs one copy."""
+
+    label = "Synthetic"
+
+    def __init__(self, tone_offset=100e3, tone_amplitude=0.1, noise=0.01, **kwargs):
+        super().__init__(**kwargs)
+        self.tone_offset = tone_offset
+        self.tone_amplitude = tone_amplitude
+        self.noise = noise
+        self.pattern = None
+
+    def activateStream(self, stream):
+        # A whole number of tone periods keeps the cycled pattern continuous
+        rng = np.random.default_rng(0)
+        length = 1 << 20
+        periods = max(1, round(self.tone_offset * length / self.sample_rate))
+        t = np.arange(length)
+        samples = self.tone_amplitude * np.exp(2j * np.pi * periods * t / length)
+        samples += self.noise * (rng.standard_normal(length) + 1j * rng.standard_normal(length))
+        self.pattern = from_complex64(samples.astype(np.complex64), self.stream_format)
+        super().activateStream(stream)
+
+    def fill(self, buffers, count):
+        count = min(count, 1 << 20)
+        sample_size = len(self.pattern) // (1 << 20)
+        start = (self.position % (1 << 20)) * sample_size
+        nbytes = count * sample_size
+        pattern = self.pattern
+        if start + nbytes > len(pattern):
+            pattern = np.concatenate((pattern[start:], pattern[:start]))
+            start = 0
+        for buffer in buffers:
+            buffer.view(np.uint8)[:nbytes] = pattern[start:start + nbytes]
+        return count
+
+
+class ReplayDevice(PacedDevice):
+    """Streams an existing recording (.dat with or without its SigMF sidecar) as if it came off the tuner.
+
+    The file's samples are converted to the stream format the recorder asks for. Every channel gets the
+    same samples. Without loop the stream times out once the file is used up.
+    """
+
+    label = "Replay"
+
+    def __init__(self, path, loop=True, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.loop = loop
+        self.datatype = "cf32_le"
+        meta_path = os.path.splitext(path)[0] + ".sigmf-meta"
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                metadata = json.load(f)["global"]
+            self.datatype = metadata["core:datatype"]
+            self.sample_rate = float(metadata["core:sample_rate"])
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        self.file_sample_size = SIGMF_DATATYPES[self.datatype][0].itemsize * 2
+        self.length = len(self.data) // self.file_sample_size
+
+    def fill(self, buffers, count):
+        offset = self.position % self.length if self.loop else self.position
+        count = min(count, self.length - offset)
+        if count <= 0:
+            return 0
+        raw = self.data[offset * self.file_sample_size:(offset + count) * self.file_sample_size]
+        if STREAM_DATATYPES[self.stream_format] == self.datatype:
+            data = raw
+        else:
+            data = from_complex64(to_complex64(raw, self.datatype), self.stream_format)
+        for buffer in buffers:
+            buffer.view(np.uint8)[:len(data)] = data
+        return count
+
+
+# Device arguments with one of these drivers open a stand-in instead of hardware,
+# e.g. {"driver": "synthetic", "overflow_probability": 0.01} or {"driver": "replay", "path": "pass.dat"}
+BACKENDS = {"synthetic": SyntheticDevice, "replay": ReplayDevice}
+
+
+def open_device(device_args):
+    """A device for device_args: a stand-in device object as is, a stand-in driver's arguments, or SoapySDR."""
+    if hasattr(device_args, "readStream"):
+        return device_args
+    if isinstance(device_args, dict) and device_args.get("driver") in BACKENDS:
+        kwargs = {key: value for key, value in device_args.items() if key != "driver"}
+        return BACKENDS[device_args["driver"]](**kwargs)
+    return sdr.Device(device_args)
+
+
+def device_label(device_args):
+    if hasattr(device_args, "readStream"):
+        return device_args.label
+    if isinstance(device_args, dict):
+        return device_args.get("label", device_args.get("driver", ""))
+    return device_args["label"] if "label" in device_args else str(device_args)
+
@@ -1,51 +1,490 @@
 import os
+import errno
+import bisect
+import fcntl
+import json
+import mmap
 import numpy as np
-import SoapySDR as sdr
-from datetime import datetime
+from datetime import datetime, timezone
 import threading
 import logging
-from queue import Queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import SimpleQueue, Empty
 import time
+from sdr_backends import sdr, open_device, device_label
+from iq_container import BlockCompressor, ContainerWriter, to_complex64
+from channelizer import ChannelExtractor, DEFAULT_CHANNEL_BANDWIDTH
 
-def align_buffer(byte_data, block_size=131072):
-    """Pad the buffer to match the filesystem's block size for direct I/O"""
-    buffer_size = byte_data.nbytes
-    if buffer_size % block_size != 0:
-        padding_size = block_size - (buffer_size % block_size)
-        padding = np.zeros(padding_size, dtype=np.uint8)
-        byte_data = np.concatenate((byte_data, padding))
-    return byte_data.tobytes()
+DATA_BASE_DIR = "/mnt/usbdrive"
+
+# O_DIRECT needs file offsets, lengths and memory aligned to the logical block size, 4 KiB covers USB drives
+DIRECT_IO_ALIGNMENT = 4096
+# Samples are gathered into blocks of this size before each write
+WRITE_BLOCK_SIZE = 4 * 1024 * 1024
+# Where O_DIRECT is not available, written data is flushed and dropped from the page cache this often,
+# small enough that each flush is a short stall instead of one long one at the end
+WRITEBACK_BYTES = 16 * 1024 * 1024
+
+
+class AlignedWriter:
+    """Writes a byte stream to a file in aligned blocks with O_DIRECT, bypassing the page cache.
+
+    Data is gathered in a page-aligned staging block; input that is already aligned and starts on a
+    block boundary is written straight from the caller's memory. Only the final block is padded, and
+    the file is truncated back to the real length on close. Filesystems that refuse O_DIRECT get
+    buffered writes with an fdatasync and posix_fadvise(DONTNEED) every WRITEBACK_BYTES instead, so
+    dirty pages never pile up into a long stall.
+    """
+
+    def __init__(self, path, block_size=WRITE_BLOCK_SIZE):
+        self.path = path
+        self.block_size = block_size
+        self.staging = mmap.mmap(-1, block_size)
+        self.fill = 0
+        self.length = 0
+        self.unsynced = 0
+        try:
+            self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_DIRECT, 0o660)
+            self.direct = True
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+            self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o660)
+            self.direct = False
+
+    def _disable_direct(self):
+        # Some filesystems accept the O_DIRECT open but fail the writes
+        flags = fcntl.fcntl(self.fd, fcntl.F_GETFL)
+        fcntl.fcntl(self.fd, fcntl.F_SETFL, flags & ~os.O_DIRECT)
+        self.direct = False
+
+    def _write_all(self, data):
+        view = memoryview(data)
+        while len(view):
+            try:
+                written = os.write(self.fd, view)
+            except OSError as e:
+                if e.errno != errno.EINVAL or not self.direct:
+                    raise
+                self._disable_direct()
+                continue
+            view = view[written:]
+        if not self.direct:
+            self.unsynced += len(data)
+            if self.unsynced >= WRITEBACK_BYTES:
+                os.fdatasync(self.fd)
+                os.posix_fadvise(self.fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                self.unsynced = 0
+
+    def write(self, data):
+        view = memoryview(data).cast("B")
+        self.length += len(view)
+        if self.fill == 0 and np.frombuffer(view, dtype=np.uint8, count=0).ctypes.data % DIRECT_IO_ALIGNMENT == 0:
+            aligned = len(view) - len(view) % DIRECT_IO_ALIGNMENT
+            if aligned:
+                self._write_all(view[:aligned])
+                view = view[aligned:]
+        while len(view):
+            count = min(len(view), self.block_size - self.fill)
+            self.staging[self.fill:self.fill + count] = view[:count]
+            self.fill += count
+            view = view[count:]
+            if self.fill == self.block_size:
+                self._write_all(self.staging)
+                self.fill = 0
+
+    def close(self):
+        try:
+            if self.fill:
+                # Pad the last block to the alignment, the padding is truncated away below
+                padded = -(-self.fill // DIRECT_IO_ALIGNMENT) * DIRECT_IO_ALIGNMENT
+                self.staging[self.fill:padded] = bytes(padded - self.fill)
+                self._write_all(memoryview(self.staging)[:padded])
+                self.fill = 0
+            os.ftruncate(self.fd, self.length)
+            os.fsync(self.fd)
+        finally:
+            os.close(self.fd)
+            self.staging.close()
 
+# (IF bandwidth, sample rate) pairs of the SDRplay tuners from narrowest to widest
+CAPTURE_SETTINGS = [(200e3, 250e3), (300e3, 500e3), (600e3, 1e6), (1.536e6, 2e6), (5e6, 6e6), (6e6, 8e6), (7e6, 8e6), (8e6, 10e6)]
+# The center frequency follows the Doppler profile, checked this often and retuned when it is off by more than DOPPLER_RETUNE_HZ
+DOPPLER_RETUNE_SECONDS = 0.5
+DOPPLER_RETUNE_HZ = 500
 
+# Sample formats a recording can be stored in: SoapySDR stream format, numpy dtype of one I/Q sample
+# and the SigMF datatype. CS16 is the SDRplay's native 14-bit ADC output at half the size of CF32,
+# CS8 halves it again at the cost of dynamic range.
+SAMPLE_FORMATS = {
+    "CF32": (sdr.SOAPY_SDR_CF32, np.dtype(np.complex64), "cf32_le"),
+    "CS16": (sdr.SOAPY_SDR_CS16, np.dtype([("i", "<i2"), ("q", "<i2")]), "ci16_le"),
+    "CS8": (sdr.SOAPY_SDR_CS8, np.dtype([("i", "i1"), ("q", "i1")]), "ci8"),
+}
+DEFAULT_SAMPLE_FORMAT = "CS16"
+SIGMF_VERSION = "1.0.0"
 
 
-DATA_BASE_DIR = "/mnt/usbdrive"
+def bytes_per_sample(sample_format):
+    return SAMPLE_FORMATS[sample_format][1].itemsize
+
+# Optional compression between producer and consumer: blocks are compressed on this many threads,
+# with at most COMPRESSION_QUEUE_PER_WORKER blocks per worker in flight for each channel
+COMPRESSION_WORKERS = 2
+COMPRESSION_QUEUE_PER_WORKER = 2
+
+# Size of the rolling wideband segments, a completed segment can be fetched while the pass goes on
+SEGMENT_BYTES = 256 * 1024 * 1024
+
+
+class BufferPool:
+    """Fixed set of preallocated, page-aligned sample buffers shared by one producer and one consumer.
+
+    Buffers are handed over by index: the producer takes a free index, reads samples straight into
+    that buffer and puts (index, sample count) on the filled queue; the consumer writes the buffer out
+    and returns the index. Nothing is allocated or copied per chunk and memory never grows past the pool.
+    """
+
+    def __init__(self, count, samples, dtype=np.complex64):
+        dtype = np.dtype(dtype)
+        # Every buffer starts on a page boundary (anonymous mmap memory is page-aligned)
+        stride = -(-samples * dtype.itemsize // mmap.PAGESIZE) * mmap.PAGESIZE
+        self.memory = mmap.mmap(-1, count * stride)
+        self.buffers = [np.frombuffer(self.memory, dtype=dtype, count=samples, offset=i * stride) for i in range(count)]
+        self.free = SimpleQueue()
+        self.filled = SimpleQueue()
+        for i in range(count):
+            self.free.put(i)
+
+    @property
+    def nbytes(self):
+        return len(self.memory)
+
+
+# The producer gives up this long after the recording should have ended if samples stop arriving
+READ_GRACE_SECONDS = 5
+
+# Bucket upper edges in milliseconds of the read and write latency histograms, the last bucket is open
+LATENCY_EDGES_MS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Histogram:
+    def __init__(self, edges):
+        self.edges = edges
+        self.counts = [0] * (len(edges) + 1)
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.edges, value)] += 1
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        return {"edges": list(self.edges), "counts": list(self.counts), "max": self.max}
+
+
+class RecordingStats:
+    """Health counters of one recording, updated live by the producer and consumer threads.
+
+    Counts reads, samples, overflows, timeouts and stream errors, estimates the samples lost in
+    overflows from the gaps in the stream timestamps, tracks how many buffers were waiting to be
+    written (the high-water mark against the pool size shows how close the disk came to losing data)
+    and times every read and write.
+    """
+
+    def __init__(self, channels, sample_rate, queue_capacity):
+        self.lock = threading.Lock()
+        self.sample_rate = sample_rate
+        self.queue_capacity = queue_capacity
+        self.started = None
+        self.finished = None
+        self.reads = 0
+        self.samples = 0
+        self.overflows = 0
+        self.timeouts = 0
+        self.stream_errors = 0
+        self.dropped_samples = 0
+        self.buffer_waits = 0
+        self.next_time_ns = None
+        self.read_latency = Histogram(LATENCY_EDGES_MS)
+        self.write_latency = Histogram(LATENCY_EDGES_MS)
+        self.queue_high_water = {channel: 0 for channel in channels}
+        self.written_bytes = {channel: 0 for channel in channels}
+        self.write_seconds = {channel: 0.0 for channel in channels}
+
+    def start(self):
+        self.started = time.time()
+
+    def finish(self):
+        self.finished = time.time()
+
+    def add_read(self, seconds, ret, flags=0, time_ns=0):
+        with self.lock:
+            self.read_latency.add(seconds * 1000)
+            if ret > 0:
+                self.reads += 1
+                self.samples += ret
+                # With hardware timestamps a jump past the expected time of the next sample is the
+                # number of samples the overflow lost
+                if flags & sdr.SOAPY_SDR_HAS_TIME:
+                    if self.next_time_ns is not None and time_ns > self.next_time_ns:
+                        self.dropped_samples += int(round((time_ns - self.next_time_ns) * self.sample_rate / 1e9))
+                    self.next_time_ns = time_ns + ret * 1e9 / self.sample_rate
+            elif ret == sdr.SOAPY_SDR_TIMEOUT:
+                self.timeouts += 1
+            elif ret == sdr.SOAPY_SDR_OVERFLOW:
+                self.overflows += 1
+            elif ret < 0:
+                # A read of no samples is no error, the producer just reads again
+                self.stream_errors += 1
+
+    def add_queue_depth(self, channel, depth):
+        with self.lock:
+            self.queue_high_water[channel] = max(self.queue_high_water[channel], depth)
+
+    def add_buffer_wait(self):
+        with self.lock:
+            self.buffer_waits += 1
+
+    def add_write(self, channel, nbytes, seconds):
+        with self.lock:
+            self.written_bytes[channel] += nbytes
+            self.write_seconds[channel] += seconds
+            self.write_latency.add(seconds * 1000)
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = ((self.finished or time.time()) - self.started) if self.started else 0.0
+            return {"started": self.started, "elapsed": elapsed, "finished": self.finished is not None,
+                    "reads": self.reads, "samples": self.samples, "overflows": self.overflows, "timeouts": self.timeouts,
+                    "stream_errors": self.stream_errors, "dropped_samples": self.dropped_samples, "buffer_waits": self.buffer_waits,
+                    "queue_capacity": self.queue_capacity, "queue_high_water": dict(self.queue_high_water),
+                    "read_latency_ms": self.read_latency.to_dict(), "write_latency_ms": self.write_latency.to_dict(),
+                    "written_bytes": dict(self.written_bytes),
+                    # Speed of the writes themselves, and the rate data reached the disk over the recording
+                    "write_mb_per_s": {channel: self.written_bytes[channel] / seconds / 1e6 if seconds else None for channel, seconds in self.write_seconds.items()},
+                    "throughput_mb_per_s": sum(self.written_bytes.values()) / elapsed / 1e6 if elapsed else None}
+
+
+def sigmf_datetime(unix_time):
+    return datetime.fromtimestamp(unix_time, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class SegmentedOutput:
+    """One channel of a recording as rolling files of about segment_bytes, plus an index of them.
+
+    A segment ends at the first block boundary past segment_bytes, so each one holds whole blocks. The
+    index (<base>.index.json) maps every segment to its first sample, sample count, size and start and
+    end time. It is rewritten atomically whenever a segment opens or closes, so completed segments can
+    be fetched or analysed while the pass is still recording. on_close(path, sample_start, samples) is
+    called for each finished segment. segment_bytes of 0 writes a single file named <base>.<extension>.
+
+    wrap turns the AlignedWriter of a new segment into the object blocks are written to (a
+    ContainerWriter when compressing).
+    """
+
+    def __init__(self, base_path, extension, segment_bytes, sample_rate, start_time, wrap=None, on_close=None):
+        self.base_path = base_path
+        self.extension = extension
+        self.segment_bytes = segment_bytes
+        self.sample_rate = sample_rate
+        self.start_time = start_time
+        self.wrap = wrap or (lambda writer: writer)
+        self.on_close = on_close
+        self.index_path = base_path + ".index.json"
+        self.segments = []
+        self.writer = None
+        self.output = None
+        self.samples = 0
+        # False once any segment had to fall back to buffered writes
+        self.direct = True
+
+    def current(self):
+        """Where the next block goes, opening a new segment if needed."""
+        if self.output is None:
+            path = f"{self.base_path}_{len(self.segments):04d}.{self.extension}" if self.segment_bytes else f"{self.base_path}.{self.extension}"
+            self.writer = AlignedWriter(path)
+            self.output = self.wrap(self.writer)
+            self.segments.append({"file": os.path.basename(path), "sample_start": self.samples, "samples": 0, "bytes": 0,
+                                  "start_time": self.start_time + self.samples / self.sample_rate, "end_time": None, "complete": False})
+            self.save_index()
+        return self.output
+
+    def written(self, samples):
+        # Account for a block written to current(), closing the segment once it is full
+        segment = self.segments[-1]
+        segment["samples"] += samples
+        self.samples += samples
+        if self.segment_bytes and self.writer.length >= self.segment_bytes:
+            self.close_segment()
+
+    def close_segment(self):
+        segment = self.segments[-1]
+        self.output.close()
+        self.direct = self.direct and self.writer.direct
+        segment.update(bytes=os.path.getsize(os.path.join(os.path.dirname(self.base_path), segment["file"])),
+                       end_time=self.start_time + self.samples / self.sample_rate, complete=True)
+        self.output = self.writer = None
+        if self.on_close is not None:
+            self.on_close(os.path.join(os.path.dirname(self.base_path), segment["file"]), segment["sample_start"], segment["samples"])
+        self.save_index()
+
+    def close(self):
+        if self.output is not None:
+            self.close_segment()
+        self.save_index(finished=True)
+
+    def save_index(self, finished=False):
+        index = {"sample_rate": self.sample_rate, "start_time": self.start_time, "segment_bytes": self.segment_bytes,
+                 "samples": self.samples, "finished": finished, "segments": self.segments}
+        temporary_path = self.index_path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(temporary_path, self.index_path)
+
+
+def choose_capture_settings(signal_bandwidth, doppler_profile=None, retune=True, max_bandwidth=None):
+    """Narrowest (bandwidth, sample_rate) that keeps signal_bandwidth in band for the whole pass.
+
+    With retuning only the drift between two retunes needs a margin, without it the largest shift of
+    the pass does. max_bandwidth caps the choice (the dual tuner is limited to narrower captures).
+    """
+    margin = 0.0
+    if doppler_profile is not None:
+        if retune:
+            margin = doppler_profile.max_drift(DOPPLER_RETUNE_SECONDS) + DOPPLER_RETUNE_HZ
+        else:
+            margin = max(abs(shift) for shift in doppler_profile.span())
+    settings = [setting for setting in CAPTURE_SETTINGS if max_bandwidth is None or setting[0] <= max_bandwidth] or CAPTURE_SETTINGS[:1]
+    for band_width, sample_rate in settings:
+        if band_width >= signal_bandwidth + 2 * margin:
+            return band_width, sample_rate
+    return settings[-1]
+
+
+# Bytes written by the disk probe, enough to get past the write cache of a USB stick
+DISK_PROBE_BYTES = 256 * 1024 * 1024
+# Share of the probed throughput a recording may use, the rest covers filesystem hiccups and other writers
+DISK_MARGIN = 0.7
+
+
+def probe_disk_throughput(directory, size_bytes=DISK_PROBE_BYTES):
+    """Sustained sequential write speed of directory through the recorder's own write path.
+
+    Writes size_bytes with an AlignedWriter, including the final fsync, and deletes the file again.
+    """
+    path = os.path.join(directory, ".disk_probe.tmp")
+    block = np.random.default_rng(0).integers(0, 256, WRITE_BLOCK_SIZE, dtype=np.uint8)
+    start = time.monotonic()
+    writer = AlignedWriter(path)
+    try:
+        for _ in range(max(1, size_bytes // WRITE_BLOCK_SIZE)):
+            writer.write(block)
+    finally:
+        writer.close()
+        os.remove(path)
+    seconds = time.monotonic() - start
+    return {"bytes_per_second": writer.length / seconds, "bytes": writer.length, "seconds": seconds,
+            "direct": writer.direct, "time": time.time()}
+
+
+def cap_to_disk(band_width, sample_rate, sample_format, channels, disk_bytes_per_second, compression_ratio=1.0):
+    """(band_width, sample_rate, sample_format) the disk sustains with DISK_MARGIN to spare.
+
+    Steps down from CF32 to the lossless CS16 first, then to the widest capture setting that fits,
+    and only then to CS8. Returns the narrowest CS8 setting when nothing fits.
+    """
+    budget = disk_bytes_per_second * DISK_MARGIN * compression_ratio
+
+    def fits(rate, sample_format):
+        return rate * bytes_per_sample(sample_format) * channels <= budget
+
+    formats = [sample_format] + [candidate for candidate in ("CS16", "CS8") if bytes_per_sample(candidate) < bytes_per_sample(sample_format)]
+    for candidate in formats:
+        if fits(sample_rate, candidate):
+            return band_width, sample_rate, candidate
+        if candidate == "CF32":
+            continue
+        for setting_band_width, setting_rate in reversed(CAPTURE_SETTINGS):
+            if setting_rate < sample_rate and fits(setting_rate, candidate):
+                return min(band_width, setting_band_width), setting_rate, candidate
+    band_width, sample_rate = CAPTURE_SETTINGS[0]
+    return band_width, sample_rate, formats[-1]
+
 
 class SDRRecorder:
     DEFAULT_SAMPLE_RATE = 2e6
-    BUFFER_SIZE = 1000*100
-
-    def __init__(self, device_args, band_width = None, sat_name="NoName", frequency=1.626e9, mode='single', directory=DATA_BASE_DIR, stop_event = threading.Event()):
-        self.device = sdr.Device(device_args)
+    # Samples per buffer, a whole number of pages
+    BUFFER_SIZE = 1024*100
+    # Buffers per channel: 32 x 800 KiB = 25 MiB, about 1.6 s at 2 MS/s before the SDR overflows
+    BUFFER_COUNT = 32
+
+    def __init__(self, device_args, band_width = None, sat_name="NoName", frequency=1.626e9, mode='single', directory=DATA_BASE_DIR, stop_event = None, sample_rate=None, doppler_profile=None, sample_format=DEFAULT_SAMPLE_FORMAT, compression=None, compression_level=None, compression_workers=COMPRESSION_WORKERS, channel_frequencies=None, channel_bandwidth=DEFAULT_CHANNEL_BANDWIDTH, record_wideband=True, segment_bytes=SEGMENT_BYTES):
+        # SoapySDR device arguments, or a stand-in device from sdr_backends
+        self.device = open_device(device_args)
+        self.device_label = device_label(device_args)
         self.band_width = int(band_width)
-        self.sample_rate = int(self.DEFAULT_SAMPLE_RATE)
+        self.sample_rate = int(sample_rate or self.DEFAULT_SAMPLE_RATE)
         self.mode = mode
-        self.streams = [None] * (2 if mode == 'dual' else 1)
+        # Both tuners of the dual device are read through one stream, so their samples stay aligned
+        self.channels = [0, 1] if mode == 'dual' else [0]
+        self.stream = None
+        # Serializes device configuration (setup, retuning, teardown), stream reads don't take it
         self.lock = threading.Lock()
         self.directory = directory
         self.sat_name = sat_name
         self.frequency = frequency
-        self.queues = [Queue(maxsize=10000) for _ in range(len(self.streams))]
+        self.sample_format = self.negotiate_format(sample_format)
+        self.pools = [BufferPool(self.BUFFER_COUNT, self.BUFFER_SIZE, SAMPLE_FORMATS[self.sample_format][1]) for _ in self.channels]
+        # Wideband files roll over to a new segment after this many bytes, 0 for one file per channel
+        self.segment_bytes = segment_bytes
+
+        # Optional compression codec ("zstd" or "zlib"), each pool buffer becomes one block of a .iqz container
+        self.compressor = None
+        if compression:
+            self.compressor = BlockCompressor(compression, compression_level, SAMPLE_FORMATS[self.sample_format][1].itemsize // 2)
+        self.compression_workers = compression_workers
+        self.compression_pool = None
+        self.containers = []
+        self.compression_stats = None
+        self.recording_started = None
+
+        # Narrow channels extracted from the capture into their own decimated files, for every tuner
+        # channel. Without record_wideband only those files are written.
+        self.channel_frequencies = list(channel_frequencies or [])
+        self.channel_bandwidth = channel_bandwidth
+        self.record_wideband = record_wideband or not self.channel_frequencies
+        self.extractors = {channel: [ChannelExtractor(frequency, frequency - self.frequency, self.sample_rate, channel_bandwidth) for frequency in self.channel_frequencies] for channel in self.channels}
+        self.channel_paths = []
+        self.stats = RecordingStats(self.channels, self.sample_rate, self.BUFFER_COUNT)
         self.producer_threads = []
         self.consumer_threads = []
-        self.stop_event = stop_event
+        # A shared default Event would stay set after the first recording, each recorder gets its own
+        self.stop_event = stop_event if stop_event is not None else threading.Event()
 
+        # Optional trajectory.DopplerProfile of the pass, the center frequency is kept on the shifted signal
+        self.doppler_profile = doppler_profile
+        self.doppler_thread = None
+        self.doppler_stop_event = threading.Event()
+        self.center_frequency = frequency
+        self.tuning_log = []
+        self.timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 
         log_path = os.path.join(self.directory, "slave.log")
 
         logging.basicConfig(level=logging.INFO, filename=log_path, filemode='a', format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         self.logger = logging.getLogger(__name__)
-
+        if self.sample_format != sample_format:
+            self.logger.warning(f"{sample_format} not supported by the device, recording {self.sample_format}")
+
+    def negotiate_format(self, sample_format):
+        # The requested format if every channel can stream it, otherwise CF32 which SoapySDR always converts to
+        if sample_format not in SAMPLE_FORMATS:
+            raise ValueError(f"Unknown sample format {sample_format}")
+        for channel in self.channels:
+            if sample_format not in self.device.getStreamFormats(sdr.SOAPY_SDR_RX, channel):
+                return "CF32"
+        return sample_format
 
     def setup_device(self, channel, frequency, gain):
         with self.lock:
@@ -54,101 +493,296 @@ class SDRRecorder:
             self.device.setBandwidth(sdr.SOAPY_SDR_RX, channel, self.band_width)
             self.device.setGain(sdr.SOAPY_SDR_RX, channel, gain)
 
-    def activate_stream(self, channel):
+    def activate_stream(self):
         with self.lock:
-            if self.streams[channel] is None:
-                self.streams[channel] = self.device.setupStream(sdr.SOAPY_SDR_RX, sdr.SOAPY_SDR_CF32, [channel])
-                self.device.activateStream(self.streams[channel])
+            if self.stream is None:
+                self.stream = self.device.setupStream(sdr.SOAPY_SDR_RX, SAMPLE_FORMATS[self.sample_format][0], self.channels)
+                self.device.activateStream(self.stream)
 
-    def producer(self, channel, duration_seconds, queue):
+    def retune(self, frequency):
+        with self.lock:
+            for channel in self.channels:
+                self.device.setFrequency(sdr.SOAPY_SDR_RX, channel, frequency)
+        self.center_frequency = frequency
+        # Logged at the sample the producer has reached, so the captures start where the file changes
+        # frequency (up to the samples still buffered in the tuner)
+        self.tuning_log.append((self.stats.samples, time.time(), frequency))
+
+    def follow_doppler(self):
+        while not self.doppler_stop_event.wait(DOPPLER_RETUNE_SECONDS):
+            frequency = self.frequency + self.doppler_profile.at(time.time())
+            if abs(frequency - self.center_frequency) > DOPPLER_RETUNE_HZ:
+                self.retune(frequency)
+
+    def get_compression_stats(self):
+        """Compression ratio of the recording and the share of the machine's CPU time compression took."""
+        raw_bytes = sum(container.raw_bytes for container in self.containers)
+        compressed_bytes = sum(container.compressed_bytes for container in self.containers)
+        wall_seconds = time.time() - self.recording_started
+        return {"codec": self.compressor.codec, "level": self.compressor.level, "workers": self.compression_workers,
+                "raw_bytes": raw_bytes, "compressed_bytes": compressed_bytes,
+                "ratio": raw_bytes / compressed_bytes if compressed_bytes else None,
+                "cpu_seconds": self.compressor.cpu_seconds,
+                "cpu_share": self.compressor.cpu_seconds / (wall_seconds * (os.cpu_count() or 1)) if wall_seconds > 0 else None}
+
+    def channel_offset(self, frequency):
+        # Where the channel at nominal frequency sits relative to the tuned center. The center follows
+        # the Doppler shift of self.frequency and the channel's shift scales with its frequency.
+        return frequency * self.center_frequency / self.frequency - self.center_frequency
+
+    def save_stats(self):
+        # Health of the recording next to its files
+        filename = f"{self.sat_name}_Frequency{self.frequency}_SampleRate{self.sample_rate}_{self.timestamp}.stats.json"
+        stats = self.stats.snapshot()
+        with open(os.path.join(self.directory, filename), "w") as f:
+            json.dump(stats, f, indent=2)
+        if stats["overflows"] or stats["dropped_samples"] or stats["buffer_waits"]:
+            self.logger.warning(f"Recording lost data: {stats['overflows']} overflows, {stats['dropped_samples']} samples dropped, {stats['buffer_waits']} waits for a free buffer")
+
+    def save_metadata(self, channel, data_path, extractor=None, sample_start=0, sample_count=None):
+        """Write the SigMF sidecar (.sigmf-meta) describing the recording at data_path.
+
+        Every retune starts a new capture segment, so the center frequency over time needed to undo
+        the Doppler correction travels with the recording. Retunes are logged at a sample index, their
+        wall clock time only fills in core:datetime. An extracted channel (extractor given) was already
+        mixed to DC from its Doppler-shifted position and has a single capture. A file segment holding
+        sample_count samples from sample_start of the recording gets the captures of its own range.
+        """
+        start_time = self.tuning_log[0][1]
+        tuning_log = self.tuning_log if extractor is None else [(0, start_time, extractor.frequency)]
+        sample_rate = self.sample_rate if extractor is None else extractor.output_rate
+        captures = [{"core:sample_start": sample_index,
+                     "core:frequency": frequency,
+                     "core:datetime": sigmf_datetime(unix_time)}
+                    for sample_index, unix_time, frequency in tuning_log]
+        if sample_count is not None:
+            # The capture in effect at the segment's first sample and the retunes within it
+            first = max([i for i, capture in enumerate(captures) if capture["core:sample_start"] <= sample_start], default=0)
+            captures = [dict(capture, **{"core:sample_start": max(capture["core:sample_start"] - sample_start, 0)})
+                        for capture in captures[first:] if capture["core:sample_start"] < sample_start + sample_count] or captures[first:first + 1]
+            captures[0]["core:datetime"] = sigmf_datetime(start_time + sample_start / sample_rate)
+        description = f"{self.sat_name} at {self.frequency} Hz"
+        if extractor is not None:
+            description = f"{self.sat_name} at {extractor.frequency} Hz, {self.channel_bandwidth} Hz channel extracted from the capture at {self.frequency} Hz"
+        metadata = {
+            "global": {
+                "core:datatype": SAMPLE_FORMATS[self.sample_format][2] if extractor is None else "cf32_le",
+                "core:sample_rate": sample_rate,
+                "core:version": SIGMF_VERSION,
+                "core:num_channels": 1,
+                "core:offset": sample_start,
+                "core:dataset": os.path.basename(data_path),
+                "core:hw": f"{self.device_label} channel {channel}, bandwidth {self.band_width} Hz",
+                "core:description": description,
+                "core:recorder": "sdr_recorder.py",
+            },
+            "captures": captures,
+            "annotations": [],
+        }
+        with open(os.path.splitext(data_path)[0] + ".sigmf-meta", "w") as f:
+            json.dump(metadata, f, indent=2)
+
+    def take_free_buffer(self, pool, deadline):
+        # Wait for the consumer to hand back a buffer when all of them are waiting to be written. None once
+        # the recording is stopped or past its deadline: a consumer that died never hands one back
+        while not self.stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                return pool.free.get(timeout=min(remaining, 5))
+            except Empty:
+                self.stats.add_buffer_wait()
+                print("all buffers are full")
+        return None
+
+    def producer(self, duration_seconds):
+        # One thread reads every channel: each readStream fills one buffer per channel with samples
+        # taken at the same instants, and each channel's buffer goes to that channel's consumer
         num_samples = int(self.sample_rate * duration_seconds)
-        buff = np.empty(self.BUFFER_SIZE, dtype=np.complex64)
         samples_collected = 0
+        # A stream that stops delivering (a stalled tuner, the end of a replayed file) still ends on time
+        deadline = time.monotonic() + duration_seconds + READ_GRACE_SECONDS
       
-        while samples_collected < num_samples and not self.stop_event.set():
-            with self.lock:
-                sr = self.device.readStream(self.streams[channel], [buff], len(buff))
+        while samples_collected < num_samples and not self.stop_event.is_set() and time.monotonic() < deadline:
+            indices = []
+            for pool in self.pools:
+                index = self.take_free_buffer(pool, deadline)
+                if index is None:
+                    break
+                indices.append(index)
+            if len(indices) < len(self.pools):
+                for pool, index in zip(self.pools, indices):
+                    pool.free.put(index)
+                if not self.stop_event.is_set():
+                    self.logger.error("No buffer came back from the consumers, stopping the recording")
+                break
+            read_start = time.perf_counter()
+            sr = self.device.readStream(self.stream, [pool.buffers[index] for pool, index in zip(self.pools, indices)], self.BUFFER_SIZE)
+            self.stats.add_read(time.perf_counter() - read_start, sr.ret, sr.flags, sr.timeNs)
             if sr.ret > 0:
-                while True:
-                    try:
-                        queue.put(buff[:sr.ret], block = True, timeout = 5)
-                        break
-                    except:
-                        print("queue is full")
+                for channel, pool, index in zip(self.channels, self.pools, indices):
+                    pool.filled.put((index, sr.ret))
+                    self.stats.add_queue_depth(channel, pool.filled.qsize())
                 samples_collected += sr.ret
-            elif sr.ret == sdr.SOAPY_SDR_TIMEOUT:
+                continue
+            for pool, index in zip(self.pools, indices):
+                pool.free.put(index)
+            if sr.ret == sdr.SOAPY_SDR_TIMEOUT:
                 self.logger.warning("Read stream timeout.")
             elif sr.ret == sdr.SOAPY_SDR_OVERFLOW:
                 self.logger.warning("Overflow occurred.")
             elif sr.ret < 0:
                 self.logger.error(f"Stream error: {sr.ret}")
 
-        # Signal the consumer that the production is done
-        queue.put(None)
+        # Signal the consumers that the production is done
+        for pool in self.pools:
+            pool.filled.put(None)
         print("finished producer thread")
 
-    def consumer(self, channel, queue):
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        filename = f"{self.sat_name}_Frequency{self.frequency}_SampleRate{self.sample_rate}_Channel{channel}_{timestamp}.dat"
-        file_path = os.path.join(self.directory, filename)
-        block_size = 131072  
-        
-        # Open the file with os.open() to get a file descriptor with direct I/O flags
-        fd = os.open(file_path, os.O_WRONLY | os.O_CREAT, 0o660)
+    def channelize(self, channel, data, writers):
+        # Extract every narrow channel from the block and append it to that channel's file
+        samples = to_complex64(data, SAMPLE_FORMATS[self.sample_format][2])
+        for extractor, writer in zip(self.extractors[channel], writers):
+            extractor.offset = self.channel_offset(extractor.frequency)
+            writer.write(extractor.process(samples).view(np.uint8))
+
+    def release(self, pool, index, extraction):
+        # Hand the buffer back to the producer once it is written and its channels are extracted
+        if extraction is None:
+            pool.free.put(index)
+            return
+
+        def done(future):
+            if future.exception() is not None:
+                self.logger.error(f"Channel extraction failed: {future.exception()}")
+            pool.free.put(index)
+        extraction.add_done_callback(done)
+
+    def write_compressed(self, channel, output, pool, future, index, length, count, extraction):
+        # Write a compressed block once it is ready and return its buffer to the producer
+        compressed = future.result()
+        write_start = time.perf_counter()
+        output.current().write_block(compressed, length)
+        output.written(count)
+        self.stats.add_write(channel, len(compressed), time.perf_counter() - write_start)
+        self.release(pool, index, extraction)
+
+    def open_container(self, writer):
+        container = ContainerWriter(writer, self.compressor.codec, SAMPLE_FORMATS[self.sample_format][2], self.compressor.element_size, bytes_per_sample(self.sample_format))
+        self.containers.append(container)
+        return container
+
+    def consumer(self, channel, pool):
+        base_path = os.path.join(self.directory, f"{self.sat_name}_Frequency{self.frequency}_SampleRate{self.sample_rate}_Channel{channel}_{self.timestamp}")
+        output = None
+        if self.record_wideband:
+            # Each raw segment gets its SigMF sidecar as soon as it is complete. A .iqz container is no SigMF
+            # dataset, its own header carries the datatype
+            on_close = None
+            if self.compressor is None:
+                on_close = lambda path, sample_start, samples: self.save_metadata(channel, path, sample_start=sample_start, sample_count=samples if self.segment_bytes else None)
+            output = SegmentedOutput(base_path, "dat" if self.compressor is None else "iqz", self.segment_bytes, self.sample_rate, self.tuning_log[0][1],
+                                     wrap=self.open_container if self.compressor is not None else None,
+                                     on_close=on_close)
+        channel_writers = []
+        for extractor in self.extractors[channel]:
+            channel_path = os.path.join(self.directory, f"{self.sat_name}_Frequency{extractor.frequency}_SampleRate{extractor.output_rate}_Channel{channel}_{self.timestamp}.dat")
+            self.channel_paths.append((channel, channel_path, extractor))
+            channel_writers.append(AlignedWriter(channel_path))
+        # Channels are extracted on a thread of their own, in block order, so extraction overlaps the
+        # wideband writes. A buffer goes back to the producer once both are done with it.
+        extraction_pool = ThreadPoolExecutor(1) if channel_writers else None
+        # Blocks being compressed, written in the order they were read
+        pending = deque()
         
         try:
             while True:
-                data = queue.get()
-                if data is None:  # Check for the sentinel value indicating the end of data
+                item = pool.filled.get()
+                if item is None:  # Check for the sentinel value indicating the end of data
                     break
-                
-                # Convert the complex64 data to bytes
-                byte_data = data.view(np.uint8)
-                # byte_data = data.tobytes()
-       
-                # Ensure the buffer is correctly aligned for direct I/O
-                aligned_data = align_buffer(byte_data, block_size)
-                
-                # Write the aligned data to the file using the file descriptor
-                os.write(fd, aligned_data)
+                index, count = item
+                data = pool.buffers[index][:count].view(np.uint8)
+                extraction = extraction_pool.submit(self.channelize, channel, data, channel_writers) if extraction_pool else None
+
+                if output is None:
+                    self.release(pool, index, extraction)
+                    continue
+                if self.compressor is None:
+                    # Write from the pool buffer, then hand it back to the producer
+                    write_start = time.perf_counter()
+                    output.current().write(data)
+                    output.written(count)
+                    self.stats.add_write(channel, len(data), time.perf_counter() - write_start)
+                    self.release(pool, index, extraction)
+                    continue
+
+                # The buffer goes back to the producer once its block has been compressed
+                pending.append((self.compression_pool.submit(self.compressor.compress, data), index, len(data), count, extraction))
+                while pending and (pending[0][0].done() or len(pending) > self.compression_workers * COMPRESSION_QUEUE_PER_WORKER):
+                    self.write_compressed(channel, output, pool, *pending.popleft())
+            while pending:
+                self.write_compressed(channel, output, pool, *pending.popleft())
         finally:
-            # Use fsync to ensure all internal file buffers are written to disk
-            os.fsync(fd)
-            # Close the file descriptor
-            os.close(fd)
+            if extraction_pool is not None:
+                extraction_pool.shutdown()
+            for channel_writer in channel_writers:
+                channel_writer.close()
+            if output is None:
+                return
+            output.close()
+            if not output.direct:
+                self.logger.info(f"O_DIRECT not supported for {base_path}, used buffered writes with periodic writeback")
 
 
 
     def start_recording(self, gain, duration_seconds):
         time.sleep(1)
         frequency = self.frequency
-        for channel in range(len(self.streams)):
+        self.timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        if self.doppler_profile is not None:
+            frequency += self.doppler_profile.at(time.time())
+        self.center_frequency = frequency
+        self.tuning_log = [(0, time.time(), frequency)]
+        self.recording_started = time.time()
+        self.stats.start()
+        if self.compressor is not None:
+            self.compression_pool = ThreadPoolExecutor(self.compression_workers)
+        for channel in self.channels:
             self.setup_device(channel, frequency, gain)
-            self.activate_stream(channel)
+        self.activate_stream()
 
-            # Start the producer thread
-            producer_thread = threading.Thread(target=self.producer, args=(channel, duration_seconds, self.queues[channel]))
-            producer_thread.start()
-            self.producer_threads.append(producer_thread)
-
-            # Start the consumer thread
-            consumer_thread = threading.Thread(target=self.consumer, args=(channel, self.queues[channel]))
+        # Start a consumer thread per channel
+        for channel, pool in zip(self.channels, self.pools):
+            consumer_thread = threading.Thread(target=self.consumer, args=(channel, pool))
             consumer_thread.start()
             self.consumer_threads.append(consumer_thread)
 
+        # Start the producer thread
+        producer_thread = threading.Thread(target=self.producer, args=(duration_seconds,))
+        producer_thread.start()
+        self.producer_threads.append(producer_thread)
+
+        if self.doppler_profile is not None:
+            self.doppler_thread = threading.Thread(target=self.follow_doppler)
+            self.doppler_thread.start()
+
     def stop_recording(self):
         
         # Wait for all producer threads to finish
         for thread in self.producer_threads:
             thread.join()
 
-        # Deactivate and close all streams
-        for channel in range(len(self.streams)):
-            with self.lock:
-                if self.streams[channel] is not None:
-                    self.device.deactivateStream(self.streams[channel])
-                    self.device.closeStream(self.streams[channel])
-                    self.streams[channel] = None
+        if self.doppler_thread is not None:
+            self.doppler_stop_event.set()
+            self.doppler_thread.join()
+
+        # Deactivate and close the stream
+        with self.lock:
+            if self.stream is not None:
+                self.device.deactivateStream(self.stream)
+                self.device.closeStream(self.stream)
+                self.stream = None
         # Release the device
         self.device.close()
         self.device = None
@@ -157,6 +791,14 @@ class SDRRecorder:
         # Wait for all consumer threads to finish
         for thread in self.consumer_threads:
             thread.join()
+        self.stats.finish()
+        self.save_stats()
+        for channel, data_path, extractor in self.channel_paths:
+            self.save_metadata(channel, data_path, extractor)
+        if self.compression_pool is not None:
+            self.compression_pool.shutdown()
+            self.compression_stats = self.get_compression_stats()
+            self.logger.info(f"Compression: {self.compression_stats}")
         self.logger.info("Finished saving to drive")
         print("Finished saving to drive")
         import gc
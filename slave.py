@@ -4,15 +4,23 @@ import subprocess
 import threading
 import time
 import scheduler
+import trajectory
+import tracking
+from schedule_index import ScheduleIndex
 from datetime import datetime, timedelta
 from scheduler import Topos, pytz, determine_timezone
 import pickle
+import json
 import queue
+from collections import deque
 from rtlsdr import RtlSdr
 import serial
 import gps
 import numpy as np
-from sdr_recorder import SDRRecorder, sdr, logging
+from sdr_recorder import SDRRecorder, sdr, logging, choose_capture_settings, bytes_per_sample, SAMPLE_FORMATS, DEFAULT_SAMPLE_FORMAT, COMPRESSION_WORKERS, SEGMENT_BYTES, probe_disk_throughput, cap_to_disk
+from pass_cache import PassCache
+from rotator import RotatorWorker
+from channelizer import DEFAULT_CHANNEL_BANDWIDTH, EXTRACTION_MARGIN, decimation_for, measure_throughput
 
 
 
@@ -22,6 +30,11 @@ DATA_BASE_DIR = "/home/dietpi/Desktop/MDE/data_base"
 
 USB_DIR = "/mnt/usbdrive"
 
+# Campaigns keep the schedule filled this far ahead, checking every CAMPAIGN_CHECK_SECONDS
+CAMPAIGN_LOOKAHEAD_HOURS = 8
+CAMPAIGN_CHECK_SECONDS = 60
+# Only the most recent processed passes are kept so long campaigns don't grow memory
+MAX_PROCESSED_HISTORY = 1000
 
 
 def get_size_of_directory(directory_path):
@@ -83,6 +96,13 @@ def parse_satellite_data(s):
     return satellite_dict
 
 
+def rejected_tle_report(catalog):
+    # The TLEs of a request that were dropped, appended to the reply
+    if not catalog.rejected:
+        return ""
+    return f", dropped {len(catalog.rejected)} TLEs: " + "; ".join(f"{name} ({norad}): {reason}" for name, norad, reason in catalog.rejected)
+
+
 
 def receive_full_message(sock, as_bytes=False):
     # First, get the message length
@@ -121,11 +141,11 @@ class SatelliteTracker:
             if serial_port is None:
                 print("Unable to find Arduino port.")
                 self.arduino_found = False
-        self.schedule = queue.Queue()
+        self.schedule = ScheduleIndex()
         self.stop_recording_event = threading.Event()
         self.satellites = []
         self.satellites_frequencies = {}
-        self.already_processed_satellites = []
+        self.already_processed_satellites = deque(maxlen=MAX_PROCESSED_HISTORY)
         # Flag to stop the tracking process
         self.stop_signal = True
         self.default_frequency = 1.626e9
@@ -156,6 +176,37 @@ class SatelliteTracker:
         self.start_time = None
         self.end_time = None
 
+        # Viewing windows already computed for a TLE set and location are reused across add_to_queue calls
+        self.pass_cache = PassCache(os.path.join(DATA_BASE_DIR, "pass_cache.pkl"))
+
+        # "spaced" is the greedy first-fit scheduler, "optimal" the weighted interval scheduler
+        self.schedule_mode = "spaced"
+        self.satellite_priorities = {}
+        self.min_pass_gap_seconds = 60
+        # The report compares the optimal schedule with the greedy ones. Those are planned again for it,
+        # so it is only made when set_schedule_report turns it on
+        self.schedule_report_enabled = False
+        self.schedule_report = {}
+        # Passes that don't clear this scheduler.PassFilter are never scheduled, None keeps every pass
+        self.pass_filter = None
+
+        # Schedules are computed off the command thread, spread over the cores by a process pool
+        self.schedule_executor = scheduler.create_schedule_executor()
+        self.schedule_lock = threading.Lock()
+        self.schedule_status = "idle"
+        # Background schedule updates started but not finished, the status only reads ready (or the
+        # error of one of them) once all of them are done
+        self.schedule_updates_pending = 0
+        self.schedule_update_error = None
+        self.schedule_status_lock = threading.Lock()
+
+        # Rolling-horizon campaign extending the schedule in the background
+        self.campaign_thread = None
+        self.campaign_stop_event = threading.Event()
+        self.campaign_frequencies = {}
+        self.campaign_pass_counts = {}
+        self.campaign_lookahead_hours = CAMPAIGN_LOOKAHEAD_HOURS
+
         self.samples_queue = [queue.Queue(), queue.Queue()]
         self.recording = False
         
@@ -164,6 +215,12 @@ class SatelliteTracker:
 
         self.ser = serial.Serial(serial_port, baudrate)
         time.sleep(2)  # Allow some time for connection to establish
+        # All rotator traffic goes through the worker thread so the tracking loop never waits on the mount
+        self.rotator = RotatorWorker(self.ser) if self.arduino_found else None
+        self.pointing_report = {}
+        # "stream" sends pointing updates from the host every tick, "upload" sends the whole pass to
+        # the controller before it starts and lets it follow the path on its own
+        self.tracking_mode = "stream"
 
         self.dual_device_args = ""
         self.single_device_args = ""
@@ -177,6 +234,125 @@ class SatelliteTracker:
    
         self.band_width = 10e6
         self.dualMode = False
+        # With a known signal bandwidth (Hz), or channels to extract, the capture is narrowed to the smallest
+        # bandwidth that keeps the shifted signal in band and the tuner follows the pass Doppler shift.
+        # Full-width captures are never retuned, a few kHz of drift doesn't matter there.
+        self.doppler_correction = True
+        self.signal_bandwidth = None
+        # Stored sample format, CF32 is used instead when the tuner can't stream the selected one
+        self.sample_format = DEFAULT_SAMPLE_FORMAT
+        # Optional compression of recordings ("zstd" or "zlib", None to store raw samples), its level and
+        # worker threads, and the statistics of the last compressed recording
+        self.compression = None
+        self.compression_level = None
+        self.compression_workers = COMPRESSION_WORKERS
+        self.compression_stats = None
+        # Channelizer: other frequencies of a satellite that fit in the same capture are extracted into
+        # narrow files during the pass, optionally without keeping the wideband file
+        self.channelizer = False
+        self.channel_bandwidth = DEFAULT_CHANNEL_BANDWIDTH
+        # (channel bandwidth, wideband samples/s) one channel extractor keeps up with, measured when first needed
+        self.extractor_throughput = None
+        self.record_wideband = True
+        # Wideband recordings are split into segments of this size with an index per pass, 0 for one file
+        self.segment_bytes = SEGMENT_BYTES
+        # Recorder of the current or last recording, its stats are served by recording_status
+        self.recorder = None
+        # Sustained write speed of the data drive, kept next to the data. Measured in the background when
+        # there is no earlier result and again on probe_disk, captures are capped to what it sustains.
+        # The probe holds disk_probe_lock, recordings wait for it so neither skews the other.
+        self.disk_probe_path = os.path.join(DATA_BASE_DIR, "disk_probe.json")
+        self.disk_probe = self.load_disk_probe()
+        self.disk_probe_status = "idle"
+        self.disk_probe_lock = threading.Lock()
+        if self.disk_probe is None:
+            self.start_disk_probe()
+
+    def load_disk_probe(self):
+        try:
+            with open(self.disk_probe_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def start_disk_probe(self):
+        # Probe the drive in the background, False while a recording or another probe is running
+        if not self.disk_probe_lock.acquire(blocking=False):
+            return False
+        if self.recording:
+            self.disk_probe_lock.release()
+            return False
+        self.disk_probe_status = "running"
+        threading.Thread(target=self.probe_disk, daemon=True).start()
+        return True
+
+    def probe_disk(self):
+        # Runs holding disk_probe_lock, taken by start_disk_probe
+        try:
+            probe = probe_disk_throughput(DATA_BASE_DIR)
+            with open(self.disk_probe_path, "w") as f:
+                json.dump(probe, f)
+            self.disk_probe = probe
+            self.disk_probe_status = "done"
+            self.logger.info(f"{DATA_BASE_DIR} sustains {probe['bytes_per_second'] / 1e6:.1f} MB/s")
+        except OSError as e:
+            self.disk_probe_status = f"failed: {e}"
+            self.logger.error(f"Disk probe of {DATA_BASE_DIR} failed: {e}")
+        finally:
+            self.disk_probe_lock.release()
+
+    def start_recording_after_probe(self):
+        # A recording starting during a disk probe waits for it to finish
+        with self.disk_probe_lock:
+            self.recording = True
+
+    def disk_capped(self, band_width, sample_rate):
+        if self.disk_probe is None:
+            return band_width, sample_rate, self.sample_format
+        channels = 2 if self.dualMode else 1
+        return cap_to_disk(band_width, sample_rate, self.sample_format, channels, self.disk_probe["bytes_per_second"], self.expected_compression_ratio())
+
+    def disk_band_width(self):
+        # Widest capture the data drive keeps up with. Channels planned within it keep their sample rate
+        # through cap_to_disk, which only lowers the rate of wider captures
+        band_width, sample_rate = choose_capture_settings(self.band_width, max_bandwidth=self.band_width)
+        return min(self.band_width, self.disk_capped(band_width, sample_rate)[0])
+
+    def cap_to_disk(self, band_width, sample_rate):
+        # Capture settings and sample format the data drive keeps up with, unchanged until it has been probed
+        capped = self.disk_capped(band_width, sample_rate)
+        if capped != (band_width, sample_rate, self.sample_format):
+            self.logger.warning(f"{DATA_BASE_DIR} can't sustain {sample_rate} samples/s of {self.sample_format}, recording with bandwidth {capped[0]} Hz at {capped[1]} samples/s in {capped[2]}")
+        return capped
+
+    def extraction_throughput(self):
+        if self.extractor_throughput is None or self.extractor_throughput[0] != self.channel_bandwidth:
+            self.extractor_throughput = (self.channel_bandwidth, measure_throughput(self.channel_bandwidth))
+            self.logger.info(f"A channel extractor processes {self.extractor_throughput[1] / 1e6:.1f} MS/s")
+        return self.extractor_throughput[1]
+
+    def plan_channels(self, freq1, candidates, max_bandwidth):
+        # freq1 and the candidates closest to it, as long as all of their channels fit in max_bandwidth
+        # and the extraction keeps up: every channel processes every sample of the capture on the
+        # tuner channel's extraction thread
+        budget = self.extraction_throughput() * EXTRACTION_MARGIN
+        group = [freq1]
+        for frequency in sorted(set(candidates) - {freq1}, key=lambda candidate: abs(candidate - freq1)):
+            span = max(group + [frequency]) - min(group + [frequency]) + self.channel_bandwidth
+            if span > max_bandwidth:
+                continue
+            _, sample_rate = choose_capture_settings(span, max_bandwidth=max_bandwidth)
+            if (len(group) + 1) * sample_rate > budget:
+                self.logger.info(f"Leaving {frequency} Hz for a later pass, extracting {len(group) + 1} channels at {sample_rate} samples/s would outrun the channelizer")
+                continue
+            group.append(frequency)
+        return sorted(group)
+
+    def expected_compression_ratio(self):
+        # Ratio of the last compressed recording, never assumed better than that
+        if self.compression and self.compression_stats and self.compression_stats["ratio"]:
+            return max(self.compression_stats["ratio"], 1.0)
+        return 1.0
 
     def start_tracking(self):
         """Starts the tracking process in a new thread."""
@@ -196,16 +372,25 @@ class SatelliteTracker:
     def track_and_record_satellites_concurrently(self):
         try:
             print("Tracking started")
-            while not self.stop_signal and self.schedule.qsize() > 0:
+            while not self.stop_signal and (len(self.schedule) > 0 or self.campaign_running()):
     
-                if self.schedule.qsize() == 0:
-                    break
-                item = self.schedule.queue[0] if not self.schedule.empty() else None
+                item = self.schedule.peek()
                 if item == None:
+                    if self.campaign_running():
+                        # The campaign adds passes as its horizon moves on, wait for them
+                        time.sleep(0.5)
+                        continue
                     self.stop_signal = True
+                    break
                 _, rise_time, set_time, satellite = item
 
+                # In upload mode the path goes to the controller while waiting, so the pass starts with a SYNC
+                uploaded_trajectory = None
+                upload_due = self.tracking_mode == "upload" and self.rotator is not None
                 while self.local_timezone.localize(datetime.now())  < rise_time:
+                    if upload_due and (rise_time - self.local_timezone.localize(datetime.now())).total_seconds() <= tracking.TRAJECTORY_UPLOAD_LEAD_SECONDS:
+                        upload_due = False
+                        uploaded_trajectory = self.upload_pass(satellite, rise_time, set_time)
                     print("waiting")
                     print(self.local_timezone.localize(datetime.now()))
                     print(rise_time)
@@ -213,17 +398,19 @@ class SatelliteTracker:
                         print(f"Tracking got canceled before it began.")
                         self.logger.warning("Tracking got canceled before it began.")
                         return  # Exit the method if stop signal is detected
+                    if self.schedule.peek() != item:
+                        # A pass was merged in ahead of this one (or this one was removed), start over
+                        break
                     time.sleep(0.5)  # Sleep for short intervals to check for stop_signal frequently
 
+                if self.schedule.peek() != item:
+                    continue
 
-                try:
-                    # Get next item, but don't wait forever. Timeout after 5 seconds, for example.
-                    item = self.schedule.get(timeout=5)
-                    
-
-
-                except queue.Empty:
-                    # queue is empty and no item was retrieved in the given timeout.
+                item = self.schedule.pop_first()
+                if item is None:
+                    # schedule was cleared while waiting
+                    if self.campaign_running():
+                        continue
                     self.stop_signal = True
                     break
 
@@ -232,7 +419,7 @@ class SatelliteTracker:
 
 
                 print(f"Tracking {satellite.name} from {rise_time} to {set_time}")
-                self.track_and_record_satellite(satellite, self.local_timezone.localize(datetime.now()), set_time)
+                self.track_and_record_satellite(satellite, self.local_timezone.localize(datetime.now()), set_time, uploaded_trajectory)
 
                 # Add the satellite to the list of already processed satellites
                 self.already_processed_satellites.append(item)
@@ -243,52 +430,121 @@ class SatelliteTracker:
             self.stop_signal = True
 
 
-    def create_schedule(self):
-        print(f"Creating schedule")
-        self.logger.info("Creating schedule.")
-             # Getting the current UTC time
-        old_schedule = []
-        while not self.schedule.empty():
-            old_schedule.append(self.schedule.get())
-        # self.schedule = scheduler.get_sequential_tracking_schedule(self.satellites, self.start_time, self.end_time, self.latitude, self.longitude, self.topos)
-        new_schedule = scheduler.get_sequential_tracking_spaced(old_schedule, self.satellites, self.start_time, self.end_time, self.topos)
+    def create_schedule(self, satellites=None):
+        if satellites is None:
+            satellites = self.satellites
+            self.satellites = []
+        # One schedule update at a time, later add_to_queue requests wait for the running one
+        with self.schedule_lock:
+            print(f"Creating schedule")
+            self.logger.info("Creating schedule.")
+            # New passes are merged into the gaps of the existing schedule, which is left in place
+            # self.schedule = scheduler.get_sequential_tracking_schedule(self.satellites, self.start_time, self.end_time, self.latitude, self.longitude, self.topos)
+            required_break = self.slew_break()
+            if self.schedule_mode == "optimal":
+                old_schedule = self.schedule.to_list()
+                scheduler.add_weighted_optimal_to_index(self.schedule, satellites, self.start_time, self.end_time, self.topos, self.satellite_priorities, self.min_pass_gap_seconds, cache=self.pass_cache, executor=self.schedule_executor, pass_filter=self.pass_filter, required_break=required_break)
+                if self.schedule_report_enabled:
+                    self.schedule_report = scheduler.compare_schedule_modes(old_schedule, satellites, self.start_time, self.end_time, self.topos, self.satellite_priorities, self.min_pass_gap_seconds, cache=self.pass_cache, pass_filter=self.pass_filter, required_break=required_break, executor=self.schedule_executor, optimal_schedule=self.schedule.to_list())
+                    print(f"Recorded seconds per schedule mode: {self.schedule_report}")
+            else:
+                scheduler.add_to_schedule_index(self.schedule, satellites, self.start_time, self.end_time, self.topos, cache=self.pass_cache, required_break=required_break, executor=self.schedule_executor, pass_filter=self.pass_filter)
 
-        for item in new_schedule:
-            self.schedule.put(item)
-        self.satellites = []
+            new_schedule = self.schedule.to_list()
         
         print(f"Schedule created")
         self.logger.info("Schedule created")
         return new_schedule
 
+    def slew_break(self):
+        # Break between passes is the time the mount needs to slew from one to the next, at the rates
+        # measured on this mount when there is one
+        return trajectory.make_slew_break(self.topos, self.rotator.response_model if self.rotator is not None else None)
+
+    def update_schedule_in_background(self, satellites):
+        def run():
+            new_schedule = None
+            try:
+                new_schedule = self.create_schedule(satellites)
+            except Exception as e:
+                print(f"Error creating schedule: {e}")
+                self.logger.error(f"Error creating schedule: {e}")
+                with self.schedule_status_lock:
+                    self.schedule_update_error = e
+            with self.schedule_status_lock:
+                self.schedule_updates_pending -= 1
+                if self.schedule_updates_pending > 0:
+                    self.schedule_status = f"computing, {self.schedule_updates_pending} updates pending"
+                elif self.schedule_update_error is not None:
+                    self.schedule_status = f"error: {self.schedule_update_error}"
+                else:
+                    self.schedule_status = f"ready, {len(new_schedule)} passes scheduled"
+
+        with self.schedule_status_lock:
+            if self.schedule_updates_pending == 0:
+                self.schedule_update_error = None
+            self.schedule_updates_pending += 1
+            self.schedule_status = "computing"
+        schedule_thread = threading.Thread(target=run)
+        schedule_thread.start()
+
+    def start_campaign(self, satellites, frequencies, lookahead_hours=CAMPAIGN_LOOKAHEAD_HOURS):
+        """Keeps the schedule filled lookahead_hours ahead with passes of the satellites until stopped."""
+        self.stop_campaign()
+        self.campaign_stop_event = threading.Event()
+        self.campaign_frequencies = frequencies
+        self.campaign_pass_counts = {}
+        self.campaign_lookahead_hours = lookahead_hours
+        self.campaign_thread = threading.Thread(target=self.extend_schedule_loop, args=(satellites, self.campaign_stop_event))
+        self.campaign_thread.start()
+
+    def campaign_running(self):
+        return self.campaign_thread is not None and self.campaign_thread.is_alive()
+
+    def stop_campaign(self):
+        self.campaign_stop_event.set()
+        if self.campaign_thread is not None:
+            self.campaign_thread.join()
+            self.campaign_thread = None
+
+    def extend_schedule_loop(self, satellites, stop_event):
+        # Windows come lazily from the rolling-horizon generator, only as far as the lookahead needs
+        try:
+            start_time = pytz.utc.localize(datetime.utcnow()).astimezone(self.local_timezone)
+            windows = scheduler.iter_viewing_windows(satellites, start_time, self.topos, executor=self.schedule_executor, cache=self.pass_cache, pass_filter=self.pass_filter)
+            pending = next(windows, None)
+            required_break = self.slew_break()
+            while pending is not None and not stop_event.is_set():
+                horizon = pytz.utc.localize(datetime.utcnow()) + timedelta(hours=self.campaign_lookahead_hours)
+                added = 0
+                while pending is not None and pending[1] <= horizon and not stop_event.is_set():
+                    if self.schedule.insert_if_free(pending, required_break):
+                        added += 1
+                    pending = next(windows, None)
+                if added:
+                    self.logger.info(f"Campaign added {added} passes up to {horizon}")
+                stop_event.wait(CAMPAIGN_CHECK_SECONDS)
+        except Exception as e:
+            print(f"Error extending campaign schedule: {e}")
+            self.logger.error(f"Error extending campaign schedule: {e}")
+
     
     def move_to_position(self, azimuth, elevation):
-        """Sends a command to move to a specific azimuth and elevation."""
+        """Moves to a specific azimuth and elevation and waits for the mount to get there."""
         if self.arduino_found:
-            cmd = f"MOVE {azimuth}, {elevation}\n"
-            self.ser.write(cmd.encode('utf-8'))
-
-            # Wait for the response
-            while True:
-                response = self.ser.readline().decode('utf-8').strip()
-                if response.lower() == "moved":
-                    return True
-                elif "Error" in response:  # Adjust this condition based on the possible error messages from the Feather
-                    print("Error:", response)
-                    self.logger.error("Error:"+str(response))
-                    return False
+            return self.rotator.move(azimuth, elevation)
         else:
             return False
-    def calibrate(self):
-        """Sends a command to move to a specific azimuth and elevation."""
+
+    def point_to_position(self, azimuth, elevation):
+        """Hands the rotator worker a new target without waiting, replacing any target it hasn't started."""
         if self.arduino_found:
-            cmd = f"calibrate\n"
-            self.ser.write(cmd.encode('utf-8'))
+            self.rotator.point(azimuth, elevation)
 
-            # Wait for the response
-            while True:
-                response = self.ser.readline().decode('utf-8').strip()
-                return response
+    def calibrate(self):
+        """Runs the mount calibration and returns the Feather's answer."""
+        if self.arduino_found:
+            return self.rotator.calibrate()
         else:
             return "arduino not found"
         
@@ -298,7 +554,7 @@ class SatelliteTracker:
 
       
 
-        self.recording = True
+        self.start_recording_after_probe()
 
 
         self.stop_recording_event = threading.Event()
@@ -308,14 +564,16 @@ class SatelliteTracker:
        
 
         
+        band_width, sample_rate, sample_format = self.cap_to_disk(self.band_width, SDRRecorder.DEFAULT_SAMPLE_RATE)
         used = get_size_of_directory(DATA_BASE_DIR)
-        bits_per_sample = 32
-        bytes_per_sample = bits_per_sample/8
+        # The files hold sample_rate samples per second of the selected format for each channel, less
+        # what the last compressed recording saved
+        sample_bytes = bytes_per_sample(sample_format) / self.expected_compression_ratio()
         
         if self.dualMode:
-            theoretical_recording_size = ((self.band_width * bytes_per_sample * total_time) / (1024**3))*2
+            theoretical_recording_size = ((sample_rate * sample_bytes * total_time) / (1024**3))*2
         else:
-            theoretical_recording_size = ((self.band_width * bytes_per_sample * total_time) / (1024**3))
+            theoretical_recording_size = ((sample_rate * sample_bytes * total_time) / (1024**3))
 
 
         projected_used_space = theoretical_recording_size + used
@@ -330,11 +588,14 @@ class SatelliteTracker:
 
         try:
             if self.dualMode:
-                recorder = SDRRecorder(self.dual_device_args, self.band_width, sat_name = satName, mode='dual', frequency = freq1, stop_event = self.stop_recording_event)
+                recorder = SDRRecorder(self.dual_device_args, band_width, sat_name = satName, mode='dual', frequency = freq1, stop_event = self.stop_recording_event, sample_rate = sample_rate, sample_format = sample_format, compression = self.compression, compression_level = self.compression_level, compression_workers = self.compression_workers, segment_bytes = self.segment_bytes)
             else:
-                recorder = SDRRecorder(self.single_device_args, self.band_width, sat_name = satName, mode='single', frequency = freq1, stop_event = self.stop_recording_event)
+                recorder = SDRRecorder(self.single_device_args, band_width, sat_name = satName, mode='single', frequency = freq1, stop_event = self.stop_recording_event, sample_rate = sample_rate, sample_format = sample_format, compression = self.compression, compression_level = self.compression_level, compression_workers = self.compression_workers, segment_bytes = self.segment_bytes)
+            self.recorder = recorder
             recorder.start_recording(30, total_time)
             recorder.stop_recording()
+            if recorder.compression_stats is not None:
+                self.compression_stats = recorder.compression_stats
         except:
             print("Error recording")
             self.logger.error("Error recording")
@@ -345,10 +606,15 @@ class SatelliteTracker:
             return "finished recording"
 
     def record(self, satellite, rise_time, set_time):
-
+        self.start_recording_after_probe()
 
         total_time = (set_time - rise_time).seconds
-        if self.satellites_frequencies.get(satellite.name) is None or len (self.satellites_frequencies.get(satellite.name)) == 0:
+        if self.campaign_frequencies.get(satellite.name):
+            # Campaign passes cycle through the satellite's frequencies instead of using them up
+            pass_count = self.campaign_pass_counts.get(satellite.name, 0)
+            freq1 = self.campaign_frequencies[satellite.name][pass_count % len(self.campaign_frequencies[satellite.name])]
+            self.campaign_pass_counts[satellite.name] = pass_count + 1
+        elif self.satellites_frequencies.get(satellite.name) is None or len (self.satellites_frequencies.get(satellite.name)) == 0:
             print(f"No frequencies for satellite {satellite.name}, defaulting to {self.default_frequency}")
             self.logger.info(f"No frequencies for satellite {satellite.name}, defaulting to {self.default_frequency}")
             freq1 = self.default_frequency
@@ -358,11 +624,54 @@ class SatelliteTracker:
         else:
             freq1 = self.satellites_frequencies[satellite.name][0]
             self.satellites_frequencies[satellite.name] = self.satellites_frequencies[satellite.name][1:]
+
+        # With the channelizer on, the satellite's other frequencies that fit in the same capture are
+        # extracted during this pass instead of being left for later passes. The capture is then
+        # centered between them.
+        channel_frequencies = []
+        # Captures are planned within what the data drive sustains, so the channels planned here are
+        # still covered once the capture is capped to the drive
+        max_bandwidth = self.disk_band_width()
+        if self.channelizer:
+            campaign = bool(self.campaign_frequencies.get(satellite.name))
+            candidates = self.campaign_frequencies[satellite.name] if campaign else self.satellites_frequencies.get(satellite.name, [])
+            channel_frequencies = self.plan_channels(freq1, candidates, max_bandwidth)
+            if not campaign and satellite.name in self.satellites_frequencies:
+                remaining = [frequency for frequency in self.satellites_frequencies[satellite.name] if frequency not in channel_frequencies]
+                if remaining:
+                    self.satellites_frequencies[satellite.name] = remaining
+                else:
+                    self.satellites_frequencies.pop(satellite.name)
+            if len(channel_frequencies) > 1:
+                freq1 = (channel_frequencies[0] + channel_frequencies[-1]) / 2
+                self.logger.info(f"Extracting {channel_frequencies} from one capture of {satellite.name} at {freq1} Hz")
+            elif self.record_wideband:
+                # A single frequency only needs the wideband file
+                channel_frequencies = []
             
         self.stop_signal = False
         self.recording = True
         gain = 30
 
+        doppler_profile = None
+        band_width, sample_rate = self.band_width, SDRRecorder.DEFAULT_SAMPLE_RATE
+        if self.doppler_correction and (channel_frequencies or self.signal_bandwidth):
+            observer_location = scheduler.wgs84.latlon(self.latitude, self.longitude)
+            doppler_profile = trajectory.compute_doppler_profile(satellite, observer_location, rise_time, set_time, freq1)
+            low, high = doppler_profile.span()
+            self.logger.info(f"Doppler shift of {satellite.name} at {freq1} Hz: {low:.0f} to {high:.0f} Hz")
+        if channel_frequencies:
+            # Narrowest capture holding every extracted channel
+            signal_bandwidth = channel_frequencies[-1] - channel_frequencies[0] + self.channel_bandwidth
+            band_width, sample_rate = choose_capture_settings(signal_bandwidth, doppler_profile, retune=self.doppler_correction, max_bandwidth=max_bandwidth)
+            self.logger.info(f"Capturing {satellite.name} with bandwidth {band_width} Hz at {sample_rate} samples/s")
+        elif self.signal_bandwidth:
+            band_width, sample_rate = choose_capture_settings(self.signal_bandwidth, doppler_profile, retune=self.doppler_correction, max_bandwidth=max_bandwidth)
+            self.logger.info(f"Capturing {satellite.name} with bandwidth {band_width} Hz at {sample_rate} samples/s")
+        if band_width >= self.band_width:
+            # Retuning a capture that wasn't narrowed only adds discontinuities
+            doppler_profile = None
+
 
         self.stop_recording_event = threading.Event()
 
@@ -372,14 +681,19 @@ class SatelliteTracker:
        
 
         
+        band_width, sample_rate, sample_format = self.cap_to_disk(band_width, sample_rate)
         used = get_size_of_directory(DATA_BASE_DIR)
-        bits_per_sample = 32
-        bytes_per_sample = bits_per_sample/8
+        # The files hold sample_rate samples per second of the selected format for each channel, less
+        # what the last compressed recording saved
+        sample_bytes = bytes_per_sample(sample_format) / self.expected_compression_ratio()
+        bytes_per_second = sample_rate * sample_bytes if self.record_wideband or not channel_frequencies else 0
+        # Extracted channels are stored as CF32 at their decimated rate
+        bytes_per_second += len(channel_frequencies) * sample_rate / decimation_for(sample_rate, self.channel_bandwidth) * 8
         
         if self.dualMode:
-            theoretical_recording_size = ((self.band_width * bytes_per_sample * total_time) / (1024**3))*2
+            theoretical_recording_size = ((bytes_per_second * total_time) / (1024**3))*2
         else:
-            theoretical_recording_size = ((self.band_width * bytes_per_sample * total_time) / (1024**3))
+            theoretical_recording_size = ((bytes_per_second * total_time) / (1024**3))
 
 
         projected_used_space = theoretical_recording_size + used
@@ -395,11 +709,14 @@ class SatelliteTracker:
 
         try:
             if self.dualMode:
-                recorder = SDRRecorder(self.dual_device_args, self.band_width, sat_name = satellite.name, mode='dual', frequency = freq1, stop_event = self.stop_recording_event)
+                recorder = SDRRecorder(self.dual_device_args, band_width, sat_name = satellite.name, mode='dual', frequency = freq1, stop_event = self.stop_recording_event, sample_rate = sample_rate, doppler_profile = doppler_profile, sample_format = sample_format, compression = self.compression, compression_level = self.compression_level, compression_workers = self.compression_workers, channel_frequencies = channel_frequencies, channel_bandwidth = self.channel_bandwidth, record_wideband = self.record_wideband, segment_bytes = self.segment_bytes)
             else:
-                recorder = SDRRecorder(self.single_device_args, self.band_width, sat_name = satellite.name, mode='single', frequency = freq1, stop_event = self.stop_recording_event)
+                recorder = SDRRecorder(self.single_device_args, band_width, sat_name = satellite.name, mode='single', frequency = freq1, stop_event = self.stop_recording_event, sample_rate = sample_rate, doppler_profile = doppler_profile, sample_format = sample_format, compression = self.compression, compression_level = self.compression_level, compression_workers = self.compression_workers, channel_frequencies = channel_frequencies, channel_bandwidth = self.channel_bandwidth, record_wideband = self.record_wideband, segment_bytes = self.segment_bytes)
+            self.recorder = recorder
             recorder.start_recording(30, total_time)
             recorder.stop_recording()
+            if recorder.compression_stats is not None:
+                self.compression_stats = recorder.compression_stats
         except:
             print("Error recording")
             self.logger.error("Error recording")
@@ -411,35 +728,46 @@ class SatelliteTracker:
         
         
 
-    def track_and_record_satellite(self, satellite, rise_time, set_time):
+    def plan_pass(self, satellite, rise_time, set_time):
+        observer_location = scheduler.wgs84.latlon(self.latitude, self.longitude)
+
+        # Compute the whole pass once, each tick of the tracking loop only interpolates in this table. The path is in
+        # mount coordinates, using the 360-450 overlap or the flip over the zenith when that means less travel.
+        pass_trajectory = trajectory.compute_pass_trajectory(satellite, observer_location, rise_time, set_time)
+        if self.rotator is not None:
+            return trajectory.plan_mount_trajectory(pass_trajectory, self.rotator.last_position, self.rotator.response_model)
+        return trajectory.plan_mount_trajectory(pass_trajectory)
+
+    def upload_pass(self, satellite, rise_time, set_time):
+        # The pass's path on the controller ahead of AOS, None if it did not accept it
+        pass_trajectory = self.plan_pass(satellite, rise_time, set_time)
+        if not self.rotator.upload_trajectory(pass_trajectory):
+            self.logger.warning(f"Controller did not accept the trajectory of {satellite.name} ahead of AOS")
+            return None
+        self.logger.info(f"Uploaded the {pass_trajectory.strategy} mount path of {satellite.name} ahead of AOS")
+        return pass_trajectory
+
+    def track_and_record_satellite(self, satellite, rise_time, set_time, uploaded_trajectory=None):
         # Start recording on a separate thread
         self.recording_thread = threading.Thread(target=self.record, args=(satellite, rise_time, set_time))
         self.recording_thread.start()
-        
 
-        observer_location = scheduler.wgs84.latlon(self.latitude, self.longitude)
-        
+        # A path uploaded ahead of AOS only needs its SYNC
+        pass_trajectory = uploaded_trajectory or self.plan_pass(satellite, rise_time, set_time)
+        self.logger.info(f"Tracking {satellite.name} with the {pass_trajectory.strategy} mount path")
    
-        previous_azimuth, previous_elevation = None, None
-
-        while self.local_timezone.localize(datetime.now()) < set_time and self.stop_signal is False and self.recording is True:
-            azimuth, elevation = scheduler.get_azimuth_elevation(satellite, observer_location)
-            
-            # Check if this is the first iteration or if the difference in angle is greater than 1 degree
-            if previous_azimuth is None or abs(azimuth - previous_azimuth) > 1 or abs(elevation - previous_elevation) > 1:
-                
-                if azimuth >= 0 and  azimuth<= 450 and elevation >= 0 and elevation<=180:
-                    self.move_to_position(azimuth, elevation)
-                    self.logger.info("Moved to az= " + str(azimuth)+", el= "+str(elevation))
-                    # Update the previous azimuth and elevation
-                    previous_azimuth, previous_elevation = azimuth, elevation
-                else:
-                    self.logger.warning("Waiting on az el to be above the horizon. az= " + str(azimuth)+", el= "+str(elevation))
-                    
-
-            
-            time.sleep(0.1)
+        keep_tracking = lambda: self.stop_signal is False and self.recording is True
+        report = None
+        if self.tracking_mode == "upload" and self.rotator is not None:
+            report = tracking.follow_uploaded_pass(self.rotator, pass_trajectory, set_time.timestamp(), keep_tracking, uploaded=uploaded_trajectory is not None)
+            if report is None:
+                self.logger.warning("Controller did not accept the trajectory, tracking from the host instead")
+        if report is None:
+            report = tracking.track_pass(self.rotator, pass_trajectory, set_time.timestamp(), keep_tracking)
         self.recording_thread.join()
+
+        self.pointing_report = dict(report, satellite=satellite.name)
+        self.logger.info(f"Pointing for {satellite.name}: {self.pointing_report}")
             
     
     def setup_server_socket(self, ip_address, port):
@@ -523,6 +851,94 @@ class SatelliteTracker:
                         self.dualMode = True
                         send_message(client_sock, "set_dual_tuner")
 
+                    elif data.startswith("set_schedule_mode"):
+                        # set_schedule_mode <spaced|optimal> [min gap between passes in seconds]
+                        parts = data.split(" ")
+                        if parts[1] in ("spaced", "optimal"):
+                            self.schedule_mode = parts[1]
+                            if len(parts) > 2:
+                                self.min_pass_gap_seconds = float(parts[2])
+                            send_message(client_sock, "set_schedule_mode")
+                        else:
+                            send_message(client_sock, f"Unknown schedule mode {parts[1]}")
+
+                    elif data.startswith("set_schedule_report"):
+                        # set_schedule_report <on|off>, compare the optimal schedules with the greedy modes
+                        parts = data.split(" ")
+                        self.schedule_report_enabled = parts[1] == "on"
+                        if not self.schedule_report_enabled:
+                            self.schedule_report = {}
+                        send_message(client_sock, "set_schedule_report")
+
+                    elif data.startswith("set_priority"):
+                        # set_priority <satellite name> <priority>, the name may contain spaces
+                        parts = data.split(" ")
+                        self.satellite_priorities[" ".join(parts[1:-1])] = float(parts[-1])
+                        send_message(client_sock, "set_priority")
+
+                    elif data.startswith("set_pass_filter"):
+                        # set_pass_filter <min max elevation> <elevation mask> [min seconds above mask], or set_pass_filter off
+                        parts = data.split(" ")
+                        if parts[1] == "off":
+                            self.pass_filter = None
+                        else:
+                            min_seconds = float(parts[3]) if len(parts) > 3 else 0.0
+                            self.pass_filter = scheduler.PassFilter(float(parts[1]), float(parts[2]), min_seconds)
+                        send_message(client_sock, "set_pass_filter")
+
+                    elif data.startswith("set_tracking_mode"):
+                        # set_tracking_mode <stream|upload>
+                        parts = data.split(" ")
+                        if parts[1] in ("stream", "upload"):
+                            self.tracking_mode = parts[1]
+                            send_message(client_sock, "set_tracking_mode")
+                        else:
+                            send_message(client_sock, f"Unknown tracking mode {parts[1]}")
+
+                    elif data.startswith("set_doppler"):
+                        # set_doppler <on|off> [signal bandwidth in Hz, 0 keeps the tuner bandwidth]
+                        parts = data.split(" ")
+                        self.doppler_correction = parts[1] == "on"
+                        if len(parts) > 2:
+                            self.signal_bandwidth = float(parts[2]) or None
+                        send_message(client_sock, "set_doppler")
+
+                    elif data.startswith("set_compression"):
+                        # set_compression <off|zstd|zlib> [level] [worker threads]
+                        parts = data.split(" ")
+                        if parts[1] in ("off", "zstd", "zlib"):
+                            self.compression = None if parts[1] == "off" else parts[1]
+                            self.compression_level = int(parts[2]) if len(parts) > 2 else None
+                            self.compression_workers = int(parts[3]) if len(parts) > 3 else COMPRESSION_WORKERS
+                            send_message(client_sock, "set_compression")
+                        else:
+                            send_message(client_sock, f"Unknown compression {parts[1]}")
+
+                    elif data.startswith("set_channelizer"):
+                        # set_channelizer <on|off> [channel bandwidth in Hz] [wideband on|off]
+                        parts = data.split(" ")
+                        self.channelizer = parts[1] == "on"
+                        if len(parts) > 2:
+                            self.channel_bandwidth = float(parts[2]) or DEFAULT_CHANNEL_BANDWIDTH
+                        if len(parts) > 3:
+                            self.record_wideband = parts[3] == "on"
+                        send_message(client_sock, "set_channelizer")
+
+                    elif data.startswith("set_segment_size"):
+                        # set_segment_size <MB>, 0 writes each pass to a single file
+                        parts = data.split(" ")
+                        self.segment_bytes = int(float(parts[1]) * 1024 * 1024)
+                        send_message(client_sock, "set_segment_size")
+
+                    elif data.startswith("set_sample_format"):
+                        # set_sample_format <CF32|CS16|CS8>
+                        parts = data.split(" ")
+                        if parts[1].upper() in SAMPLE_FORMATS:
+                            self.sample_format = parts[1].upper()
+                            send_message(client_sock, "set_sample_format")
+                        else:
+                            send_message(client_sock, f"Unknown sample format {parts[1]}")
+
                     # setViewingWindow
                     elif data.startswith("setViewingWindow"):
                         parts = data.split(" ")
@@ -550,7 +966,8 @@ class SatelliteTracker:
                     elif data.startswith("add_to_queue "):
                         lines = data.split('\n\n')
 
-                        self.satellites = scheduler.load_tle_from_string(lines[0].replace("add_to_queue ", ""))
+                        catalog = scheduler.load_tle_catalog(lines[0].replace("add_to_queue ", ""), cache_dir=DATA_BASE_DIR)
+                        satellites = catalog.satellites()
                         self.satellites_frequencies = parse_satellite_data(lines[1])
                         # start generating schedule once all meta data is set, the default time range is 8 hours
                         if self.start_time is None:
@@ -558,12 +975,40 @@ class SatelliteTracker:
                             uts_plus_five_hours = utc_now + timedelta(hours=8)
                             self.start_time = utc_now.astimezone(self.local_timezone)
                             self.end_time = uts_plus_five_hours.astimezone(self.local_timezone)
-                        new_schedule = self.create_schedule()
-                        send_message(client_sock, "Schedule updated")
+                        # The schedule is computed in the background, poll it with schedule_status
+                        self.update_schedule_in_background(satellites)
+                        send_message(client_sock, "Schedule update started" + rejected_tle_report(catalog))
+
+                    elif data.startswith("start_campaign"):
+                        # start_campaign [lookahead hours], followed by the TLEs and frequencies as in add_to_queue
+                        lines = data.split('\n\n')
+                        header, tle_string = lines[0].split("\n", 1)
+                        parts = header.split()
+                        lookahead_hours = float(parts[1]) if len(parts) > 1 else CAMPAIGN_LOOKAHEAD_HOURS
+                        catalog = scheduler.load_tle_catalog(tle_string, cache_dir=DATA_BASE_DIR)
+                        self.start_campaign(catalog.satellites(), parse_satellite_data(lines[1]), lookahead_hours)
+                        send_message(client_sock, "Campaign started" + rejected_tle_report(catalog))
+
+                    elif data.startswith("stop_campaign"):
+                        self.stop_campaign()
+                        send_message(client_sock, "Campaign stopped")
+
+                    elif data.startswith("probe_disk"):
+                        # The result is reported by getMeta once the probe is done
+                        if self.start_disk_probe():
+                            send_message(client_sock, "Disk probe started")
+                        else:
+                            send_message(client_sock, "Recording or disk probe in progress, not probing the disk")
+
+                    elif data.startswith("recording_status"):
+                        status = {"is_recording": self.recording, "stats": self.recorder.stats.snapshot() if self.recorder else None}
+                        send_message(client_sock, pickle.dumps(status), is_binary=True)
+
+                    elif data.startswith("schedule_status"):
+                        send_message(client_sock, f"Schedule {self.schedule_status}")
 
                     elif data.startswith("clear_schedule"):
-                        with self.schedule.mutex:  # Acquire the lock before clearing
-                            self.schedule.queue.clear()  # Clear all items from the queue
+                        self.schedule.clear()
                         send_message(client_sock, "Schedule cleared")
 
 
@@ -571,10 +1016,10 @@ class SatelliteTracker:
                         directory_files = '\n'.join(list_files(DATA_BASE_DIR))
 
                         # Exclude the last column from each row in self.schedule and self.already_processed_satellites
-                        modified_schedule = [row[:-1] for row in list(self.schedule.queue)]
+                        modified_schedule = [row[:-1] for row in self.schedule.to_list()]
                         modified_processed_satellites = [row[:-1] for row in self.already_processed_satellites]
 
-                        meta_data = {"used_space" : get_size_of_directory(DATA_BASE_DIR), "is_recording" :self.recording,"directory" :DATA_BASE_DIR, "current_time": datetime.utcnow(), "data": directory_files, "schedule": modified_schedule, "processed_schedule": modified_processed_satellites, "tracking": not self.stop_signal}
+                        meta_data = {"used_space" : get_size_of_directory(DATA_BASE_DIR), "is_recording" :self.recording,"directory" :DATA_BASE_DIR, "current_time": datetime.utcnow(), "data": directory_files, "schedule": modified_schedule, "processed_schedule": modified_processed_satellites, "tracking": not self.stop_signal, "pass_cache": self.pass_cache.get_stats(), "schedule_mode": self.schedule_mode, "schedule_report": self.schedule_report, "pass_filter": self.pass_filter._asdict() if self.pass_filter else None, "rotator": self.rotator.latency_stats() if self.rotator else None, "pointing": self.pointing_report, "tracking_mode": self.tracking_mode, "doppler_correction": self.doppler_correction, "signal_bandwidth": self.signal_bandwidth, "sample_format": self.sample_format, "segment_bytes": self.segment_bytes, "disk_probe": self.disk_probe, "disk_probe_status": self.disk_probe_status, "compression": {"codec": self.compression, "level": self.compression_level, "workers": self.compression_workers, "last": self.compression_stats}, "channelizer": {"enabled": self.channelizer, "channel_bandwidth": self.channel_bandwidth, "record_wideband": self.record_wideband, "extractor_throughput": self.extractor_throughput[1] if self.extractor_throughput else None}, "schedule_status": self.schedule_status, "campaign": self.campaign_thread is not None}
 
                         serialized_data = pickle.dumps(meta_data)
                         send_message(client_sock, serialized_data, is_binary=True)
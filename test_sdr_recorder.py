@@ -0,0 +1,23 @@
+import threading
+import time
+
+import sdr_recorder
+from sdr_backends import SyntheticDevice
+from sdr_recorder import SDRRecorder
+
+
+def test_recording_ends_when_a_consumer_dies(tmp_path, monkeypatch):
+    # The consumer dies on its first write and never hands a buffer back to the producer
+    monkeypatch.setattr(sdr_recorder, "READ_GRACE_SECONDS", 0.5)
+    recorder = SDRRecorder(SyntheticDevice(), 1.6e6, sat_name="Test", directory=str(tmp_path), sample_rate=2e6)
+
+    def failing_write(*args):
+        raise OSError("disk gone")
+    monkeypatch.setattr(recorder.stats, "add_write", failing_write)
+    monkeypatch.setattr(threading, "excepthook", lambda args: None)
+
+    start = time.monotonic()
+    recorder.start_recording(0, 3)
+    recorder.stop_recording()
+    assert time.monotonic() - start < 10
+    assert all(not thread.is_alive() for thread in recorder.producer_threads + recorder.consumer_threads)
@@ -0,0 +1,179 @@
+import glob
+import hashlib
+import logging
+import os
+import numpy as np
+from skyfield.api import load, EarthSatellite
+
+
+# On-disk form of a parsed catalog: fixed-width records that numpy loads without any parsing. Dropped
+# TLEs are kept as records with the reason they were dropped and no lines, so a cached catalog still
+# reports them
+CATALOG_DTYPE = np.dtype([("norad", "U5"), ("epoch", "f8"), ("name", "U64"), ("line1", "S69"), ("line2", "S69"), ("rejected", "U48")])
+
+
+# Byte -> checksum value: digits count as themselves, minus signs ("-") as 1, everything else as 0
+CHECKSUM_TABLE = bytes(b - 48 if 48 <= b <= 57 else 1 if b == 45 else 0 for b in range(256))
+
+logger = logging.getLogger(__name__)
+
+
+def tle_checksum(line):
+    # Modulo 10 sum of the first 68 columns
+    return sum(line[:68].encode("ascii", "replace").translate(CHECKSUM_TABLE)) % 10
+
+
+def tle_epoch(line1):
+    # Epoch from columns 19-32 (YYDDD.DDDDDDDD) as year * 1000 + day of year, which sorts by time
+    two_digit_year = int(line1[18:20])
+    year = two_digit_year + (2000 if two_digit_year < 57 else 1900)
+    return year * 1000 + float(line1[20:32])
+
+
+def is_valid_tle(line1, line2):
+    return (len(line1) >= 69 and len(line2) >= 69 and line1[0] == "1" and line2[0] == "2"
+            and line1[2:7] == line2[2:7]
+            and tle_checksum(line1) == int(line1[68]) and tle_checksum(line2) == int(line2[68]))
+
+
+class TLECatalog:
+    """TLE catalog indexed by name and NORAD ID, keeping only the newest epoch of each object.
+
+    Parses 3LE and 2LE text in one pass. EarthSatellite objects are only built when asked for, all
+    with the same timescale.
+    """
+
+    def __init__(self, ts=None):
+        self.ts = ts if ts is not None else load.timescale()
+        self.records = {}
+        self.names = {}
+        self.satellite_objects = {}
+        # (name, NORAD ID, reason) of every TLE that was dropped
+        self.rejected = []
+
+    def __len__(self):
+        return len(self.records)
+
+    def reject(self, name, norad, reason):
+        self.rejected.append((name, norad, reason))
+        logger.warning(f"Dropped TLE {name} ({norad}): {reason}")
+
+    def add(self, name, line1, line2):
+        norad = line1[2:7].strip().zfill(5)
+        epoch = tle_epoch(line1)
+        current = self.records.get(norad)
+        name = name or norad
+        if current is not None and current[1] >= epoch:
+            self.reject(name, norad, "duplicate of the same epoch" if current[1] == epoch else f"older than {current[0]}")
+            return False
+        if current is not None:
+            self.reject(current[0], norad, f"superseded by {name}")
+            self.names.pop(current[0], None)
+            self.satellite_objects.pop(norad, None)
+        self.records[norad] = (name, epoch, line1, line2)
+        self.names[name] = norad
+        return True
+
+    def add_text(self, text):
+        # Single pass over the lines: a TLE pair is a "1 " line directly followed by a "2 " line, and
+        # the line before it (if it isn't part of another TLE) is the name, with any "0 " prefix removed
+        lines = [line.rstrip() for line in text.splitlines()]
+        name = None
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            if line.startswith("1 ") and i + 1 < len(lines) and lines[i + 1].startswith("2 "):
+                if is_valid_tle(line, lines[i + 1]):
+                    self.add(name, line[:69], lines[i + 1][:69])
+                else:
+                    self.reject(name or line[2:7].strip(), line[2:7].strip(), "bad checksum or format")
+                name = None
+                i += 2
+                continue
+            if line.strip():
+                name = line[2:].strip() if line.startswith("0 ") else line.strip()
+            i += 1
+        return self
+
+    @classmethod
+    def from_string(cls, text, ts=None, cache_dir=None):
+        """Parse TLE text, reusing the binary copy in cache_dir saved the last time the same text was loaded."""
+        if cache_dir is None:
+            return cls(ts).add_text(text)
+        cache_path = os.path.join(cache_dir, f"tle_catalog_{hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]}.npy")
+        if os.path.isfile(cache_path):
+            try:
+                return cls.load(cache_path, ts)
+            except Exception as e:
+                logger.warning(f"Could not load TLE catalog cache {cache_path}: {e}")
+        catalog = cls(ts).add_text(text)
+        # Only the copy of the latest text is kept
+        for old_path in glob.glob(os.path.join(cache_dir, "tle_catalog_*.npy")):
+            if old_path != cache_path:
+                os.remove(old_path)
+        catalog.save(cache_path)
+        return catalog
+
+    @classmethod
+    def from_file(cls, path, ts=None, cache_path=None):
+        """Load a TLE file, reusing the binary cache_path copy when it is newer than the file."""
+        if cache_path is not None and os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            try:
+                return cls.load(cache_path, ts)
+            except Exception as e:
+                logger.warning(f"Could not load TLE catalog cache {cache_path}: {e}")
+        with open(path, "r") as f:
+            catalog = cls.from_string(f.read(), ts)
+        if cache_path is not None:
+            catalog.save(cache_path)
+        return catalog
+
+    def save(self, path):
+        records = np.array([(norad, epoch, name, line1, line2, "") for norad, (name, epoch, line1, line2) in self.records.items()]
+                           + [(norad, 0.0, name, b"", b"", reason) for name, norad, reason in self.rejected], dtype=CATALOG_DTYPE)
+        # np.save appends .npy to names without it, write through a file object to keep the name as given
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, records, allow_pickle=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, ts=None):
+        catalog = cls(ts)
+        records = np.load(path, allow_pickle=False)
+        for norad, epoch, name, line1, line2, rejected in zip(records["norad"].tolist(), records["epoch"].tolist(), records["name"].tolist(),
+                                                              records["line1"].tolist(), records["line2"].tolist(), records["rejected"].tolist()):
+            if rejected:
+                catalog.rejected.append((name, norad, rejected))
+                continue
+            catalog.records[norad] = (name, epoch, line1.decode("ascii"), line2.decode("ascii"))
+            catalog.names[name] = norad
+        return catalog
+
+    def _satellite(self, norad):
+        satellite = self.satellite_objects.get(norad)
+        if satellite is None:
+            name, _, line1, line2 = self.records[norad]
+            satellite = EarthSatellite(line1, line2, name, self.ts)
+            self.satellite_objects[norad] = satellite
+        return satellite
+
+    def _norad(self, key):
+        if isinstance(key, str) and key in self.names:
+            return self.names[key]
+        return str(key).strip().zfill(5)
+
+    def get(self, key):
+        """Satellite by name or NORAD ID (int or string), None if not in the catalog."""
+        norad = self._norad(key)
+        if norad not in self.records:
+            return None
+        return self._satellite(norad)
+
+    def tle_lines(self, key):
+        record = self.records.get(self._norad(key))
+        return None if record is None else (record[2], record[3])
+
+    def satellites(self):
+        """All satellites, in the order they were first added."""
+        return [self._satellite(norad) for norad in self.records]
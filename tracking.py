@@ -0,0 +1,114 @@
+import logging
+import time
+
+import numpy as np
+
+import trajectory
+
+
+# Tracking loop period
+TRACKING_TICK_SECONDS = 0.1
+# A new target goes out when the mount is this many degrees off it on either axis
+POINTING_THRESHOLD_DEGREES = 1
+# In upload mode the controller's clock is re-synced this often
+TRAJECTORY_SYNC_SECONDS = 30
+# In upload mode the path goes out this long before AOS. A full frame of waypoints takes several seconds
+# at 9600 baud, up to rotator.TRAJECTORY_TIMEOUT_SECONDS, and must not eat into the pass
+TRAJECTORY_UPLOAD_LEAD_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+
+def track_pass(rotator, pass_trajectory, end_timestamp, keep_tracking=lambda: True, tick_seconds=TRACKING_TICK_SECONDS):
+    """Point the rotator along pass_trajectory (mount coordinates) until end_timestamp or keep_tracking() is False.
+
+    rotator is a rotator.RotatorWorker, or None to run the loop without a mount. Returns the pointing
+    report of the pass: moves, corrective moves, pointing error while the mount is at rest and the
+    loop jitter (how late each tick started).
+    """
+    previous_azimuth, previous_elevation = None, None
+    pointing_errors = []
+    tick_times = []
+    moves = 0
+    # Moves that completed more than 1 degree off the satellite, each one needs another move to correct it
+    corrective_moves = 0
+    last_move = rotator.last_move if rotator is not None else None
+
+    while time.time() < end_timestamp and keep_tracking():
+        now = time.time()
+        tick_times.append(now)
+        # New targets only go out once the mount has finished its move, so each one is planned from
+        # where the mount actually is
+        if rotator is not None and not rotator.is_idle():
+            time.sleep(tick_seconds)
+            continue
+        if rotator is not None and rotator.last_move is not last_move:
+            last_move = rotator.last_move
+            if trajectory.angular_separation(last_move[0], last_move[1], *pass_trajectory.at(last_move[2])) > POINTING_THRESHOLD_DEGREES:
+                corrective_moves += 1
+        if rotator is not None and rotator.last_position is not None:
+            previous_azimuth, previous_elevation = rotator.last_position
+        if previous_azimuth is not None:
+            pointing_errors.append(trajectory.angular_separation(previous_azimuth, previous_elevation, *pass_trajectory.at(now)))
+
+        # Aim where the satellite will be when the move completes, using the mount's measured response
+        if rotator is not None:
+            start = None if previous_azimuth is None else (previous_azimuth, previous_elevation)
+            (azimuth, elevation), _ = pass_trajectory.lead(now, lambda target: rotator.response_model.predict(start, target))
+        else:
+            azimuth, elevation = pass_trajectory.at(now)
+
+        # Check if this is the first iteration or if the difference in angle is greater than 1 degree
+        if previous_azimuth is None or abs(azimuth - previous_azimuth) > POINTING_THRESHOLD_DEGREES or abs(elevation - previous_elevation) > POINTING_THRESHOLD_DEGREES:
+            if 0 <= azimuth <= trajectory.MOUNT_MAX_AZIMUTH and 0 <= elevation <= trajectory.MOUNT_MAX_ELEVATION:
+                if rotator is not None:
+                    rotator.point(azimuth, elevation)
+                moves += 1
+                logger.info(f"Pointing to az= {azimuth}, el= {elevation}")
+                previous_azimuth, previous_elevation = azimuth, elevation
+            else:
+                logger.warning(f"Waiting on az el to be above the horizon. az= {azimuth}, el= {elevation}")
+
+        time.sleep(tick_seconds)
+
+    # Pointing error is sampled while the mount is at rest between moves
+    lateness = np.diff(tick_times) - tick_seconds if len(tick_times) > 1 else np.zeros(0)
+    return {"moves": moves, "corrective_moves": corrective_moves,
+            "mean_error": float(np.mean(pointing_errors)) if pointing_errors else None,
+            "max_error": float(np.max(pointing_errors)) if pointing_errors else None,
+            "tick_jitter_mean": float(np.mean(lateness)) if len(lateness) else None,
+            "tick_jitter_max": float(np.max(lateness)) if len(lateness) else None}
+
+
+def follow_uploaded_pass(rotator, pass_trajectory, end_timestamp, keep_tracking=lambda: True, sync_seconds=TRAJECTORY_SYNC_SECONDS, uploaded=False):
+    """Let the controller follow pass_trajectory (mount coordinates) on its own clock.
+
+    The path is normally uploaded ahead of AOS (uploaded=True) and only started here, otherwise it is
+    uploaded first. The host only re-syncs the clock every sync_seconds and collects the controller's
+    STATUS reports. Returns the pointing report, or None if the controller did not accept the upload
+    (older firmware), in which case the caller should fall back to track_pass.
+    """
+    if not uploaded and not rotator.upload_trajectory(pass_trajectory):
+        logger.warning("Trajectory upload was not accepted")
+        return None
+    rotator.status_reports.clear()
+    rotator.start_trajectory(pass_trajectory.start)
+    syncs = 1
+    last_sync = time.time()
+    while time.time() < end_timestamp and keep_tracking() and rotator.following:
+        if time.time() - last_sync >= sync_seconds:
+            rotator.start_trajectory(pass_trajectory.start)
+            syncs += 1
+            last_sync = time.time()
+        time.sleep(TRACKING_TICK_SECONDS)
+    if rotator.following:
+        rotator.stop_trajectory()
+
+    # Pointing error from the positions the controller reported against the path at the same time
+    reports = list(rotator.status_reports)
+    pointing_errors = [trajectory.angular_separation(azimuth, elevation, *pass_trajectory.at(pass_trajectory.start + elapsed_ms / 1000))
+                       for elapsed_ms, azimuth, elevation in reports]
+    return {"moves": 0, "corrective_moves": 0, "syncs": syncs, "status_reports": len(reports),
+            "mean_error": float(np.mean(pointing_errors)) if pointing_errors else None,
+            "max_error": float(np.max(pointing_errors)) if pointing_errors else None,
+            "tick_jitter_mean": None, "tick_jitter_max": None}
@@ -0,0 +1,186 @@
+import numpy as np
+import scheduler
+from collections import OrderedDict
+from datetime import timedelta
+from rotator import ResponseModel
+
+
+# Sampling step of precomputed pass trajectories, positions in between are interpolated
+TRAJECTORY_STEP_SECONDS = 1.0
+# Fixed point iterations when solving for where the satellite is once a move completes
+LEAD_ITERATIONS = 3
+# Mount travel: azimuth runs past north up to 450 degrees, elevation over the zenith up to 180
+MOUNT_MAX_AZIMUTH = 450.0
+MOUNT_MAX_ELEVATION = 180.0
+# Coarser sampling is enough for the pass end points the schedulers need
+SLEW_PLAN_STEP_SECONDS = 10.0
+# Pass trajectories a slew_break keeps, the least recently used go first. The schedulers compare
+# neighbouring passes, so this only needs to cover the windows being planned at once
+SLEW_CACHE_ENTRIES = 512
+
+
+def angular_separation(azimuth1, elevation1, azimuth2, elevation2):
+    """Angle in degrees between two azimuth/elevation directions."""
+    azimuth1, elevation1, azimuth2, elevation2 = np.radians((azimuth1, elevation1, azimuth2, elevation2))
+    cos_angle = np.sin(elevation1) * np.sin(elevation2) + np.cos(elevation1) * np.cos(elevation2) * np.cos(azimuth1 - azimuth2)
+    return float(np.degrees(np.arccos(np.clip(cos_angle, -1.0, 1.0))))
+
+
+class PassTrajectory:
+    """Azimuth/elevation of one pass sampled on a fixed time grid (unix timestamps)."""
+
+    def __init__(self, times, azimuths, elevations):
+        self.times = np.asarray(times, dtype=float)
+        # Interpolate on the unwrapped azimuth so a pass through north does not sweep back through 180
+        self.unwrapped_azimuths = np.degrees(np.unwrap(np.radians(azimuths)))
+        self.elevations = np.asarray(elevations, dtype=float)
+
+    @property
+    def start(self):
+        return self.times[0]
+
+    @property
+    def end(self):
+        return self.times[-1]
+
+    def at(self, timestamp):
+        """Azimuth and elevation in degrees at a unix timestamp, clamped to the ends of the pass."""
+        azimuth = np.interp(timestamp, self.times, self.unwrapped_azimuths) % 360
+        elevation = np.interp(timestamp, self.times, self.elevations)
+        return float(azimuth), float(elevation)
+
+    def lead(self, timestamp, move_seconds, iterations=LEAD_ITERATIONS):
+        """Where the satellite will be when a move commanded at timestamp completes, and when that is.
+
+        move_seconds(position) is the predicted duration of a move to position. The move duration
+        depends on the target and the target on the duration, a few iterations settle both.
+        """
+        arrival = timestamp
+        position = self.at(timestamp)
+        for _ in range(iterations):
+            arrival = timestamp + move_seconds(position)
+            position = self.at(arrival)
+        return position, arrival
+
+
+class MountTrajectory(PassTrajectory):
+    """Pass path in mount coordinates: azimuth 0-450 without wrapping, elevation 0-180 past the zenith."""
+
+    def __init__(self, times, azimuths, elevations, strategy):
+        self.times = np.asarray(times, dtype=float)
+        self.unwrapped_azimuths = np.asarray(azimuths, dtype=float)
+        self.elevations = np.asarray(elevations, dtype=float)
+        self.strategy = strategy
+
+    def at(self, timestamp):
+        azimuth = np.interp(timestamp, self.times, self.unwrapped_azimuths)
+        elevation = np.interp(timestamp, self.times, self.elevations)
+        return float(azimuth), float(elevation)
+
+    def start_position(self):
+        return float(self.unwrapped_azimuths[0]), float(self.elevations[0])
+
+    def end_position(self):
+        return float(self.unwrapped_azimuths[-1]), float(self.elevations[-1])
+
+    def travel_seconds(self, model):
+        """Time the mount spends moving along the path at the model's slew rates."""
+        return float(np.abs(np.diff(self.unwrapped_azimuths)).sum() / model.azimuth_rate
+                     + np.abs(np.diff(self.elevations)).sum() / model.elevation_rate)
+
+
+def plan_mount_trajectory(pass_trajectory, start_position=None, model=None):
+    """Mount path for a pass that needs the least rotator time, including the slew from start_position.
+
+    A direction can be reached normally or flipped (azimuth + 180, elevation 180 - elevation). The
+    candidates are the pass all normal, all flipped, or switching between the two at culmination, which
+    avoids the fast azimuth swing of high passes. Each is shifted by whole turns to fit 0-450. If none
+    fits, the azimuth is wrapped to 0-360 and the mount slews across the gap mid-pass.
+    """
+    model = model or ResponseModel()
+    azimuths = pass_trajectory.unwrapped_azimuths
+    elevations = pass_trajectory.elevations
+    after_culmination = np.arange(len(elevations)) >= int(np.argmax(elevations))
+    candidates = []
+    for strategy, flipped in (("normal", np.zeros(len(elevations), dtype=bool)), ("flipped", np.ones(len(elevations), dtype=bool)),
+                              ("flip_after_culmination", after_culmination), ("flip_before_culmination", ~after_culmination)):
+        mount_azimuths = np.degrees(np.unwrap(np.radians(azimuths + 180.0 * flipped)))
+        # Rise and set are found to within a second, so the end points can be a hair below the horizon
+        mount_elevations = np.clip(np.where(flipped, 180.0 - elevations, elevations), 0.0, MOUNT_MAX_ELEVATION)
+        # Whole turns that bring the path into 0-450
+        lowest_turn = int(np.ceil(-mount_azimuths.min() / 360.0))
+        for turn in range(lowest_turn, lowest_turn + 2):
+            shifted = mount_azimuths + 360.0 * turn
+            if shifted.min() >= 0 and shifted.max() <= MOUNT_MAX_AZIMUTH:
+                candidates.append(MountTrajectory(pass_trajectory.times, shifted, mount_elevations, strategy))
+    if not candidates:
+        candidates.append(MountTrajectory(pass_trajectory.times, azimuths % 360.0, np.clip(elevations, 0.0, MOUNT_MAX_ELEVATION), "wrapped"))
+
+    return min(candidates, key=lambda path: model.predict(start_position, path.start_position()) + path.travel_seconds(model))
+
+
+def make_slew_break(observer_location, model=None, max_entries=SLEW_CACHE_ENTRIES):
+    """required_break(previous, following) for the schedulers: the time the mount needs to get from the
+    end of the previous pass to the start of the following one, each planned as the tracker would.
+
+    Pass trajectories are cached, at most max_entries of them, so a slew_break kept for a whole
+    campaign stays the same size however many windows it sees."""
+    model = model or ResponseModel()
+    trajectories = OrderedDict()
+
+    def pass_trajectory(item):
+        name, rise_time, set_time, satellite = item
+        key = (name, rise_time)
+        if key in trajectories:
+            trajectories.move_to_end(key)
+            return trajectories[key]
+        trajectories[key] = compute_pass_trajectory(satellite, observer_location, rise_time, set_time, SLEW_PLAN_STEP_SECONDS)
+        while len(trajectories) > max_entries:
+            trajectories.popitem(last=False)
+        return trajectories[key]
+
+    def slew_break(previous, following):
+        end_position = plan_mount_trajectory(pass_trajectory(previous), model=model).end_position()
+        following_path = plan_mount_trajectory(pass_trajectory(following), end_position, model)
+        return timedelta(seconds=model.predict(end_position, following_path.start_position()))
+
+    return slew_break
+
+
+def compute_pass_trajectory(satellite, observer_location, start_time, end_time, step_seconds=TRAJECTORY_STEP_SECONDS):
+    # Whole pass ephemeris in one vectorized SGP4 call, done once at AOS instead of every tracking tick
+    start = start_time.timestamp()
+    end = end_time.timestamp()
+    times = np.append(np.arange(start, end, step_seconds), end)
+    azimuths, elevations = scheduler.get_azimuth_elevation_array(satellite, observer_location, times)
+    return PassTrajectory(times, azimuths, elevations)
+
+
+class DopplerProfile:
+    """Doppler shift in Hz of one pass and downlink frequency sampled on a fixed time grid (unix timestamps)."""
+
+    def __init__(self, frequency, times, shifts):
+        self.frequency = frequency
+        self.times = np.asarray(times, dtype=float)
+        self.shifts = np.asarray(shifts, dtype=float)
+
+    def at(self, timestamp):
+        """Doppler shift at a unix timestamp, clamped to the ends of the pass."""
+        return float(np.interp(timestamp, self.times, self.shifts))
+
+    def span(self):
+        """Lowest and highest shift over the pass."""
+        return float(self.shifts.min()), float(self.shifts.max())
+
+    def max_drift(self, seconds):
+        """Largest change of the shift over any interval of the given length."""
+        rate = np.abs(np.diff(self.shifts) / np.diff(self.times)).max() if len(self.times) > 1 else 0.0
+        return float(rate * seconds)
+
+
+def compute_doppler_profile(satellite, observer_location, start_time, end_time, frequency, step_seconds=TRAJECTORY_STEP_SECONDS):
+    start = start_time.timestamp()
+    end = end_time.timestamp()
+    times = np.append(np.arange(start, end, step_seconds), end)
+    shifts = scheduler.get_doppler_shift_array(satellite, observer_location, times, frequency)
+    return DopplerProfile(frequency, times, shifts)